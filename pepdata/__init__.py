@@ -1,3 +1,5 @@
+import importlib
+
 from .amino_acid_alphabet import (
     AminoAcid,
     canonical_amino_acids,
@@ -7,11 +9,28 @@ from .amino_acid_alphabet import (
     amino_acid_letter_indices,
     amino_acid_name_indices,
 )
-from .peptide_vectorizer import PeptideVectorizer
+from .encoded_peptides import EncodedPeptides, encode_peptides
 from .version import __version__
-from . import iedb
 
+# loaded on first access, so that importing pepdata doesn't import
+# pandas (pepdata.iedb) or scikit-learn (PeptideVectorizer)
+_lazy_submodules = {"iedb"}
+_lazy_attributes = {
+    "PeptideVectorizer": ".peptide_vectorizer",
+}
+
+def __getattr__(name):
+    if name in _lazy_submodules:
+        return importlib.import_module("." + name, __name__)
+    if name in _lazy_attributes:
+        module = importlib.import_module(_lazy_attributes[name], __name__)
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
+def __dir__():
+    return sorted(list(globals()) + list(_lazy_submodules) + list(_lazy_attributes))
 
 __all__ = [
     "iedb",
@@ -22,5 +41,7 @@ __all__ = [
     "extended_amino_acid_letters",
     "amino_acid_letter_indices",
     "amino_acid_name_indices",
+    "EncodedPeptides",
+    "encode_peptides",
     "PeptideVectorizer",
 ]
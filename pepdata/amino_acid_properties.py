@@ -10,7 +10,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from .amino_acid_alphabet import letter_to_index
+from . import matrix_bundle
+from .amino_acid_alphabet import canonical_amino_acid_letters, letter_to_index
 
 """
 Quantify amino acids by their physical/chemical properties
@@ -47,7 +48,12 @@ def parse_property_table(table_string):
 Amino acids property tables copied from CRASP website
 """
 
-hydropathy = parse_property_table("""
+# the dictionaries of these tables (e.g. hydropathy) are read from
+# pepdata.matrix_bundle on first access, which parses the tables once
+# when it builds the bundle
+property_tables = {}
+
+property_tables["hydropathy"] = """
 1.80000 A ALA
 -4.5000 R ARG
 -3.5000 N ASN
@@ -68,9 +74,9 @@ hydropathy = parse_property_table("""
 -0.9000 W TRP
 -1.3000 Y TYR
 4.20000 V VAL
-""")
+"""
 
-volume = parse_property_table("""
+property_tables["volume"] = """
 91.5000 A ALA
 202.0000 R ARG
 135.2000 N ASN
@@ -91,9 +97,9 @@ volume = parse_property_table("""
 237.6000 W TRP
 203.6000 Y TYR
 141.7000 V VAL
-""")
+"""
 
-polarity = parse_property_table("""
+property_tables["polarity"] = """
 0.0000 A ALA
 52.000 R ARG
 3.3800 N ASN
@@ -114,9 +120,9 @@ polarity = parse_property_table("""
 2.1000 W TRP
 1.6100 Y TYR
 0.1300 V VAL
-""")
+"""
 
-pK_side_chain = parse_property_table("""
+property_tables["pK_side_chain"] = """
 0.0000 A ALA
 12.480 R ARG
 0.0000 N ASN
@@ -137,9 +143,9 @@ pK_side_chain = parse_property_table("""
 0.0000 W TRP
 10.700 Y TYR
 0.0000 V VAL
-""")
+"""
 
-prct_exposed_residues = parse_property_table("""
+property_tables["prct_exposed_residues"] = """
 15.0000 A ALA
 67.0000 R ARG
 49.0000 N ASN
@@ -160,9 +166,9 @@ prct_exposed_residues = parse_property_table("""
 17.0000 W TRP
 41.0000 Y TYR
 14.0000 V VAL
-""")
+"""
 
-hydrophilicity = parse_property_table("""
+property_tables["hydrophilicity"] = """
 -0.5000 A ALA
 3.00000 R ARG
 0.20000 N ASN
@@ -183,9 +189,9 @@ hydrophilicity = parse_property_table("""
 -3.4000 W TRP
 -2.3000 Y TYR
 -1.5000 V VAL
-""")
+"""
 
-accessible_surface_area = parse_property_table("""
+property_tables["accessible_surface_area"] = """
 27.8000 A ALA
 94.7000 R ARG
 60.1000 N ASN
@@ -206,9 +212,9 @@ accessible_surface_area = parse_property_table("""
 34.7000 W TRP
 55.2000 Y TYR
 23.7000 V VAL
-""")
+"""
 
-local_flexibility = parse_property_table("""
+property_tables["local_flexibility"] = """
 705.42000 A ALA
 1484.2800 R ARG
 513.46010 N ASN
@@ -229,9 +235,9 @@ local_flexibility = parse_property_table("""
 6374.0698 W TRP
 4291.1001 Y TYR
 4474.4199 V VAL
-""")
+"""
 
-accessible_surface_area_folded = parse_property_table("""
+property_tables["accessible_surface_area_folded"] = """
 31.5000 A ALA
 93.8000 R ARG
 62.2000 N ASN
@@ -252,9 +258,9 @@ accessible_surface_area_folded = parse_property_table("""
 41.7000 W TRP
 59.1000 Y TYR
 23.5000 V VAL
-""")
+"""
 
-refractivity = parse_property_table("""
+property_tables["refractivity"] = """
 4.34000 A ALA
 26.6600 R ARG
 13.2800 N ASN
@@ -275,10 +281,10 @@ refractivity = parse_property_table("""
 42.5300 W TRP
 31.5300 Y TYR
 13.9200 V VAL
-""")
+"""
 
 
-mass = parse_property_table("""
+property_tables["mass"] = """
 70.079 A ALA
 156.188 R ARG
 114.104 N ASN
@@ -299,7 +305,7 @@ mass = parse_property_table("""
 186.213 W TRP
 163.170 Y TYR
 99.133 V VAL
-""")
+"""
 
 ###
 # Values copied from:
@@ -355,3 +361,13 @@ solvent_exposed_area = dict(
     R=0.84,
     H=0.66,
 )
+
+def __getattr__(attr):
+    if attr in property_tables:
+        values = matrix_bundle.get_array("property/" + attr).tolist()
+        globals()[attr] = dict(zip(canonical_amino_acid_letters, values))
+        return globals()[attr]
+    raise AttributeError("module %r has no attribute %r" % (__name__, attr))
+
+def __dir__():
+    return sorted(list(globals()) + list(property_tables))
@@ -14,7 +14,7 @@ from os.path import join
 
 from .static_data import MATRIX_DIR
 
-from .amino_acid_alphabet import dict_to_amino_acid_matrix
+from . import matrix_bundle
 
 def parse_blosum_table(table, coeff_type=int, key_type='row'):
     """
@@ -59,15 +59,31 @@ def parse_blosum_table(table, coeff_type=int, key_type='row'):
     return coeffs
 
 
-with open(join(MATRIX_DIR, 'BLOSUM30'), 'r') as f:
-    blosum30_dict = parse_blosum_table(f.read())
-    blosum30_matrix = dict_to_amino_acid_matrix(blosum30_dict)
+# dictionaries are parsed on first access of e.g. blosum62_dict, matrices
+# are read from pepdata.matrix_bundle on first access of e.g. blosum62_matrix
+_blosum_filenames = {
+    "blosum30": "BLOSUM30",
+    "blosum50": "BLOSUM50",
+    "blosum62": "BLOSUM62",
+}
 
-with open(join(MATRIX_DIR, 'BLOSUM50'), 'r') as f:
-    blosum50_dict = parse_blosum_table(f.read())
-    blosum50_matrix = dict_to_amino_acid_matrix(blosum50_dict)
+def _load_dict(name):
+    with open(join(MATRIX_DIR, _blosum_filenames[name]), 'r') as f:
+        globals()[name + "_dict"] = parse_blosum_table(f.read())
 
-with open(join(MATRIX_DIR, 'BLOSUM62'), 'r') as f:
-    blosum62_dict = parse_blosum_table(f.read())
-    blosum62_matrix = dict_to_amino_acid_matrix(blosum62_dict)
+def __getattr__(attr):
+    name, _, suffix = attr.rpartition("_")
+    if name in _blosum_filenames and suffix == "dict":
+        _load_dict(name)
+        return globals()[attr]
+    if name in _blosum_filenames and suffix == "matrix":
+        globals()[attr] = matrix_bundle.get_array(name)
+        return globals()[attr]
+    raise AttributeError("module %r has no attribute %r" % (__name__, attr))
 
+def __dir__():
+    return sorted(list(globals()) + [
+        name + suffix
+        for name in _blosum_filenames
+        for suffix in ("_dict", "_matrix")
+    ])
@@ -10,6 +10,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from . import matrix_bundle
 from .amino_acid_alphabet import amino_acid_name_indices
 
 # Chou-Fasman of structural properties from
@@ -68,5 +69,16 @@ def parse_chou_fasman(table):
     assert len(turn_score_dict) == 20
     return alpha_helix_score_dict, beta_sheet_score_dict, turn_score_dict
 
-alpha_helix_score, beta_sheet_score, turn_score = \
-    parse_chou_fasman(chou_fasman_table)
+# alpha_helix_score, beta_sheet_score and turn_score are read from
+# pepdata.matrix_bundle on first access rather than parsed on import
+_score_names = ("alpha_helix_score", "beta_sheet_score", "turn_score")
+
+def __getattr__(attr):
+    if attr in _score_names:
+        values = matrix_bundle.get_array("property/" + attr).tolist()
+        globals()[attr] = {i: int(value) for (i, value) in enumerate(values)}
+        return globals()[attr]
+    raise AttributeError("module %r has no attribute %r" % (__name__, attr))
+
+def __dir__():
+    return sorted(list(globals()) + list(_score_names))
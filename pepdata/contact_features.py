@@ -0,0 +1,149 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Featurize batches of peptides by the residue contact energies of
+pepdata.residue_contact_energies, summed over adjacent residues or over
+all pairs of residues (in sequence order) of each peptide.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+
+from . import residue_contact_energies
+from .encoded_peptides import PADDING_INDEX, as_canonical_encoding
+
+contact_matrix_names = [
+    "strand_vs_coil",
+    "coil_vs_strand",
+    "helix_vs_strand",
+    "strand_vs_helix",
+    "helix_vs_coil",
+    "coil_vs_helix",
+]
+
+def contact_matrix(name : str):
+    """
+    20x20 array of pepdata.residue_contact_energies, e.g. contact_matrix(
+    "strand_vs_coil") is strand_vs_coil_array.
+    """
+    if name not in contact_matrix_names:
+        raise ValueError(
+            "Unknown contact matrix '%s', expected one of %s" % (
+                name, contact_matrix_names))
+    return getattr(residue_contact_energies, name + "_array")
+
+PAIRINGS = ("adjacent", "all_pairs")
+
+DEFAULT_CHUNK_SIZE = 16384
+
+def _padded(matrix, padding_value, dtype):
+    """
+    Extend a 20x20 matrix to every possible index, so that pairs with
+    a padding position gather padding_value.
+    """
+    table = np.full((PADDING_INDEX + 1, PADDING_INDEX + 1), padding_value, dtype=dtype)
+    table[:20, :20] = matrix
+    return table
+
+def _adjacent_energies(indices, table):
+    return table[indices[:, :-1], indices[:, 1:]].sum(axis=1)
+
+def _all_pair_energies(indices, table):
+    """
+    Sum of table[a[i], a[j]] over positions i < j, with one gather of
+    every pair of positions.
+    """
+    first, second = np.triu_indices(indices.shape[1], k=1)
+    return table[indices[:, first], indices[:, second]].sum(axis=1)
+
+class ContactEnergyFeaturizer(object):
+    """
+    Sum residue contact energies over the pairs of residues of peptides.
+
+    Parameters
+    ----------
+    matrices : list of str, optional
+        Names in contact_matrix_names, defaults to all of them
+
+    pairings : list of str
+        "adjacent" sums the energies of neighboring residues and
+        "all_pairs" of every pair of residues i < j
+
+    chunk_size : int
+        Number of peptides featurized at once, bounding memory use
+
+    dtype : numpy dtype
+    """
+    def __init__(
+            self,
+            matrices=None,
+            pairings=PAIRINGS,
+            chunk_size=DEFAULT_CHUNK_SIZE,
+            dtype=np.float32):
+        if matrices is None:
+            matrices = list(contact_matrix_names)
+        self.matrices = list(matrices)
+        if isinstance(pairings, str):
+            pairings = [pairings]
+        for pairing in pairings:
+            if pairing not in PAIRINGS:
+                raise ValueError(
+                    "Unknown pairing '%s', expected one of %s" % (pairing, PAIRINGS))
+        self.pairings = list(pairings)
+        self.chunk_size = chunk_size
+        self.dtype = dtype
+        self._tables = {
+            name: _padded(contact_matrix(name), 0, dtype)
+            for name in self.matrices
+        }
+
+    @property
+    def feature_names(self):
+        return [
+            "%s_%s" % (name, pairing)
+            for name in self.matrices
+            for pairing in self.pairings
+        ]
+
+    def transform(self, peptides):
+        """
+        (N x F) array of energies of a list of peptides or EncodedPeptides,
+        with columns in the order of feature_names.
+        """
+        encoded = as_canonical_encoding(peptides)
+        result = np.zeros((len(encoded), len(self.feature_names)), dtype=self.dtype)
+        for start in range(0, len(encoded), self.chunk_size):
+            indices = encoded.indices[start:start + self.chunk_size]
+            column = 0
+            for name in self.matrices:
+                table = self._tables[name]
+                for pairing in self.pairings:
+                    if pairing == "adjacent":
+                        values = _adjacent_energies(indices, table)
+                    else:
+                        values = _all_pair_energies(indices, table)
+                    result[start:start + len(indices), column] = values
+                    column += 1
+        return result
+
+    def pair_tensor(self, peptides, matrix):
+        """
+        (N x L x L) array with the energy of residues i and j of each
+        peptide at [n, i, j] under one of the contact matrices, and NaN
+        past the end of shorter peptides.
+        """
+        encoded = as_canonical_encoding(peptides)
+        table = _padded(contact_matrix(matrix), np.nan, self.dtype)
+        indices = encoded.indices
+        return table[indices[:, :, None], indices[:, None, :]]
@@ -0,0 +1,211 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Batches of peptides encoded as integer matrices, the shared representation
+used to featurize peptides without per-residue Python work.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+
+from .amino_acid_alphabet import canonical_amino_acid_letters
+
+# index used for the positions past the end of each peptide
+PADDING_INDEX = 255
+
+# marks bytes which aren't letters of the alphabet in a lookup table
+_INVALID_INDEX = 254
+
+def reduced_alphabet_letters(reduced_alphabet : dict) -> list[str]:
+    """
+    Letters of a reduced alphabet (e.g. pepdata.reduced_alphabet.gbmr4),
+    which maps every amino acid to the first letter of its group.
+    """
+    return sorted(set(reduced_alphabet.values()))
+
+def make_lookup_table(
+        alphabet : list[str],
+        reduced_alphabet : dict | None = None,
+        unknown_letter : str | None = None) -> np.ndarray:
+    """
+    Make a 256 entry table from the byte value of a letter to its index,
+    which for a reduced alphabet is the index of its group's letter.
+    Bytes which aren't part of the alphabet map to the index of
+    unknown_letter if given and are invalid otherwise.
+    """
+    if len(alphabet) > _INVALID_INDEX:
+        raise ValueError("Alphabet too large: %d letters" % len(alphabet))
+    letter_indices = {letter: i for (i, letter) in enumerate(alphabet)}
+    if unknown_letter is None:
+        default = _INVALID_INDEX
+    elif unknown_letter in letter_indices:
+        default = letter_indices[unknown_letter]
+    else:
+        raise ValueError(
+            "Unknown letter '%s' not in alphabet %s" % (unknown_letter, alphabet))
+    table = np.full(256, default, dtype="uint8")
+    if reduced_alphabet is None:
+        mapping = {letter: letter for letter in alphabet}
+    else:
+        mapping = reduced_alphabet
+    for letter, target in mapping.items():
+        if target not in letter_indices:
+            raise ValueError(
+                "Letter '%s' (for '%s') not in alphabet %s" % (
+                    target, letter, alphabet))
+        table[ord(letter)] = letter_indices[target]
+    return table
+
+class EncodedPeptides(object):
+    """
+    Batch of peptides as a (n_peptides x max_length) uint8 matrix of letter
+    indices, padded with PADDING_INDEX, plus a vector of peptide lengths.
+    """
+    def __init__(self, indices, lengths, alphabet):
+        self.indices = indices
+        self.lengths = lengths
+        self.alphabet = list(alphabet)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __getitem__(self, rows):
+        """
+        Select a subset of peptides by integer index, slice or boolean mask.
+        """
+        if isinstance(rows, (int, np.integer)):
+            rows = [rows]
+        return EncodedPeptides(
+            indices=self.indices[rows],
+            lengths=self.lengths[rows],
+            alphabet=self.alphabet)
+
+    @property
+    def max_length(self):
+        return self.indices.shape[1]
+
+    def with_length(self, length):
+        """
+        Encoded peptides of exactly the given length, without padding, and
+        the row of each one in this batch.
+        """
+        rows = np.flatnonzero(self.lengths == length)
+        return EncodedPeptides(
+            indices=self.indices[rows, :length],
+            lengths=self.lengths[rows],
+            alphabet=self.alphabet), rows
+
+    def decode(self):
+        """
+        Convert back to a list of strings
+        """
+        letters = np.array(
+            [ord(c) for c in self.alphabet] +
+            [0] * (256 - len(self.alphabet)),
+            dtype="uint8")
+        # padding becomes NUL bytes, which are trimmed by the lengths
+        buffer = letters[self.indices].tobytes()
+        width = self.max_length
+        return [
+            buffer[i * width:i * width + n].decode("ascii")
+            for (i, n) in enumerate(self.lengths)
+        ]
+
+def encode_peptides(
+        peptides,
+        alphabet : list[str] = canonical_amino_acid_letters,
+        reduced_alphabet : dict | None = None,
+        unknown_letter : str | None = None,
+        max_length : int | None = None) -> EncodedPeptides:
+    """
+    Encode a batch of peptides as an integer matrix in one pass over their
+    bytes, using a 256 entry lookup table.
+
+    Parameters
+    ----------
+    peptides
+        List, array or Series of amino acid strings
+
+    alphabet
+        Letters in index order, e.g. canonical_amino_acid_letters (default)
+        or extended_amino_acid_letters to also allow rare amino acids and
+        wildcards such as X. The order of the canonical letters matches the
+        rows and columns of the amino acid matrices (e.g. blosum62_matrix).
+
+    reduced_alphabet
+        Dictionary from amino acid letters to their group's letter (see
+        pepdata.reduced_alphabet), in which case alphabet defaults to
+        reduced_alphabet_letters(reduced_alphabet)
+
+    unknown_letter
+        Encode letters outside of the alphabet as this letter (e.g. "X" with
+        the extended alphabet) instead of raising an error
+
+    max_length
+        Width of the result, defaults to the length of the longest peptide
+
+    Returns EncodedPeptides
+    """
+    if reduced_alphabet is not None and alphabet is canonical_amino_acid_letters:
+        alphabet = reduced_alphabet_letters(reduced_alphabet)
+    table = make_lookup_table(
+        alphabet,
+        reduced_alphabet=reduced_alphabet,
+        unknown_letter=unknown_letter)
+    peptides = list(map(str, peptides))
+    lengths = np.fromiter(map(len, peptides), dtype="int64", count=len(peptides))
+    if max_length is None:
+        max_length = int(lengths.max()) if len(lengths) > 0 else 0
+    elif len(lengths) > 0 and lengths.max() > max_length:
+        raise ValueError(
+            "Peptide of length %d longer than max_length=%d" % (
+                lengths.max(), max_length))
+    try:
+        buffer = "".join(peptides).encode("ascii")
+    except UnicodeEncodeError as e:
+        raise ValueError("Non-ASCII character in peptides: %s" % e)
+    codes = table[np.frombuffer(buffer, dtype="uint8")]
+    invalid = np.flatnonzero(codes == _INVALID_INDEX)
+    if len(invalid) > 0:
+        offsets = np.cumsum(lengths)
+        peptide_index = np.searchsorted(offsets, invalid[0], side="right")
+        raise ValueError(
+            "Invalid letter '%s' in peptide '%s'" % (
+                chr(buffer[invalid[0]]), peptides[peptide_index]))
+    if len(peptides) > 0 and (lengths == max_length).all():
+        indices = codes.reshape(len(peptides), max_length)
+        return EncodedPeptides(indices=indices, lengths=lengths, alphabet=alphabet)
+    indices = np.full((len(peptides), max_length), PADDING_INDEX, dtype="uint8")
+    rows = np.repeat(np.arange(len(peptides)), lengths)
+    starts = np.cumsum(lengths) - lengths
+    cols = np.arange(len(codes)) - np.repeat(starts, lengths)
+    indices[rows, cols] = codes
+    return EncodedPeptides(indices=indices, lengths=lengths, alphabet=alphabet)
+
+def as_canonical_encoding(peptides) -> EncodedPeptides:
+    """
+    Encode peptides (unless they're already EncodedPeptides) and check that
+    they only use the 20 canonical amino acids, in the order of the rows and
+    columns of the amino acid matrices and property tables.
+    """
+    if isinstance(peptides, EncodedPeptides):
+        encoded = peptides
+    else:
+        encoded = encode_peptides(peptides)
+    n_canonical = len(canonical_amino_acid_letters)
+    indices = encoded.indices
+    if encoded.alphabet[:n_canonical] != canonical_amino_acid_letters or \
+            (indices[indices != PADDING_INDEX] >= n_canonical).any():
+        raise ValueError("Peptides must only contain the canonical amino acids")
+    return encoded
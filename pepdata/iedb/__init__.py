@@ -1,11 +1,15 @@
 from . import (
+    aggregate,
     alleles,
     mhc,
+    refresh,
     tcell
 )
 
 __all__ = [
+    "aggregate",
     "alleles",
     "mhc",
+    "refresh",
     "tcell",
-]
\ No newline at end of file
+]
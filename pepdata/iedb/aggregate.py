@@ -0,0 +1,538 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Assays of tcell.load_dataframe or mhc.load_dataframe aggregated into one
+row per (epitope, allele): the number of assays, of positive and negative
+qualitative outcomes, the summed number of subjects tested and responded,
+and the set of assay methods.
+
+Epitopes, alleles and methods are stored as integer codes into a
+dictionary of their distinct values. The dictionaries only ever grow, so
+aggregating rows appended to an export (EpitopeAlleleTable.append) keeps
+every existing code. load_epitope_allele_table caches the table on disk
+next to the export and, when the export only gained rows at the end,
+aggregates just those rows.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from .columnar import source_fingerprint
+from .common import _source_module, atomic_write, str_startswith
+from .memoize import _prepare_memoization_key
+from .columns import (
+    find_keys,
+    get_assay_method,
+    get_assay_num_responded,
+    get_assay_num_tested,
+    get_assay_qualitative,
+    get_epitope_name,
+    get_mhc_allele,
+)
+
+COUNT_COLUMNS = [
+    "n_assays",
+    "n_positive",
+    "n_negative",
+    "n_tested",
+    "n_responded",
+]
+
+# columns which determine the aggregated values of a row
+AGGREGATED_GETTERS = [
+    get_epitope_name,
+    get_mhc_allele,
+    get_assay_qualitative,
+    get_assay_num_tested,
+    get_assay_num_responded,
+    get_assay_method,
+]
+
+def _empty_strings():
+    return pd.Index([], dtype=str)
+
+def _extend_dictionary(values : pd.Series, dictionary : pd.Index):
+    """
+    Codes of values in a dictionary of distinct strings (-1 for missing
+    values), and the dictionary extended with any values it didn't have.
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        value_codes = values.cat.codes.to_numpy()
+        distinct = values.cat.categories
+    else:
+        value_codes, distinct = pd.factorize(values)
+    distinct = pd.Index(distinct, dtype=str)
+    mapping = dictionary.get_indexer(distinct)
+    new = mapping < 0
+    if new.any():
+        mapping[new] = len(dictionary) + np.arange(new.sum())
+        dictionary = dictionary.append(distinct[new]).astype(str)
+    mapping = np.append(mapping, -1).astype("int32")
+    return mapping[value_codes], dictionary
+
+def _subject_counts(values : pd.Series | None, n : int):
+    if values is None:
+        return np.zeros(n, dtype="int64")
+    if not pd.api.types.is_numeric_dtype(values.dtype):
+        # counts mixed with free text are stored as strings
+        values = pd.to_numeric(values.astype(object), errors="coerce")
+    return np.nan_to_num(values.to_numpy(dtype="float64", na_value=np.nan)).astype("int64")
+
+def row_hashes(df : pd.DataFrame) -> np.ndarray:
+    """
+    uint64 hash of the aggregated columns of every row of an IEDB
+    DataFrame, equal for equal values whether or not they're categorical.
+    """
+    keys = [key for key in find_keys(df.columns, AGGREGATED_GETTERS) if key is not None]
+    columns = pd.DataFrame({i: df[key] for (i, key) in enumerate(keys)}, index=df.index)
+    return pd.util.hash_pandas_object(columns, index=False).to_numpy()
+
+def _mix(x):
+    """
+    splitmix64 finalizer of a uint64 array
+    """
+    with np.errstate(over="ignore"):
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+        return x ^ (x >> np.uint64(31))
+
+def rows_checksum(hashes : np.ndarray, start : int = 0) -> int:
+    """
+    Order dependent checksum of row_hashes, where start is the position of
+    the first row. Checksums of consecutive runs of rows add up (modulo
+    2 ** 64) to the checksum of all of them, so rows can be appended
+    without rehashing the earlier ones.
+    """
+    positions = np.arange(start, start + len(hashes), dtype="uint64")
+    with np.errstate(over="ignore"):
+        return int(_mix(hashes.astype("uint64") ^ _mix(positions)).sum(dtype="uint64"))
+
+def _add_checksums(a, b):
+    return (a + b) % (1 << 64)
+
+class EpitopeAlleleTable(object):
+    """
+    Aggregated assays, with one entry per (epitope, allele) sorted by
+    epitope code and then allele code.
+
+    Parameters
+    ----------
+    epitopes, alleles, methods : pd.Index
+        Distinct epitope sequences, MHC allele names and assay methods
+
+    epitope_codes, allele_codes : np.ndarray
+        int32 codes of each entry's epitope and allele (-1 when the allele
+        is missing)
+
+    n_assays, n_positive, n_negative, n_tested, n_responded : np.ndarray
+        int64 counts of each entry
+
+    method_offsets, method_codes, method_counts : np.ndarray
+        Assay methods of entry i are methods[method_codes[
+        method_offsets[i]:method_offsets[i + 1]]], each used by the
+        matching number of method_counts assays
+
+    n_source_rows : int
+        Number of assay rows aggregated
+
+    source_checksum : int
+        rows_checksum of the row_hashes of those rows, used to check that a
+        DataFrame only appends to them
+
+    load_kwargs : dict, optional
+        Arguments of load_dataframe which gave the rows, recorded by
+        load_epitope_allele_table
+
+    source_fingerprint : str, optional
+        columnar.source_fingerprint of the export the rows were loaded
+        from, recorded by load_epitope_allele_table and refresh so that an
+        unchanged export is recognized without loading it. Tables made by
+        append or update don't have one until it's set.
+    """
+    def __init__(
+            self,
+            epitopes,
+            alleles,
+            methods,
+            epitope_codes,
+            allele_codes,
+            n_assays,
+            n_positive,
+            n_negative,
+            n_tested,
+            n_responded,
+            method_offsets,
+            method_codes,
+            method_counts,
+            n_source_rows=0,
+            source_checksum=0,
+            load_kwargs=None,
+            source_fingerprint=None):
+        self.epitopes = epitopes
+        self.alleles = alleles
+        self.methods = methods
+        self.epitope_codes = epitope_codes
+        self.allele_codes = allele_codes
+        self.n_assays = n_assays
+        self.n_positive = n_positive
+        self.n_negative = n_negative
+        self.n_tested = n_tested
+        self.n_responded = n_responded
+        self.method_offsets = method_offsets
+        self.method_codes = method_codes
+        self.method_counts = method_counts
+        self.n_source_rows = n_source_rows
+        self.source_checksum = source_checksum
+        self.load_kwargs = load_kwargs
+        self.source_fingerprint = source_fingerprint
+
+    @classmethod
+    def empty(cls):
+        return cls._from_codes(
+            _empty_strings(),
+            _empty_strings(),
+            _empty_strings(),
+            np.zeros(0, dtype="int32"),
+            np.zeros(0, dtype="int32"),
+            {name: np.zeros(0, dtype="int64") for name in COUNT_COLUMNS},
+            np.zeros(0, dtype="int32"))
+
+    @classmethod
+    def _from_codes(
+            cls, epitopes, alleles, methods, epitope_codes, allele_codes,
+            counts, row_method_codes):
+        """
+        Table with one entry per row (of at most one method each, -1 for
+        none), not yet aggregated.
+        """
+        has_method = row_method_codes >= 0
+        method_offsets = np.zeros(len(epitope_codes) + 1, dtype="int64")
+        np.cumsum(has_method, out=method_offsets[1:])
+        return cls(
+            epitopes=epitopes,
+            alleles=alleles,
+            methods=methods,
+            epitope_codes=epitope_codes,
+            allele_codes=allele_codes,
+            method_offsets=method_offsets,
+            method_codes=row_method_codes[has_method],
+            method_counts=np.ones(int(has_method.sum()), dtype="int64"),
+            **counts)
+
+    @classmethod
+    def from_dataframe(cls, df : pd.DataFrame):
+        """
+        Aggregate the assays of an IEDB DataFrame, e.g. the result of
+        tcell.load_dataframe. Rows without an epitope are skipped.
+        """
+        return cls.empty().append(df)
+
+    def __len__(self):
+        return len(self.epitope_codes)
+
+    def _rows(self, df : pd.DataFrame, sign : int = 1) -> EpitopeAlleleTable:
+        """
+        Unaggregated table of the rows of a DataFrame (with counts
+        multiplied by sign), whose dictionaries extend those of this table.
+        """
+        epitopes = get_epitope_name(df)
+        if epitopes is None:
+            raise ValueError(
+                "Could not find epitope name column, available columns: %s" % (
+                    list(df.columns),))
+        n = len(df)
+        epitope_codes, epitope_dictionary = _extend_dictionary(epitopes, self.epitopes)
+        alleles = get_mhc_allele(df)
+        if alleles is None:
+            allele_codes, allele_dictionary = np.full(n, -1, dtype="int32"), self.alleles
+        else:
+            allele_codes, allele_dictionary = _extend_dictionary(alleles, self.alleles)
+        methods = get_assay_method(df)
+        if methods is None:
+            method_codes, method_dictionary = np.full(n, -1, dtype="int32"), self.methods
+        else:
+            method_codes, method_dictionary = _extend_dictionary(methods, self.methods)
+        qualitative = get_assay_qualitative(df)
+        if qualitative is None:
+            positive = negative = np.zeros(n, dtype="bool")
+        else:
+            positive = str_startswith(qualitative, "Positive").to_numpy()
+            negative = str_startswith(qualitative, "Negative").to_numpy()
+        counts = {
+            "n_assays": np.ones(n, dtype="int64"),
+            "n_positive": positive.astype("int64"),
+            "n_negative": negative.astype("int64"),
+            "n_tested": _subject_counts(get_assay_num_tested(df), n),
+            "n_responded": _subject_counts(get_assay_num_responded(df), n),
+        }
+        keep = epitope_codes >= 0
+        rows = EpitopeAlleleTable._from_codes(
+            epitope_dictionary,
+            allele_dictionary,
+            method_dictionary,
+            epitope_codes[keep],
+            allele_codes[keep],
+            {name: sign * values[keep] for (name, values) in counts.items()},
+            method_codes[keep])
+        rows.method_counts *= sign
+        return rows
+
+    def append(
+            self,
+            df : pd.DataFrame,
+            hashes : np.ndarray | None = None) -> EpitopeAlleleTable:
+        """
+        New table which also aggregates the rows of another DataFrame,
+        keeping the codes of this one. Pass the row_hashes of df if they're
+        already computed.
+        """
+        if hashes is None:
+            hashes = row_hashes(df)
+        result = _combine(self, self._rows(df))
+        result.n_source_rows = self.n_source_rows + len(df)
+        result.source_checksum = _add_checksums(
+            self.source_checksum, rows_checksum(hashes, start=self.n_source_rows))
+        result.load_kwargs = self.load_kwargs
+        return result
+
+    def update(
+            self,
+            inserted : pd.DataFrame,
+            removed : pd.DataFrame,
+            hashes : np.ndarray) -> EpitopeAlleleTable:
+        """
+        New table of a changed source, from the rows it gained and lost.
+
+        Parameters
+        ----------
+        inserted, removed : pd.DataFrame
+            Rows added to and removed from the source (e.g. an ExportDelta)
+
+        hashes : np.ndarray
+            row_hashes of every row of the changed source, which later
+            appends are checked against
+        """
+        result = _combine(self, self._rows(removed, sign=-1))
+        result = _combine(result, result._rows(inserted))
+        result.n_source_rows = len(hashes)
+        result.source_checksum = rows_checksum(hashes)
+        result.load_kwargs = self.load_kwargs
+        return result
+
+    def extends(self, hashes : np.ndarray) -> bool:
+        """
+        Are the first n_source_rows of some row_hashes exactly the rows
+        this table aggregated?
+        """
+        return len(hashes) >= self.n_source_rows and \
+            rows_checksum(hashes[:self.n_source_rows]) == self.source_checksum
+
+    def methods_of(self, i : int) -> frozenset:
+        codes = self.method_codes[self.method_offsets[i]:self.method_offsets[i + 1]]
+        return frozenset(self.methods[codes])
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        DataFrame with categorical "epitope" and "allele" columns, the
+        counts and a column of frozensets of "assay_methods".
+        """
+        df = pd.DataFrame({
+            "epitope": pd.Categorical.from_codes(
+                self.epitope_codes, categories=self.epitopes),
+            "allele": pd.Categorical.from_codes(
+                self.allele_codes, categories=self.alleles),
+        })
+        for name in COUNT_COLUMNS:
+            df[name] = getattr(self, name)
+        df["assay_methods"] = self._method_sets()
+        return df
+
+    def _method_sets(self):
+        """
+        frozenset of the assay methods of every entry, built once per
+        distinct combination of methods.
+        """
+        methods = np.asarray(self.methods, dtype=object)
+        if len(methods) > 63:
+            return [
+                frozenset(methods[self.method_codes[start:end]])
+                for (start, end) in zip(
+                    self.method_offsets[:-1].tolist(), self.method_offsets[1:].tolist())
+            ]
+        # the methods of an entry are distinct, so summing their bits
+        # (with wraparound) gives the bitmask of the combination
+        bits = np.left_shift(np.uint64(1), self.method_codes.astype("uint64"))
+        cumulative = np.zeros(len(bits) + 1, dtype="uint64")
+        np.cumsum(bits, out=cumulative[1:])
+        masks = cumulative[self.method_offsets[1:]] - cumulative[self.method_offsets[:-1]]
+        distinct_masks, inverse = np.unique(masks, return_inverse=True)
+        sets = np.empty(len(distinct_masks), dtype=object)
+        for i, mask in enumerate(distinct_masks.tolist()):
+            sets[i] = frozenset(
+                methods[[j for j in range(len(methods)) if mask >> j & 1]])
+        return sets[inverse]
+
+    def save(self, path : str):
+        """
+        Write the table to a .npz file, which load reads back.
+        """
+        arrays = {
+            "epitopes": np.asarray(self.epitopes, dtype=str),
+            "alleles": np.asarray(self.alleles, dtype=str),
+            "methods": np.asarray(self.methods, dtype=str),
+            "epitope_codes": self.epitope_codes,
+            "allele_codes": self.allele_codes,
+            "method_offsets": self.method_offsets,
+            "method_codes": self.method_codes,
+            "method_counts": self.method_counts,
+            "n_source_rows": np.array(self.n_source_rows, dtype="int64"),
+            "source_checksum": np.array(self.source_checksum, dtype="uint64"),
+            "load_kwargs": np.array(json.dumps(self.load_kwargs, sort_keys=True, default=str)),
+            "source_fingerprint": np.array(self.source_fingerprint or ""),
+        }
+        for name in COUNT_COLUMNS:
+            arrays[name] = getattr(self, name)
+        with atomic_write(path, suffix=".npz") as tmp_path:
+            np.savez(tmp_path, **arrays)
+
+    @classmethod
+    def load(cls, path : str):
+        with np.load(path, allow_pickle=False) as data:
+            kwargs = {
+                name: data[name]
+                for name in [
+                    "epitope_codes",
+                    "allele_codes",
+                    "method_offsets",
+                    "method_codes",
+                    "method_counts",
+                ] + COUNT_COLUMNS
+            }
+            for name in ["epitopes", "alleles", "methods"]:
+                kwargs[name] = pd.Index(data[name], dtype=str)
+            kwargs["n_source_rows"] = int(data["n_source_rows"])
+            kwargs["source_checksum"] = int(data["source_checksum"])
+            kwargs["load_kwargs"] = json.loads(str(data["load_kwargs"]))
+            if "source_fingerprint" in data.files:
+                kwargs["source_fingerprint"] = str(data["source_fingerprint"]) or None
+        return cls(**kwargs)
+
+def _entries_of_methods(table):
+    return np.repeat(np.arange(len(table)), np.diff(table.method_offsets))
+
+def _combine(a : EpitopeAlleleTable, b : EpitopeAlleleTable) -> EpitopeAlleleTable:
+    """
+    Sum the entries of two tables, where the dictionaries of b extend those
+    of a. Entries left without any assays are dropped.
+    """
+    epitope_codes = np.concatenate([a.epitope_codes, b.epitope_codes]).astype("int64")
+    allele_codes = np.concatenate([a.allele_codes, b.allele_codes]).astype("int64")
+    n_allele_keys = len(b.alleles) + 1
+    keys, groups = np.unique(
+        epitope_codes * n_allele_keys + allele_codes + 1, return_inverse=True)
+    counts = {
+        name: np.bincount(
+            groups,
+            weights=np.concatenate([getattr(a, name), getattr(b, name)]),
+            minlength=len(keys)).round().astype("int64")
+        for name in COUNT_COLUMNS
+    }
+
+    method_groups = groups[np.concatenate([
+        _entries_of_methods(a), _entries_of_methods(b) + len(a)])]
+    method_keys, method_inverse = np.unique(
+        method_groups * max(len(b.methods), 1) +
+        np.concatenate([a.method_codes, b.method_codes]),
+        return_inverse=True)
+    method_counts = np.bincount(
+        method_inverse,
+        weights=np.concatenate([a.method_counts, b.method_counts]),
+        minlength=len(method_keys)).round().astype("int64")
+
+    keep = counts["n_assays"] != 0
+    new_groups = np.cumsum(keep) - 1
+    method_groups = method_keys // max(len(b.methods), 1)
+    keep_methods = (method_counts != 0) & keep[method_groups]
+    method_groups = new_groups[method_groups[keep_methods]]
+    method_offsets = np.zeros(int(keep.sum()) + 1, dtype="int64")
+    np.cumsum(
+        np.bincount(method_groups, minlength=len(method_offsets) - 1),
+        out=method_offsets[1:])
+    keys = keys[keep]
+    return EpitopeAlleleTable(
+        epitopes=b.epitopes,
+        alleles=b.alleles,
+        methods=b.methods,
+        epitope_codes=(keys // n_allele_keys).astype("int32"),
+        allele_codes=(keys % n_allele_keys - 1).astype("int32"),
+        method_offsets=method_offsets,
+        method_codes=(method_keys[keep_methods] % max(len(b.methods), 1)).astype("int32"),
+        method_counts=method_counts[keep_methods],
+        **{name: values[keep] for (name, values) in counts.items()})
+
+def cached_table_path(csv_path : str, load_kwargs : dict) -> str:
+    """
+    Location of the cached table of an IEDB export loaded with some
+    arguments of load_dataframe (next to the export itself).
+    """
+    key = _prepare_memoization_key(None, (), load_kwargs)
+    digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:16]
+    base, _ = os.path.splitext(csv_path)
+    return "%s.epitope_alleles-%s.npz" % (base, digest)
+
+def load_epitope_allele_table(source : str = "tcell", **load_kwargs) -> EpitopeAlleleTable:
+    """
+    Aggregate the assays of pepdata.iedb.tcell or pepdata.iedb.mhc, with
+    load_kwargs passed to their load_dataframe function.
+
+    The table is cached on disk. While the export's source_fingerprint
+    matches the one recorded in the cached table, that table is returned
+    without loading the export. Otherwise the rows are loaded and hashed:
+    if the export changed only by gaining rows at the end, only those rows
+    are aggregated into the cached table, otherwise it's rebuilt.
+    """
+    module = _source_module(source)
+    csv_path = module.local_path()
+    path = cached_table_path(csv_path, load_kwargs)
+    fingerprint = source_fingerprint(csv_path)
+    table = None
+    if os.path.exists(path):
+        try:
+            table = EpitopeAlleleTable.load(path)
+        except Exception as e:
+            logging.warning("Ignoring unreadable epitope table %s: %s", path, e)
+    if table is not None and table.source_fingerprint == fingerprint:
+        return table
+    df = module.load_dataframe(**load_kwargs)
+    hashes = row_hashes(df)
+    if table is not None and table.extends(hashes):
+        n = table.n_source_rows
+        if n < len(df):
+            logging.info("Aggregating %d new rows into %s", len(df) - n, path)
+            table = table.append(df.iloc[n:], hashes=hashes[n:])
+    else:
+        table = EpitopeAlleleTable.empty().append(df, hashes=hashes)
+        table.load_kwargs = load_kwargs
+    table.source_fingerprint = fingerprint
+    try:
+        table.save(path)
+    except OSError as e:
+        logging.warning("Unable to write epitope table %s: %s", path, e)
+    return table
@@ -10,11 +10,21 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from collections import namedtuple
+from __future__ import annotations
+
+import bisect
+from collections import OrderedDict, namedtuple
+import logging
 import os
-import xml
+import pickle
+import re
+from xml.etree import ElementTree
+
+import numpy as np
+import pandas as pd
 
-from .common import cache
+from .columnar import source_fingerprint
+from .common import atomic_write, cache
 from .memoize import memoize
 
 ALLELE_XML_FILENAME = "MhcAlleleNames.xml"
@@ -45,58 +55,364 @@ Allele = namedtuple("Allele", [
     "synonyms"
 ])
 
-@memoize
-def load_alleles():
-    """Parses the IEDB MhcAlleleName XML file and returns a list of Allele
-    namedtuple objects containing information about that each allele's HLA
-    class and source organism.
+def _parse_allele_element(allele):
+    name_element = allele.find("DisplayedRestriction")
+    mhc_class_element = allele.find("Class")
+    # need at least a name and an HLA class
+    if name_element is None or mhc_class_element is None:
+        return None
+    name = name_element.text
+
+    synonyms = set()
+    for synonym_element in allele.iterfind("Synonyms"):
+        for synonym in (synonym_element.text or "").split(","):
+            synonym = synonym.strip()
+            if synonym:
+                synonyms.add(synonym)
+    mhc_class = mhc_class_element.text
+    organism_element = allele.find("Organsim")
+    if organism_element is None:
+        organism = None
+    else:
+        organism = organism_element.text
+
+    locus_element = allele.find("Locus")
+
+    if locus_element is None:
+        locus = None
+    else:
+        locus = locus_element.text
+
+    return Allele(
+        name=name,
+        mhc_class=mhc_class,
+        locus=locus,
+        organism=organism,
+        synonyms=synonyms)
+
+def parse_alleles(path):
+    """Parses an IEDB MhcAlleleName XML file into a list of Allele namedtuples,
+    one <MhcAlleleName> element at a time so that the whole document tree is
+    never held in memory.
     """
     result = []
-    path = local_path()
-    etree = xml.etree.ElementTree.parse(path)
-    for allele in etree.iterfind("MhcAlleleName"):
-        name_element = allele.find("DisplayedRestriction")
-        mhc_class_element = allele.find("Class")
-        # need at least a name and an HLA class
-        if name_element is None or mhc_class_element is None:
+    for _, element in ElementTree.iterparse(path, events=("end",)):
+        if element.tag != "MhcAlleleName":
             continue
-        name = name_element.text
-
-        synonyms = set()
-        for synonym_element in allele.iterfind("Synonyms"):
-            for synonym in synonym_element.text.split(","):
-                synonyms.add(synonym.strip())
-        mhc_class = mhc_class_element.text
-        organism_element = allele.find("Organsim")
-        if organism_element is None:
-            organism = None
-        else:
-            organism = organism_element.text
+        allele = _parse_allele_element(element)
+        if allele is not None:
+            result.append(allele)
+        element.clear()
+    return result
 
-        locus_element = allele.find("Locus")
+# characters after which an allele name is split into prefixes for
+# AlleleRegistry.with_prefix, e.g. "HLA-A*02:01" -> "HLA", "HLA-A", "HLA-A*02"
+_PREFIX_SEPARATORS = "-*:/ "
 
-        if locus_element is None:
-            locus = None
-        else:
-            locus = locus_element.text
-
-        allele_object = Allele(
-            name=name,
-            mhc_class=mhc_class,
-            locus=locus,
-            organism=organism,
-            synonyms=synonyms)
-        result.append(allele_object)
-    return result
+class AlleleRegistry(object):
+    """
+    Alleles from the IEDB allele list with indexes for common lookups:
+    by name (including synonyms), by name prefix (e.g. all alleles starting
+    with "HLA-A*02"), by locus and by MHC class, optionally restricted to an
+    organism.
+    """
+    def __init__(self, alleles):
+        self.alleles = list(alleles)
+        self.by_name = {}
+        self.class_by_name = {}
+        self._prefix_index = {}
+        self._locus_index = {}
+        self._class_index = {}
+        for i, allele in enumerate(self.alleles):
+            for name in {allele.name}.union(allele.synonyms):
+                self.by_name[name] = allele
+                self.class_by_name[name] = allele.mhc_class
+            for prefix in self._prefixes(allele.name):
+                self._prefix_index.setdefault(prefix, []).append(i)
+            for organism in (None, allele.organism):
+                self._locus_index.setdefault(
+                    (organism, allele.locus), []).append(i)
+                self._class_index.setdefault(
+                    (organism, allele.mhc_class), []).append(i)
+        self._sorted_names = sorted(
+            (allele.name, i) for (i, allele) in enumerate(self.alleles))
+
+    @staticmethod
+    def _prefixes(name):
+        prefixes = [name]
+        for j, c in enumerate(name):
+            if j > 0 and c in _PREFIX_SEPARATORS:
+                prefixes.append(name[:j])
+        return prefixes
+
+    def __len__(self):
+        return len(self.alleles)
+
+    def __contains__(self, name):
+        return name in self.by_name
+
+    def get(self, name, default=None):
+        return self.by_name.get(name, default)
+
+    def normalized_index(self):
+        """
+        Dictionary from normalize_allele_name(name) to Allele for every name
+        and synonym, leaving out normalized names shared by different alleles.
+        """
+        index = self.__dict__.get("_normalized_index")
+        if index is None:
+            index = {}
+            ambiguous = set()
+            for name, allele in self.by_name.items():
+                key = normalize_allele_name(name)
+                if key in index and index[key] is not allele:
+                    ambiguous.add(key)
+                index[key] = allele
+            for key in ambiguous:
+                del index[key]
+            self._normalized_index = index
+        return index
+
+    def with_prefix(self, prefix):
+        """
+        Alleles whose name starts with the given prefix, e.g. "HLA-A*02".
+        """
+        if prefix in self._prefix_index:
+            return [self.alleles[i] for i in self._prefix_index[prefix]]
+        # prefixes which don't end at a separator need a binary search
+        # over the sorted names
+        start = bisect.bisect_left(self._sorted_names, (prefix,))
+        result = []
+        for name, i in self._sorted_names[start:]:
+            if not name.startswith(prefix):
+                break
+            result.append(self.alleles[i])
+        return result
+
+    def with_locus(self, locus, organism=None):
+        return [
+            self.alleles[i]
+            for i in self._locus_index.get((organism, locus), [])
+        ]
+
+    def with_class(self, mhc_class, organism=None):
+        mhc_class = normalize_mhc_class(mhc_class)
+        return [
+            self.alleles[i]
+            for i in self._class_index.get((organism, mhc_class), [])
+        ]
+
+# change when the attributes or indexes of AlleleRegistry change, so that
+# registries pickled by other versions are rebuilt
+REGISTRY_FORMAT = 1
+
+def _registry_cache_path(xml_path):
+    base, _ = os.path.splitext(xml_path)
+    return base + ".registry.pickle"
 
 @memoize
+def load_allele_registry():
+    """Loads the AlleleRegistry compiled from the IEDB MhcAlleleName XML file.
+    The first load parses the XML and pickles the registry next to it, later
+    loads (in any process) read that pickle unless the XML or
+    REGISTRY_FORMAT has changed.
+    """
+    path = local_path()
+    registry_path = _registry_cache_path(path)
+    fingerprint = (REGISTRY_FORMAT, source_fingerprint(path))
+    if os.path.exists(registry_path):
+        try:
+            with open(registry_path, "rb") as f:
+                cached_fingerprint, registry = pickle.load(f)
+            if cached_fingerprint == fingerprint:
+                return registry
+        except Exception as e:
+            logging.warning(
+                "Ignoring unreadable allele registry %s: %s", registry_path, e)
+    registry = AlleleRegistry(parse_alleles(path))
+    try:
+        with atomic_write(registry_path) as tmp_path, open(tmp_path, "wb") as f:
+            pickle.dump(
+                (fingerprint, registry), f, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError as e:
+        logging.warning(
+            "Unable to write allele registry %s: %s", registry_path, e)
+    return registry
+
+def load_alleles():
+    """Returns a list of Allele namedtuple objects containing information
+    about each allele's HLA class and source organism.
+    """
+    return load_allele_registry().alleles
+
 def load_alleles_dict():
-    """Create a dictionary mapping each unique allele name to a namedtuple
+    """Dictionary mapping each unique allele name to a namedtuple
     containing information about that alleles class, locus, species, &c.
     """
-    alleles = load_alleles()
-    result = {}
-    for allele in alleles:
-        for name in {allele.name}.union(allele.synonyms):
-            result[name] = allele
-    return result
+    return load_allele_registry().by_name
+
+def load_allele_class_dict():
+    """Dictionary mapping each unique allele name (including synonyms)
+    to its MHC class, e.g. "I" or "II".
+    """
+    return load_allele_registry().class_by_name
+
+def normalize_mhc_class(mhc_class : int | str | None) -> str | None:
+    """
+    Since MHC classes can be specified as either strings ("I") or integers
+    (1), standardize them to be strings.
+    """
+    if mhc_class is None:
+        return None
+    if mhc_class == 1:
+        mhc_class = "I"
+    elif mhc_class == 2:
+        mhc_class = "II"
+    if mhc_class not in {"I", "II"}:
+        raise ValueError("Invalid MHC class: %s" % mhc_class)
+    return mhc_class
+
+def normalize_allele_name(name : str) -> str:
+    """
+    Canonical form of an allele name used to match names which only differ
+    in formatting: case, whitespace, the "*" and ":" separators and a space
+    instead of a dash after "HLA", e.g. "hla a*02:01" -> "HLA-A0201".
+    """
+    key = " ".join(str(name).split()).upper()
+    key = key.replace("*", "").replace(":", "")
+    key = _HLA_SPACE_REGEX.sub("HLA-", key)
+    return key
+
+_HLA_SPACE_REGEX = re.compile(r"^HLA[ _]+")
+
+_CLASS_REGEX = re.compile(r"CLASS[ -]*(II|I)\b")
+
+# number of distinct names whose resolution is kept by resolve_alleles,
+# evicting the least recently used first
+RESOLUTION_CACHE_SIZE = 100000
+
+_resolution_cache = {"registry": None, "resolved": OrderedDict()}
+
+def _resolve_allele(registry, name):
+    allele = registry.get(name)
+    if allele is not None:
+        return (allele.name, allele.mhc_class, allele.locus, allele.organism)
+    normalized_index = registry.normalized_index()
+    key = normalize_allele_name(name)
+    allele = normalized_index.get(key)
+    if allele is None and not key.startswith("HLA-"):
+        # names like "A*02:01" which leave out the species prefix
+        allele = normalized_index.get("HLA-" + key)
+    if allele is not None:
+        return (allele.name, allele.mhc_class, allele.locus, allele.organism)
+    # names which only give the class, e.g. "HLA class I" or
+    # "Class I,allele undetermined"
+    match = _CLASS_REGEX.search(key)
+    if match is not None:
+        return (None, match.group(1), None, None)
+    return (None, None, None, None)
+
+def resolve_alleles(names) -> pd.DataFrame:
+    """
+    Resolve free-text MHC restriction names (e.g. "HLA-A2", "HLA-A*0201",
+    "HLA class I") against the IEDB allele list.
+
+    Each distinct name is resolved once, first by exact name or synonym,
+    then by its normalize_allele_name form (also trying an "HLA-" prefix),
+    and finally by taking just the MHC class from names such as
+    "Class I,allele undetermined". The resolutions of the last
+    RESOLUTION_CACHE_SIZE distinct names are cached across calls.
+
+    The loaders' mhc_class filters don't use this (see classify_alleles).
+
+    Parameters
+    ----------
+    names
+        Sequence or Series of allele names, may contain missing values
+
+    Returns DataFrame aligned with names (sharing the index of a Series)
+    with columns "name", "mhc_class", "locus" and "organism", which are
+    null where nothing could be resolved.
+    """
+    if isinstance(names, pd.Series):
+        index = names.index
+    else:
+        names = pd.Series(list(names), dtype=object)
+        index = names.index
+    registry = load_allele_registry()
+    if _resolution_cache["registry"] is not registry:
+        _resolution_cache["registry"] = registry
+        _resolution_cache["resolved"] = OrderedDict()
+    resolved = _resolution_cache["resolved"]
+    codes, unique_names = pd.factorize(names)
+    rows = []
+    for name in unique_names:
+        name = str(name)
+        if name in resolved:
+            resolved.move_to_end(name)
+        else:
+            resolved[name] = _resolve_allele(registry, name)
+            while len(resolved) > RESOLUTION_CACHE_SIZE:
+                resolved.popitem(last=False)
+        rows.append(resolved[name])
+    # extra row at the end so that missing names (code -1) resolve to nothing
+    rows.append((None, None, None, None))
+    unique_values = np.array(rows, dtype=object).reshape((len(rows), 4))
+    values = unique_values[codes]
+    return pd.DataFrame({
+        "name": values[:, 0],
+        "mhc_class": values[:, 1],
+        "locus": values[:, 2],
+        "organism": values[:, 3],
+    }, index=index)
+
+def classify_alleles(
+        allele_names : pd.Series,
+        fallback_classes : pd.Series | None = None) -> pd.Series:
+    """
+    Look up the MHC class of every allele name in the IEDB allele list.
+    Each distinct name is only looked up once, so the cost scales with the
+    number of distinct alleles rather than the number of rows.
+
+    Names are matched exactly (including synonyms), so that the loaders'
+    mhc_class filters follow the export's own class column wherever a name
+    isn't in the allele list. Use resolve_alleles to also match names which
+    differ in formatting.
+
+    Parameters
+    ----------
+    allele_names
+        Allele names, e.g. the MHC restriction column of an IEDB export
+
+    fallback_classes
+        Classes to use for names missing from the allele list, such as
+        "HLA class I" or "Class I,allele undetermined" (e.g. the MHC
+        restriction class column of an IEDB export)
+
+    Returns Series of classes aligned with allele_names, null where unknown.
+    """
+    codes, unique_names = pd.factorize(allele_names)
+    class_dict = load_allele_class_dict()
+    # extra None at the end so that missing names (code -1) map to None
+    unique_classes = np.array(
+        [class_dict.get(name) for name in unique_names] + [None],
+        dtype=object)
+    classes = pd.Series(unique_classes[codes], index=allele_names.index)
+    if fallback_classes is not None:
+        classes = classes.where(classes.notnull(), fallback_classes)
+    return classes
+
+def mhc_class_mask(
+        allele_names : pd.Series | None,
+        mhc_class : int | str,
+        fallback_classes : pd.Series | None = None) -> pd.Series:
+    """
+    Boolean mask of which alleles belong to the given MHC class (1, 2,
+    "I" or "II"), see classify_alleles.
+    """
+    mhc_class = normalize_mhc_class(mhc_class)
+    if allele_names is None:
+        classes = fallback_classes
+    else:
+        classes = classify_alleles(allele_names, fallback_classes)
+    return (classes == mhc_class).astype(bool)
@@ -0,0 +1,307 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Cleaning of the epitope sequences of the IEDB exports, shared by the
+T-cell and MHC ligand loaders.
+
+All the epitopes are concatenated into one byte array and every step works
+on that array with lookup tables rather than a regex or string method per
+row:
+    1) case normalization (lowercase letters are upper-cased)
+    2) modification stripping: names such as "SIINFEKL + OX(M1)" are cut
+       at their first space or "+", leaving the residues (the modification
+       itself stays in the "Modified Residue(s)" column)
+    3) non-standard residue detection: any byte left which isn't one of the
+       20 canonical amino acids
+    4) length computation
+The number of rows affected by each step is returned as CleaningStats.
+"""
+
+from __future__ import annotations
+
+import logging
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from ..amino_acid_alphabet import canonical_amino_acid_letters
+from .common import import_pyarrow
+
+CleaningStats = namedtuple("CleaningStats", [
+    "n_rows",
+    "n_null",
+    "n_lowercase",
+    "n_modified",
+    "n_empty",
+    "n_nonstandard",
+    "n_valid",
+])
+
+# class of every byte, so that one lookup over all the epitopes finds every
+# byte which isn't a standard residue
+STANDARD = 0
+LOWERCASE = 1
+MODIFICATION = 2
+NONSTANDARD = 3
+
+_is_standard = np.zeros(256, dtype="bool")
+_is_standard[[ord(c) for c in canonical_amino_acid_letters]] = True
+
+_byte_classes = np.full(256, NONSTANDARD, dtype="uint8")
+_byte_classes[_is_standard] = STANDARD
+_byte_classes[ord("a"):ord("z") + 1] = LOWERCASE
+# modified epitopes are named like "SIINFEKL + OX(M1)"
+_byte_classes[[ord(" "), ord("+")]] = MODIFICATION
+
+_to_uppercase = np.arange(256, dtype="uint8")
+_to_uppercase[ord("a"):ord("z") + 1] -= ord("a") - ord("A")
+
+class CleanedEpitopes(object):
+    """
+    Result of clean_epitopes, with one entry per input row.
+
+    Parameters
+    ----------
+    sequences : pd.Series
+        Upper-cased sequences without modifications (missing values stay
+        missing)
+
+    lengths : np.ndarray
+        Number of residues of each sequence (0 for missing values), counted
+        in UTF-8 bytes for the rare sequences with non-ASCII letters
+
+    null, lowercase, modified, nonstandard : np.ndarray
+        Boolean flags of missing values, sequences which had lowercase
+        letters, sequences which had a modification stripped (or are listed
+        as modified) and sequences which are empty or contain letters
+        outside the 20 canonical amino acids
+
+    stats : CleaningStats
+    """
+    def __init__(
+            self, sequences, lengths, null, lowercase, modified, nonstandard, stats):
+        self.sequences = sequences
+        self.lengths = lengths
+        self.null = null
+        self.lowercase = lowercase
+        self.modified = modified
+        self.nonstandard = nonstandard
+        self.stats = stats
+
+    @property
+    def valid(self):
+        return ~self.null & ~self.nonstandard
+
+    def __len__(self):
+        return len(self.lengths)
+
+def _string_bytes(values : pd.Series):
+    """
+    Byte offsets (one more than the number of values), concatenated bytes
+    and missing value flags of a column of strings. With pyarrow these are
+    the buffers of the column's UTF-8 Arrow representation, so columns which
+    are already Arrow strings aren't copied.
+    """
+    null = values.isnull().to_numpy()
+    pa = import_pyarrow()
+    if pa is not None:
+        try:
+            array = pa.array(values, type=pa.large_string(), from_pandas=True)
+        except pa.ArrowException:
+            # e.g. numbers mixed in with the strings
+            array = None
+        if isinstance(array, pa.ChunkedArray):
+            # Arrow string columns read from several Parquet row groups
+            array = array.combine_chunks()
+        if array is not None:
+            offsets = np.frombuffer(array.buffers()[1], dtype="int64")[
+                array.offset:array.offset + len(array) + 1]
+            data = array.buffers()[2]
+            data = np.zeros(0, dtype="uint8") if data is None else \
+                np.frombuffer(data, dtype="uint8")
+            return offsets - offsets[0], data[offsets[0]:offsets[-1]], null
+    # latin-1 keeps one byte per character, anything else becomes "?"
+    # (which isn't a standard residue)
+    strings = ["" if is_null else str(value) for (value, is_null) in zip(values, null)]
+    lengths = np.fromiter((len(s) for s in strings), dtype="int64", count=len(strings))
+    offsets = np.zeros(len(strings) + 1, dtype="int64")
+    np.cumsum(lengths, out=offsets[1:])
+    data = np.frombuffer(
+        "".join(strings).encode("latin-1", errors="replace"), dtype="uint8")
+    return offsets, data, null
+
+def _strings_from_bytes(offsets, data, null, like : pd.Series) -> pd.Series:
+    """
+    Inverse of _string_bytes, giving a Series with the index, name and
+    dtype of another.
+    """
+    pa = import_pyarrow()
+    if pa is not None:
+        validity = pa.array(~null).buffers()[1] if null.any() else None
+        array = pa.LargeStringArray.from_buffers(
+            len(null), pa.py_buffer(offsets), pa.py_buffer(data), validity)
+        result = pd.Series(
+            pd.arrays.ArrowStringArray(array), index=like.index, name=like.name)
+    else:
+        text = data.tobytes().decode("latin-1")
+        values = np.full(len(null), None, dtype=object)
+        for i in np.flatnonzero(~null).tolist():
+            values[i] = text[offsets[i]:offsets[i + 1]]
+        result = pd.Series(values, index=like.index, name=like.name)
+    if like.dtype == object:
+        # as for pandas string methods, missing values come back as NaN
+        return pd.Series(
+            np.where(null, np.nan, result.to_numpy(dtype=object, na_value=None)),
+            index=like.index, name=like.name, dtype=object)
+    return result.astype(like.dtype)
+
+def _rows_of(positions, offsets):
+    return np.searchsorted(offsets, positions, side="right") - 1
+
+def _clean_bytes(offsets, data):
+    """
+    Clean concatenated strings, returning new offsets and bytes (or the
+    same ones if nothing changed) and per-string flags of which had
+    lowercase letters, a modification or non-standard residues.
+    """
+    n = len(offsets) - 1
+    classes = _byte_classes[data]
+    # everything after this only looks at the (few) other bytes
+    special = np.flatnonzero(classes)
+    special_classes = classes[special]
+
+    lowercase = np.zeros(n, dtype="bool")
+    lowercase_positions = special[special_classes == LOWERCASE]
+    if len(lowercase_positions) > 0:
+        lowercase[_rows_of(lowercase_positions, offsets)] = True
+        data = data.copy()
+        data[lowercase_positions] = _to_uppercase[data[lowercase_positions]]
+        special_classes[special_classes == LOWERCASE] = np.where(
+            _is_standard[data[lowercase_positions]], STANDARD, NONSTANDARD)
+
+    # cut each string at its first space or "+"
+    cut_positions = special[special_classes == MODIFICATION]
+    cut_rows, first = np.unique(_rows_of(cut_positions, offsets), return_index=True)
+    cut_positions = cut_positions[first]
+    modified = np.zeros(n, dtype="bool")
+    modified[cut_rows] = True
+    ends = offsets[1:].copy()
+    ends[cut_rows] = cut_positions
+
+    nonstandard = np.zeros(n, dtype="bool")
+    bad_positions = special[special_classes == NONSTANDARD]
+    bad_rows = _rows_of(bad_positions, offsets)
+    nonstandard[bad_rows[bad_positions < ends[bad_rows]]] = True
+
+    if len(cut_rows) > 0:
+        # drop the bytes from each cut to the end of its string
+        removed_lengths = offsets[cut_rows + 1] - cut_positions
+        removed = np.arange(removed_lengths.sum()) + np.repeat(
+            cut_positions - np.cumsum(removed_lengths) + removed_lengths,
+            removed_lengths)
+        keep = np.ones(len(data), dtype="bool")
+        keep[removed] = False
+        data = data[keep]
+        lengths = ends - offsets[:-1]
+        offsets = np.zeros(n + 1, dtype="int64")
+        np.cumsum(lengths, out=offsets[1:])
+    return offsets, data, lowercase, modified, nonstandard
+
+def _expand(values, codes, missing):
+    """
+    Per-row values of a categorical column from per-category values, with
+    an extra entry at the end for missing values (whose code is -1).
+    """
+    return np.append(values, missing)[codes]
+
+def clean_epitopes(
+        epitopes : pd.Series,
+        modifications : pd.Series | None = None) -> CleanedEpitopes:
+    """
+    Normalize case, strip modifications, flag non-standard residues and
+    compute the lengths of a column of epitope sequences (e.g. the result
+    of get_epitope_name), in one pass over their bytes.
+
+    Parameters
+    ----------
+    epitopes
+        Epitope names, which can be categorical (then only the distinct
+        values are cleaned)
+
+    modifications
+        Matching column of get_epitope_modifications, whose non-missing
+        entries mark rows as modified even if the name doesn't say so
+    """
+    n = len(epitopes)
+    if isinstance(epitopes.dtype, pd.CategoricalDtype):
+        codes = epitopes.cat.codes.to_numpy()
+        categories = clean_epitopes(pd.Series(epitopes.cat.categories))
+        null = codes < 0
+        # distinct categories can become equal once cleaned
+        category_codes, cleaned_categories = pd.factorize(categories.sequences)
+        sequences = pd.Series(
+            pd.Categorical.from_codes(
+                _expand(category_codes, codes, -1), categories=cleaned_categories),
+            index=epitopes.index,
+            name=epitopes.name)
+        lengths = _expand(categories.lengths, codes, 0)
+        lowercase = _expand(categories.lowercase, codes, False)
+        modified = _expand(categories.modified, codes, False)
+        nonstandard = _expand(categories.nonstandard, codes, False)
+    else:
+        offsets, data, null = _string_bytes(epitopes)
+        new_offsets, new_data, lowercase, modified, nonstandard = \
+            _clean_bytes(offsets, data)
+        lengths = np.diff(new_offsets)
+        if new_data is data:
+            sequences = epitopes
+        else:
+            sequences = _strings_from_bytes(new_offsets, new_data, null, epitopes)
+    if modifications is not None:
+        modified |= modifications.notnull().to_numpy()
+    empty = ~null & (lengths == 0)
+    nonstandard |= empty
+    stats = CleaningStats(
+        n_rows=n,
+        n_null=int(null.sum()),
+        n_lowercase=int(lowercase.sum()),
+        n_modified=int(modified.sum()),
+        n_empty=int(empty.sum()),
+        n_nonstandard=int(nonstandard.sum()),
+        n_valid=int((~null & ~nonstandard).sum()))
+    return CleanedEpitopes(
+        sequences=sequences,
+        lengths=lengths,
+        null=null,
+        lowercase=lowercase,
+        modified=modified,
+        nonstandard=nonstandard,
+        stats=stats)
+
+def clean_dataframe(df : pd.DataFrame) -> CleanedEpitopes | None:
+    """
+    Replace the epitope column of an IEDB DataFrame (in place) with its
+    cleaned sequences and record the CleaningStats, as a dictionary, in
+    df.attrs["epitope_cleaning"]. Returns None if there's no epitope column.
+    """
+    from .columns import get_epitope_modifications, get_epitope_name
+    epitopes = get_epitope_name(df)
+    if epitopes is None:
+        return None
+    cleaned = clean_epitopes(epitopes, get_epitope_modifications(df))
+    if cleaned.sequences is not epitopes:
+        df[epitopes.name] = cleaned.sequences
+    df.attrs["epitope_cleaning"] = cleaned.stats._asdict()
+    logging.info("Cleaned epitopes: %s", cleaned.stats)
+    return cleaned
@@ -0,0 +1,364 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Columnar (Parquet) cache for the IEDB CSV exports.
+
+Parsing the full IEDB exports with pandas takes most of a minute, so the
+first full load of a CSV writes a normalized Parquet copy next to it. The
+Parquet file records the size and modification time of the CSV it was built
+from and is ignored (and rebuilt) as soon as either of them changes.
+
+Parquet can't store the two-row (group, column) header of the IEDB exports
+directly, so columns are flattened to "group :: column" strings on disk and
+turned back into a MultiIndex when loaded. The Parquet copy is written in
+row groups of ROW_GROUP_SIZE rows so that filtered scans (scan_table) can
+skip decoding most of the table.
+
+The cache requires pyarrow; without it every load parses the CSV.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+from typing import Callable, Iterator
+
+import numpy as np
+import pandas as pd
+
+from .common import atomic_write, import_pyarrow
+
+COLUMN_SEPARATOR = " :: "
+
+# Rows per Parquet row group, which is also the granularity at which
+# scan_table skips data that doesn't pass a filter.
+ROW_GROUP_SIZE = 65536
+
+FINGERPRINT_METADATA_KEY = b"pepdata.source_fingerprint"
+
+def source_fingerprint(path : str) -> str:
+    """
+    Summarize the size and modification time of a file, used to decide
+    whether anything derived from it is stale.
+    """
+    stat = os.stat(path)
+    return "%d:%d" % (stat.st_size, stat.st_mtime_ns)
+
+def cached_table_path(csv_path : str) -> str:
+    """
+    Location of the Parquet copy of an IEDB CSV (next to the CSV itself).
+    """
+    base, _ = os.path.splitext(csv_path)
+    return base + ".parquet"
+
+def flatten_columns(columns : pd.Index) -> list[str]:
+    return [COLUMN_SEPARATOR.join(pair) for pair in columns]
+
+def unflatten_columns(names : list[str]) -> pd.MultiIndex:
+    pairs = []
+    for name in names:
+        group, _, col = name.partition(COLUMN_SEPARATOR)
+        pairs.append((group, col))
+    return pd.MultiIndex.from_tuples(pairs)
+
+def _drop_unnamed_columns(df : pd.DataFrame) -> pd.DataFrame:
+    # Sometimes the IEDB seems to put in an extra comma in the
+    # header line, which creates an unnamed column of NaNs.
+    # To deal with this, drop any columns without a name in either
+    # header row. This only looks at the header so that every chunk
+    # of a streamed CSV ends up with the same columns.
+    unnamed = [
+        all(str(name).startswith("Unnamed:") for name in pair)
+        for pair in df.columns
+    ]
+    if not any(unnamed):
+        return df
+    return df.loc[:, [not u for u in unnamed]]
+
+def read_csv(
+        csv_path : str,
+        nrows : int | None = None,
+        on_bad_lines : str = "warn",
+        chunksize : int | None = None) -> pd.DataFrame | Iterator[pd.DataFrame]:
+    """
+    Parse an IEDB CSV export with its two-row header. If chunksize is given
+    then returns an iterator over DataFrames of at most that many rows.
+    """
+    result = pd.read_csv(
+        csv_path,
+        header=[0, 1],
+        skipinitialspace=True,
+        nrows=nrows,
+        chunksize=chunksize,
+        low_memory=False,
+        on_bad_lines=on_bad_lines,
+        encoding="latin-1")
+    if chunksize is None:
+        return _drop_unnamed_columns(result)
+    return (_drop_unnamed_columns(chunk) for chunk in result)
+
+def _normalize_for_storage(df : pd.DataFrame) -> pd.DataFrame:
+    """
+    Columns which mix numbers and strings (e.g. a count column containing
+    the occasional free-text note) can't be written to Parquet, so store
+    their non-null values as strings.
+    """
+    df = df.copy()
+    for key in df.columns:
+        column = df[key]
+        if column.dtype != object:
+            continue
+        inferred = pd.api.types.infer_dtype(column, skipna=True)
+        if inferred.startswith("mixed"):
+            df[key] = column.map(lambda x: x if pd.isnull(x) else str(x))
+    return df
+
+def is_fresh(csv_path : str) -> bool:
+    """
+    Does the Parquet copy of csv_path exist and match the CSV's current
+    size and modification time?
+    """
+    pa = import_pyarrow()
+    table_path = cached_table_path(csv_path)
+    if pa is None or not os.path.exists(table_path):
+        return False
+    try:
+        metadata = pa.parquet.read_schema(table_path).metadata or {}
+    except (OSError, pa.ArrowException):
+        return False
+    expected = source_fingerprint(csv_path).encode("ascii")
+    return metadata.get(FINGERPRINT_METADATA_KEY) == expected
+
+def write_table(df : pd.DataFrame, csv_path : str) -> str:
+    """
+    Write a normalized copy of a parsed IEDB CSV next to it, tagged
+    with the CSV's fingerprint. Returns the path of the Parquet file.
+    """
+    pa = import_pyarrow()
+    if pa is None:
+        raise ImportError("Writing IEDB table cache requires pyarrow")
+    table_path = cached_table_path(csv_path)
+    fingerprint = source_fingerprint(csv_path)
+    flat = _normalize_for_storage(df)
+    flat.columns = flatten_columns(df.columns)
+    table = pa.Table.from_pandas(flat, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[FINGERPRINT_METADATA_KEY] = fingerprint.encode("ascii")
+    table = table.replace_schema_metadata(metadata)
+    with atomic_write(table_path) as tmp_path:
+        pa.parquet.write_table(table, tmp_path, row_group_size=ROW_GROUP_SIZE)
+    return table_path
+
+def read_table(
+        csv_path : str,
+        columns : list[tuple[str, str]] | None = None,
+        nrows : int | None = None) -> pd.DataFrame:
+    """
+    Load the (fresh) Parquet copy of an IEDB CSV, memory-mapping the file
+    and decoding only the requested (group, column) pairs.
+    """
+    pa = import_pyarrow()
+    table_path = cached_table_path(csv_path)
+    flat_columns = None if columns is None else flatten_columns(columns)
+    if nrows is None:
+        table = pa.parquet.read_table(
+            table_path, columns=flat_columns, memory_map=True)
+    else:
+        parquet_file = pa.parquet.ParquetFile(table_path, memory_map=True)
+        batches = []
+        n = 0
+        for batch in parquet_file.iter_batches(columns=flat_columns):
+            batches.append(batch)
+            n += batch.num_rows
+            if n >= nrows:
+                break
+        schema = parquet_file.schema_arrow
+        if flat_columns is not None:
+            schema = pa.schema([schema.field(c) for c in flat_columns])
+        table = pa.Table.from_batches(batches, schema=schema)
+        table = table.slice(0, nrows)
+    df = table.to_pandas()
+    df.columns = unflatten_columns(list(df.columns))
+    return df
+
+def _build_table(csv_path : str, on_bad_lines : str = "warn") -> pd.DataFrame:
+    """
+    Parse the full CSV and write its Parquet copy (if pyarrow is available).
+    """
+    df = read_csv(csv_path, on_bad_lines=on_bad_lines)
+    if import_pyarrow() is not None:
+        try:
+            write_table(df, csv_path)
+        except OSError as e:
+            logging.warning(
+                "Unable to write IEDB table cache for %s: %s", csv_path, e)
+    return df
+
+def load_table(
+        csv_path : str,
+        columns : list[tuple[str, str]] | None = None,
+        nrows : int | None = None,
+        on_bad_lines : str = "warn") -> pd.DataFrame:
+    """
+    Load an IEDB CSV export, going through its Parquet copy when possible.
+
+    Parameters
+    ----------
+    csv_path
+        Local path of the IEDB CSV
+
+    columns
+        Only load these (group, column) pairs. Only the Parquet copy can
+        skip decoding the other columns.
+
+    nrows
+        Only load the first nrows rows. Partial loads never create
+        the Parquet copy but will read from an existing one.
+
+    on_bad_lines
+        Passed to pandas.read_csv when parsing the CSV
+    """
+    if is_fresh(csv_path):
+        logging.info("Loading cached IEDB table for %s", csv_path)
+        return read_table(csv_path, columns=columns, nrows=nrows)
+    if nrows is None:
+        df = _build_table(csv_path, on_bad_lines=on_bad_lines)
+    else:
+        df = read_csv(csv_path, nrows=nrows, on_bad_lines=on_bad_lines)
+    if columns is not None:
+        df = df[list(columns)]
+    return df
+
+def table_columns(csv_path : str) -> pd.MultiIndex:
+    """
+    (group, column) pairs of an IEDB CSV, read from the Parquet schema
+    or the CSV header without loading any rows.
+    """
+    if is_fresh(csv_path):
+        pa = import_pyarrow()
+        schema = pa.parquet.read_schema(cached_table_path(csv_path))
+        return unflatten_columns(schema.names)
+    return read_csv(csv_path, nrows=0).columns
+
+def _scan_parquet(
+        csv_path : str,
+        mask_fn : Callable[[pd.DataFrame], np.ndarray],
+        filter_columns : list[tuple[str, str]] | None,
+        nrows : int | None,
+        chunksize : int) -> Iterator[pd.DataFrame]:
+    pa = import_pyarrow()
+    parquet_file = pa.parquet.ParquetFile(
+        cached_table_path(csv_path), memory_map=True)
+    flat_filter_columns = \
+        None if filter_columns is None else flatten_columns(filter_columns)
+    offset = 0
+    for i in range(parquet_file.num_row_groups):
+        if nrows is not None and offset >= nrows:
+            break
+        filter_table = parquet_file.read_row_group(i, columns=flat_filter_columns)
+        n_rows = filter_table.num_rows
+        if nrows is not None and offset + n_rows > nrows:
+            n_rows = nrows - offset
+            filter_table = filter_table.slice(0, n_rows)
+        filter_df = filter_table.to_pandas()
+        filter_df.columns = unflatten_columns(list(filter_df.columns))
+        mask = np.asarray(mask_fn(filter_df), dtype=bool)
+        # only decode the rest of the row group if something passed
+        row_group = None
+        for start in range(0, n_rows, chunksize):
+            indices = np.flatnonzero(mask[start:start + chunksize]) + start
+            if len(indices) == 0:
+                continue
+            if row_group is None:
+                row_group = parquet_file.read_row_group(i)
+            df = row_group.take(indices).to_pandas()
+            df.columns = unflatten_columns(list(df.columns))
+            df.index = pd.RangeIndex(offset, offset + n_rows)[indices]
+            yield df
+        offset += n_rows
+
+def _empty_table(csv_path : str) -> pd.DataFrame:
+    return pd.DataFrame(columns=table_columns(csv_path))
+
+def scan_table(
+        csv_path : str,
+        mask_fn : Callable[[pd.DataFrame], np.ndarray],
+        filter_columns : list[tuple[str, str]] | None = None,
+        nrows : int | None = None,
+        on_bad_lines : str = "warn",
+        chunksize : int = ROW_GROUP_SIZE,
+        build_table : bool = True) -> Iterator[pd.DataFrame]:
+    """
+    Generate the rows of an IEDB CSV export which pass a filter, one chunk
+    at a time, without ever holding the whole table in memory once the
+    Parquet copy exists.
+
+    With a fresh Parquet copy, only filter_columns are decoded for each row
+    group and the remaining columns are only read for row groups which have
+    rows passing the filter. Otherwise the CSV is parsed in full to build
+    the Parquet copy or, for partial loads and when build_table is False,
+    streamed in chunks.
+
+    Parameters
+    ----------
+    csv_path
+        Local path of the IEDB CSV
+
+    mask_fn
+        Function from a DataFrame to a boolean array of rows to keep.
+        It may only be given filter_columns.
+
+    filter_columns
+        (group, column) pairs used by mask_fn, all columns if None
+
+    nrows
+        Only consider the first nrows rows of the export
+
+    on_bad_lines
+        Passed to pandas.read_csv when parsing the CSV
+
+    chunksize
+        Maximum number of rows of the export behind each yielded chunk
+
+    build_table
+        Parse the whole CSV to build a missing or stale Parquet copy
+        (the only step which needs memory for the full table)
+
+    Yields non-empty DataFrames with all columns and the index of each row
+    in the full export, or a single empty DataFrame if no rows pass.
+    """
+    if is_fresh(csv_path):
+        chunks = _scan_parquet(
+            csv_path, mask_fn, filter_columns, nrows, chunksize)
+    else:
+        if build_table and nrows is None and import_pyarrow() is not None:
+            df = _build_table(csv_path, on_bad_lines=on_bad_lines)
+            unfiltered_chunks = (
+                df.iloc[start:start + chunksize]
+                for start in range(0, len(df), chunksize))
+        else:
+            unfiltered_chunks = read_csv(
+                csv_path,
+                nrows=nrows,
+                on_bad_lines=on_bad_lines,
+                chunksize=chunksize)
+        chunks = (
+            chunk[np.asarray(mask_fn(chunk), dtype=bool)]
+            for chunk in unfiltered_chunks)
+    n_yielded = 0
+    for chunk in chunks:
+        if len(chunk) > 0:
+            n_yielded += 1
+            yield chunk
+    if n_yielded == 0:
+        yield _empty_table(csv_path)
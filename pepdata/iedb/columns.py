@@ -52,6 +52,20 @@ def find(df : pd.DataFrame, group_candidates : list[str], column_candidates : li
     return df[best]
 
 
+def find_keys(columns : pd.Index, getters : list) -> list[tuple[str, str] | None]:
+    """
+    Resolve which (group, column) pair each getter (e.g. get_mhc_allele)
+    would pick out of a DataFrame with the given columns, without needing
+    any of its rows. Getters which find nothing give None.
+    """
+    empty = pd.DataFrame(columns=columns)
+    keys = []
+    for getter in getters:
+        series = getter(empty)
+        keys.append(None if series is None else series.name)
+    return keys
+
+
 MHC_GROUP_CANDIDATES : list[str] = ["MHC", "MHC Restriction"]
 EPITOPE_GROUP_CANDIDATES : list[str] = ["Epitope"] 
 ASSAY_GROUP_CANDIDATES : list[str] = ["Assay"]
@@ -175,3 +189,25 @@ def get_host_name(
         group_candidates : list[str] = HOST_GROUP_CANDIDATES, 
         column_candidates : list[str] = ["Name"]) -> pd.Series | None:
     return find(df, group_candidates, column_candidates)
+
+
+# Columns with few distinct values compared to the number of rows, which
+# are stored as categoricals by the loaders
+LOW_CARDINALITY_GETTERS = [
+    get_mhc_allele,
+    get_mhc_class,
+    get_assay_method,
+    get_assay_units,
+    get_host_name,
+    get_epitope_source_organism,
+]
+
+def categorize(df : pd.DataFrame, getters : list = LOW_CARDINALITY_GETTERS) -> pd.DataFrame:
+    """
+    Convert the columns found by each getter to the category dtype (in place),
+    so that each distinct string is only stored and matched against once.
+    """
+    for key in find_keys(df.columns, getters):
+        if key is not None and not isinstance(df[key].dtype, pd.CategoricalDtype):
+            df[key] = df[key].astype("category")
+    return df
@@ -12,8 +12,111 @@
 
 from __future__ import annotations
 
+from contextlib import contextmanager
+import os
+
 import datacache
+import numpy as np
+import pandas as pd
 
 cache = datacache.Cache("pepdata")
 
 bad_amino_acids = 'U|X|J|B|Z'
+
+@contextmanager
+def atomic_write(path : str, suffix : str = ""):
+    """
+    Context manager giving a temporary path next to path, which replaces
+    path when the block finishes without an error. Readers (including
+    other processes) see either the old file or the complete new one.
+    The temporary file is removed if the block fails.
+
+    Parameters
+    ----------
+    path : str
+        File to write
+
+    suffix : str
+        Extension of the temporary path, for writers which would otherwise
+        append one (np.save adds ".npy", np.savez ".npz")
+    """
+    tmp_path = "%s.%d.tmp%s" % (path, os.getpid(), suffix)
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def import_pyarrow():
+    """
+    The pyarrow module (with pyarrow.parquet loaded), or None if pyarrow
+    isn't installed. pyarrow is optional: without it the IEDB exports are
+    parsed from CSV every time and string columns are converted in Python.
+    """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        return None
+    return pyarrow
+
+SOURCES = ("tcell", "mhc")
+
+def _source_module(source : str):
+    """
+    Loader module of an IEDB export: tcell for "tcell" and mhc for "mhc".
+    """
+    if source not in SOURCES:
+        raise ValueError(
+            "Unknown IEDB source %r, expected one of: %s" % (
+                source, ", ".join(SOURCES)))
+    from . import mhc, tcell
+    return {"tcell": tcell, "mhc": mhc}[source]
+
+# filters of the loaders which usually keep a small part of an export
+SELECTIVE_FILTERS = (
+    "mhc_class",
+    "hla",
+    "human_only",
+    "peptide_length",
+    "assay_method",
+)
+
+def is_selective(filters : dict) -> bool:
+    """
+    Do the keyword arguments of a load_dataframe call narrow the export
+    down enough that scanning for the matching rows beats loading it all?
+    """
+    return any(filters.get(name) for name in SELECTIVE_FILTERS)
+
+def _per_category(series : pd.Series, fn) -> pd.Series:
+    """
+    Apply a vectorized string predicate to the categories of a categorical
+    Series (rather than every row) and map the result back onto the rows.
+    Missing values give False.
+    """
+    category_result = np.asarray(fn(series.cat.categories.to_series()), dtype=bool)
+    # extra False at the end for missing values, whose code is -1
+    category_result = np.append(category_result, False)
+    return pd.Series(
+        category_result[series.cat.codes.values],
+        index=series.index)
+
+def str_contains(series : pd.Series, pattern : str) -> pd.Series:
+    """
+    Boolean mask of which values match a regex, missing values are False.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return _per_category(
+            series, lambda s: s.str.contains(pattern, na=False))
+    return series.str.contains(pattern, na=False).astype(bool)
+
+def str_startswith(series : pd.Series, prefix : str) -> pd.Series:
+    """
+    Boolean mask of which values start with a prefix, missing values are False.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return _per_category(
+            series, lambda s: s.str.startswith(prefix, na=False))
+    return series.str.startswith(prefix, na=False).astype(bool)
@@ -10,38 +10,325 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from __future__ import annotations
+
+from collections import OrderedDict, namedtuple
 from functools import wraps
+import hashlib
+import inspect
+import logging
+import os
+import pickle
+import sys
+import threading
+
+import numpy as np
+import pandas as pd
+
+CacheInfo = namedtuple("CacheInfo", [
+    "hits",
+    "misses",
+    "disk_hits",
+    "maxsize",
+    "maxbytes",
+    "currsize",
+    "currbytes",
+])
+
+def _canonicalize(value):
+    """
+    Turn a value into something hashable, treating equal dicts, lists
+    and sets as equal regardless of order (for dicts and sets) or type
+    (list vs. tuple). Anything else which can't be hashed is replaced
+    by its repr.
+    """
+    if isinstance(value, dict):
+        return ("dict", tuple(sorted(
+            ((_canonicalize(k), _canonicalize(v)) for (k, v) in value.items()),
+            key=repr)))
+    if isinstance(value, (list, tuple)):
+        return tuple(_canonicalize(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(_canonicalize(v) for v in value)
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return repr(value)
 
-def _prepare_memoization_key(args, kwargs):
+def _prepare_memoization_key(signature, args, kwargs):
     """
-    Make a tuple of arguments which can be used as a key
-    for a memoized function's lookup_table. If some object can't be hashed
-    then used its __repr__ instead.
+    Make a tuple of arguments which can be used as a key for a memoized
+    function's lookup table. Arguments are bound to the function's signature
+    (with defaults filled in) so that passing the same value positionally,
+    by keyword or not at all all give the same key.
+    """
+    if signature is None:
+        return (
+            tuple(_canonicalize(arg) for arg in args),
+            tuple(sorted((k, _canonicalize(v)) for (k, v) in kwargs.items())))
+    bound = signature.bind(*args, **kwargs)
+    bound.apply_defaults()
+    return tuple(
+        (name, _canonicalize(value))
+        for (name, value) in bound.arguments.items())
+
+def _estimate_nbytes(value):
+    if isinstance(value, pd.DataFrame) or isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_estimate_nbytes(v) for v in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            _estimate_nbytes(k) + _estimate_nbytes(v) for (k, v) in value.items())
+    return sys.getsizeof(value)
+
+def _default_disk_dir():
+    from .common import cache
+    return os.path.join(cache.cache_directory_path, "memoized")
+
+def memoize(
+        fn=None,
+        *,
+        maxsize : int | None = None,
+        maxbytes : int | None = None,
+        disk : bool = False,
+        disk_dir : str | None = None,
+        fingerprint=None):
     """
-    key_list = []
-    for arg in args:
+    Cache the results of a function, keyed on its canonicalized arguments.
+    Can be used either as @memoize or with options as @memoize(maxsize=4).
+
+    Parameters
+    ----------
+    maxsize
+        Maximum number of results kept in memory, evicting the least
+        recently used result first (default: unbounded)
+
+    maxbytes
+        Maximum estimated size of the results kept in memory
+
+    disk
+        Also pickle results to disk and look for them there before
+        calling the function
+
+    disk_dir
+        Directory for pickled results, defaults to a subdirectory of
+        the pepdata cache directory
+
+    fingerprint
+        Function of no arguments describing the data a result was computed
+        from (e.g. the size and modification time of a source file). It's
+        part of every key, so results computed from an older version of
+        the data are never returned. Writing a pickle for one fingerprint
+        deletes the function's pickles of every other fingerprint, so the
+        disk tier only holds results of the current data.
+
+    The wrapped function has extra methods:
+        cache_info() -> CacheInfo with hit/miss counts and current size
+        cache_clear(disk=False) -> drop all results (and pickles if disk=True)
+        cache_configure(maxsize=..., maxbytes=..., disk=...) -> change limits
+        cache_put(value, *args, **kwargs) -> store value as the result of
+            calling the function with args and kwargs
+        cache_get(*args, **kwargs) -> result of calling the function with
+            args and kwargs if it's held in memory, otherwise None (without
+            calling the function or counting a hit or miss)
+        cache_pin(value, *args, **kwargs) -> like cache_put, but the value
+            is never evicted (it still counts towards maxsize and maxbytes)
+            until cache_clear
+    """
+    if fn is None:
+        def decorator(fn):
+            return memoize(
+                fn,
+                maxsize=maxsize,
+                maxbytes=maxbytes,
+                disk=disk,
+                disk_dir=disk_dir,
+                fingerprint=fingerprint)
+        return decorator
+
+    try:
+        signature = inspect.signature(fn)
+    except (TypeError, ValueError):
+        signature = None
+
+    name = "%s.%s" % (fn.__module__, fn.__qualname__)
+    lookup_table = OrderedDict()
+    sizes = {}
+    pinned = set()
+    lock = threading.RLock()
+    settings = {
+        "maxsize": maxsize,
+        "maxbytes": maxbytes,
+        "disk": disk,
+        "disk_dir": disk_dir,
+    }
+    stats = {"hits": 0, "misses": 0, "disk_hits": 0}
+
+    def digest_of(value):
+        return hashlib.sha1(repr(value).encode("utf-8")).hexdigest()
+
+    def disk_path(key):
+        directory = settings["disk_dir"] or _default_disk_dir()
+        if fingerprint is None:
+            filename = "%s-%s.pickle" % (name, digest_of(key))
+        else:
+            # keys with a fingerprint are (arguments, fingerprint)
+            filename = "%s-%s-%s.pickle" % (
+                name, digest_of(key[1])[:16], digest_of(key[0]))
+        return os.path.join(directory, filename)
+
+    def prune_disk(key):
+        """
+        Remove the pickles of every fingerprint other than the one in key.
+        """
+        directory = os.path.dirname(disk_path(key))
+        current = digest_of(key[1])[:16]
+        prefix = name + "-"
+        for filename in os.listdir(directory):
+            if not (filename.startswith(prefix) and filename.endswith(".pickle")):
+                continue
+            if filename[len(prefix):].split("-")[0] != current:
+                try:
+                    os.remove(os.path.join(directory, filename))
+                except OSError:
+                    pass
+
+    def read_disk(key):
+        path = disk_path(key)
+        if not os.path.exists(path):
+            return None
         try:
-            hash(arg)
-            key_list.append(arg)
-        except:
-            key_list.append(repr(arg))
-    for (k, v) in kwargs.items():
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        except Exception as e:
+            logging.warning("Ignoring unreadable cached result %s: %s", path, e)
+            return None
+
+    def write_disk(key, value):
+        from .common import atomic_write
+        path = disk_path(key)
         try:
-            hash(k)
-            hash(v)
-            key_list.append((k, v))
-        except:
-            key_list.append((repr(k), repr(v)))
-    return tuple(key_list)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with atomic_write(path) as tmp_path, open(tmp_path, "wb") as f:
+                pickle.dump((key, value), f, protocol=pickle.HIGHEST_PROTOCOL)
+            if fingerprint is not None:
+                prune_disk(key)
+        except OSError as e:
+            logging.warning("Unable to cache result at %s: %s", path, e)
 
-def memoize(fn):
-    lookup_table = {}
+    def evict():
+        currbytes = sum(sizes.values())
+        # least recently used first, skipping pinned results
+        for old_key in list(lookup_table):
+            if not (
+                    (settings["maxsize"] is not None and
+                        len(lookup_table) > settings["maxsize"]) or
+                    (settings["maxbytes"] is not None and
+                        currbytes > settings["maxbytes"])):
+                break
+            if old_key in pinned:
+                continue
+            del lookup_table[old_key]
+            currbytes -= sizes.pop(old_key, 0)
+
+    def store(key, value):
+        with lock:
+            lookup_table[key] = value
+            if settings["maxbytes"] is not None:
+                sizes[key] = _estimate_nbytes(value)
+            evict()
 
     @wraps(fn)
     def wrapped_fn(*args, **kwargs):
-        key = _prepare_memoization_key(args, kwargs)
-        if key not in lookup_table:
-            lookup_table[key] = fn(*args, **kwargs)
-        return lookup_table[key]
+        key = _prepare_memoization_key(signature, args, kwargs)
+        if fingerprint is not None:
+            key = (key, _canonicalize(fingerprint()))
+        with lock:
+            if key in lookup_table:
+                stats["hits"] += 1
+                lookup_table.move_to_end(key)
+                return lookup_table[key]
+        if settings["disk"]:
+            cached = read_disk(key)
+            if cached is not None and cached[0] == key:
+                with lock:
+                    stats["disk_hits"] += 1
+                store(key, cached[1])
+                return cached[1]
+        with lock:
+            stats["misses"] += 1
+        value = fn(*args, **kwargs)
+        if settings["disk"]:
+            write_disk(key, value)
+        store(key, value)
+        return value
+
+    def cache_info():
+        with lock:
+            return CacheInfo(
+                hits=stats["hits"],
+                misses=stats["misses"],
+                disk_hits=stats["disk_hits"],
+                maxsize=settings["maxsize"],
+                maxbytes=settings["maxbytes"],
+                currsize=len(lookup_table),
+                currbytes=sum(sizes.values()) if settings["maxbytes"] else None)
+
+    def cache_clear(disk=False):
+        with lock:
+            lookup_table.clear()
+            sizes.clear()
+            pinned.clear()
+            for k in stats:
+                stats[k] = 0
+        if disk:
+            directory = settings["disk_dir"] or _default_disk_dir()
+            if os.path.isdir(directory):
+                for filename in os.listdir(directory):
+                    if filename.startswith(name + "-"):
+                        os.remove(os.path.join(directory, filename))
+
+    def cache_configure(**kwargs):
+        unknown = set(kwargs) - set(settings)
+        if unknown:
+            raise ValueError("Unknown cache settings: %s" % sorted(unknown))
+        with lock:
+            settings.update(kwargs)
+            if settings["maxbytes"] is not None:
+                for key, value in lookup_table.items():
+                    if key not in sizes:
+                        sizes[key] = _estimate_nbytes(value)
+            evict()
+
+    def cache_put(value, *args, **kwargs):
+        key = _prepare_memoization_key(signature, args, kwargs)
+        if fingerprint is not None:
+            key = (key, _canonicalize(fingerprint()))
+        store(key, value)
+
+    def cache_pin(value, *args, **kwargs):
+        key = _prepare_memoization_key(signature, args, kwargs)
+        if fingerprint is not None:
+            key = (key, _canonicalize(fingerprint()))
+        with lock:
+            pinned.add(key)
+            store(key, value)
+
+    def cache_get(*args, **kwargs):
+        key = _prepare_memoization_key(signature, args, kwargs)
+        if fingerprint is not None:
+            key = (key, _canonicalize(fingerprint()))
+        with lock:
+            return lookup_table.get(key)
 
+    wrapped_fn.cache_info = cache_info
+    wrapped_fn.cache_clear = cache_clear
+    wrapped_fn.cache_configure = cache_configure
+    wrapped_fn.cache_put = cache_put
+    wrapped_fn.cache_get = cache_get
+    wrapped_fn.cache_pin = cache_pin
     return wrapped_fn
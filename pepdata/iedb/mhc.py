@@ -17,21 +17,45 @@ import os
 
 import pandas as pd
 
+from .alleles import mhc_class_mask
 from .memoize import  memoize
-from .common import bad_amino_acids, cache
+from .cleaning import clean_dataframe, clean_epitopes
+from .common import cache, is_selective, str_contains, str_startswith
+from .columnar import ROW_GROUP_SIZE, load_table, scan_table, source_fingerprint, table_columns
+from .columns import (
+    categorize,
+    find_keys,
+    get_assay_method,
+    get_epitope_name,
+    get_mhc_allele,
+    get_mhc_class,
+)
 
 
 MHC_URL = "https://www.iedb.org/downloader.php?file_name=doc/mhc_ligand_full_single_file.zip"
 MHC_LOCAL_FILENAME = "mhc_ligand_full.csv"
 MHC_DECOMPRESS = True
 
-def download(force=False):
+def download(force=False, url=None):
+    """
+    Download the export (unless it's already present and force is False),
+    optionally from another URL than the IEDB's.
+    """
     return cache.fetch(
         filename=MHC_LOCAL_FILENAME,
-        url=MHC_URL,
+        url=MHC_URL if url is None else url,
         decompress=MHC_DECOMPRESS,
         force=force)
 
+def refresh(url=None):
+    """
+    Download a new copy of the export and update the epitope tables cached
+    from the current one, returning the pepdata.iedb.refresh.ExportDelta
+    of rows inserted and removed.
+    """
+    from .refresh import refresh_export
+    return refresh_export("mhc", url=url)
+
 def local_path(auto_download=True):
     path = cache.local_path(
         filename=MHC_LOCAL_FILENAME,
@@ -48,7 +72,11 @@ def local_path(auto_download=True):
 def delete():
     os.remove(local_path())
 
-@memoize
+def _source_fingerprint():
+    path = local_path()
+    return (path, source_fingerprint(path))
+
+@memoize(maxsize=8, fingerprint=_source_fingerprint)
 def load_dataframe(
         mhc_class : int | None = None,  # 1, 2, or None for neither
         hla : str | None = None,
@@ -58,10 +86,25 @@ def load_dataframe(
         assay_method : str | None = None,
         only_standard_amino_acids : bool = True,
         warn_bad_lines : bool  = True,
-        nrows : int | None = None):
+        nrows : int | None = None,
+        materialize : bool | None = None):
     """
     Load IEDB MHC data without aggregating multiple entries for the same epitope
 
+    Rows are found in one of two ways, with the same result:
+        - masking the unfiltered export, which is loaded once (per nrows)
+          and kept in memory, after which every combination of filters
+          only costs a vectorized mask
+        - scanning the export for the matching rows (see iter_dataframes),
+          which reads it again for each combination of filters but only
+          decodes the columns needed to filter, and doesn't keep the full
+          export in memory (it's parsed once to write the Parquet copy if
+          that's missing)
+    If the unfiltered export is already in memory it's always masked.
+    Otherwise materialize decides, by default scanning when any of
+    mhc_class, hla, human_only, peptide_length or assay_method is given
+    and loading the whole export for broader queries.
+
     Parameters
     ----------
     mhc_class 
@@ -93,73 +136,190 @@ def load_dataframe(
 
     nrows
         Don't load the full IEDB dataset but instead read only the first nrows
+
+    materialize
+        Load the whole export to mask it (True) or scan for the matching
+        rows (False), the default (None) decides from the filters
     """
-    df = pd.read_csv(
-            local_path(),
-            header=[0, 1],
-            skipinitialspace=True,
+    filters = dict(
+        mhc_class=mhc_class,
+        hla=hla,
+        exclude_hla=exclude_hla,
+        human_only=human_only,
+        peptide_length=peptide_length,
+        assay_method=assay_method,
+        only_standard_amino_acids=only_standard_amino_acids)
+    df = _load_base_dataframe.cache_get(nrows=nrows, warn_bad_lines=warn_bad_lines)
+    if df is None:
+        if materialize is None:
+            materialize = not is_selective(filters)
+        if not materialize:
+            chunks = _scan(
+                nrows=nrows,
+                warn_bad_lines=warn_bad_lines,
+                build_table=True,
+                **filters)
+            return categorize(pd.concat(list(chunks)))
+        df = _load_base_dataframe(nrows=nrows, warn_bad_lines=warn_bad_lines)
+    result = df[_filter_mask(df, **filters)]
+    logging.info("Returning %d / %d entries after filtering", len(result), len(df))
+    return result
+
+@memoize(maxsize=2, fingerprint=_source_fingerprint)
+def _load_base_dataframe(
+        nrows : int | None = None,
+        warn_bad_lines : bool = True):
+    """
+    Unfiltered MHC ligand export with cleaned epitopes (see
+    pepdata.iedb.cleaning), loaded once and shared by every combination of
+    filters passed to load_dataframe.
+    """
+    path = local_path()
+    epitopes = get_epitope_name(pd.DataFrame(columns=table_columns(path)))
+    if epitopes is None:
+        raise ValueError(
+            "Could not find epitope name column in IEDB MHC data. "
+            f"Available columns: {list(table_columns(path))}"
+        )
+    df = load_table(
+        path,
+        nrows=nrows,
+        on_bad_lines='warn' if warn_bad_lines else 'skip')
+    clean_dataframe(df)
+    return categorize(df)
+
+def iter_dataframes(
+        chunksize : int = ROW_GROUP_SIZE,
+        mhc_class : int | None = None,
+        hla : str | None = None,
+        exclude_hla : str | None = None,
+        human_only : bool  = False,
+        peptide_length : int | None = None,
+        assay_method : str | None = None,
+        only_standard_amino_acids : bool = True,
+        warn_bad_lines : bool  = True,
+        nrows : int | None = None):
+    """
+    Generate IEDB MHC data in filtered chunks, each coming from at most
+    chunksize rows of the export. Takes the same filters as load_dataframe
+    and concatenating the chunks gives the same rows as load_dataframe.
+
+    Unlike load_dataframe this never holds the whole export in memory, so
+    if the Parquet copy of the CSV doesn't exist yet the CSV is streamed
+    instead of being used to build it.
+    """
+    return _scan(
+        mhc_class=mhc_class,
+        hla=hla,
+        exclude_hla=exclude_hla,
+        human_only=human_only,
+        peptide_length=peptide_length,
+        assay_method=assay_method,
+        only_standard_amino_acids=only_standard_amino_acids,
+        warn_bad_lines=warn_bad_lines,
+        nrows=nrows,
+        chunksize=chunksize)
+
+def _scan(
+        mhc_class=None,
+        hla=None,
+        exclude_hla=None,
+        human_only=False,
+        peptide_length=None,
+        assay_method=None,
+        only_standard_amino_acids=True,
+        warn_bad_lines=True,
+        nrows=None,
+        chunksize=ROW_GROUP_SIZE,
+        build_table=False):
+    path = local_path()
+    mhc_key, mhc_class_key, epitope_key, assay_method_key = find_keys(
+        table_columns(path),
+        [get_mhc_allele, get_mhc_class, get_epitope_name, get_assay_method])
+
+    if epitope_key is None:
+        raise ValueError(
+            "Could not find epitope name column in IEDB MHC data. "
+            f"Available columns: {list(table_columns(path))}"
+        )
+
+    filter_columns = [
+        key for key in [mhc_key, mhc_class_key, epitope_key, assay_method_key]
+        if key is not None
+    ]
+
+    n = 0
+
+    def mask_fn(chunk):
+        nonlocal n
+        n += len(chunk)
+        return _filter_mask(
+            categorize(chunk),
+            mhc_class=mhc_class,
+            hla=hla,
+            exclude_hla=exclude_hla,
+            human_only=human_only,
+            peptide_length=peptide_length,
+            assay_method=assay_method,
+            only_standard_amino_acids=only_standard_amino_acids)
+
+    n_returned = 0
+    for df in scan_table(
+            path,
+            mask_fn,
+            filter_columns=filter_columns,
             nrows=nrows,
-            low_memory=False,
             on_bad_lines='warn' if warn_bad_lines else 'skip',
-            encoding="latin-1")
-
-    # Sometimes the IEDB seems to put in an extra comma in the
-    # header line, which creates an unnamed column of NaNs.
-    # To deal with this, drop any columns which are all NaN
-    df = df.dropna(axis=1, how="all")
-
-    print(df.head())
-
-    n = len(df)
-
-    mhc_group_key = "MHC Restriction"
-    epitope_group_key = "Epitope"
-    epitope_column_key = (epitope_group_key, "Name")
-
-    mhc_allele_column_key = (mhc_group_key, "Name")
-
-    epitopes = df[epitope_column_key] = df[epitope_column_key].str.upper()
-
-    null_epitope_seq = epitopes.isnull()
-    n_null = null_epitope_seq.sum()
-    if n_null > 0:
-        logging.info("Dropping %d null sequences", n_null)
+            chunksize=chunksize,
+            build_table=build_table):
+        df = df.copy()
+        clean_dataframe(df)
+        n_returned += len(df)
+        yield categorize(df)
+
+    logging.info("Returning %d / %d entries after filtering", n_returned, n)
+
+def _filter_mask(
+        df,
+        mhc_class=None,
+        hla=None,
+        exclude_hla=None,
+        human_only=False,
+        peptide_length=None,
+        assay_method=None,
+        only_standard_amino_acids=True):
+    """
+    Boolean mask of the rows in (a chunk of) the MHC ligand export which
+    pass the filters of load_dataframe. Only needs the columns used to filter.
+    """
+    mhc = get_mhc_allele(df)
+    mhc_class_series = get_mhc_class(df)
+    assay_method_series = get_assay_method(df)
+    epitopes = clean_epitopes(get_epitope_name(df))
 
-    mask = ~null_epitope_seq
+    mask = pd.Series(~epitopes.null, index=df.index)
 
     if only_standard_amino_acids:
         # if have rare or unknown amino acids, drop the sequence
-        bad_epitope_seq = \
-            epitopes.str.contains(bad_amino_acids, na=False).astype("bool")
-        n_bad = bad_epitope_seq.sum()
-        if n_bad > 0:
-            logging.info("Dropping %d bad sequences", n_bad)
-
-        mask &= ~bad_epitope_seq
+        mask &= ~epitopes.nonstandard
 
     if human_only:
-        mask &= df[mhc_allele_column_key].str.startswith("HLA").astype("bool")
+        mask &= str_startswith(mhc, "HLA")
 
-    if mhc_class == 1:
-        mask &= df[mhc_group_key]["Class"] == "I"
-    elif mhc_class == 2:
-        mask &= df[mhc_group_key]["Class"] == "II"
+    if mhc_class is not None:
+        mask &= mhc_class_mask(mhc, mhc_class, mhc_class_series)
 
     if hla:
-        mask &= df[mhc_allele_column_key].str.contains(hla, na=False)
+        mask &= str_contains(mhc, hla)
 
     if exclude_hla:
-        mask &= ~(df[mhc_allele_column_key].str.contains(exclude_hla, na=False))
+        mask &= ~str_contains(mhc, exclude_hla)
 
-    if assay_method:
-        mask &= df["Assay"]["Method"].str.contains(assay_method)
+    if assay_method and assay_method_series is not None:
+        mask &= str_contains(assay_method_series, assay_method)
 
     if peptide_length:
         assert peptide_length > 0
-        mask &= df[epitope_column_key].str.len() == peptide_length
-
-    df = df[mask].copy()
-
-    logging.info("Returning %d / %d entries after filtering", len(df), n)
+        mask &= epitopes.lengths == peptide_length
 
-    return df
+    return mask
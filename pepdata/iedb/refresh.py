@@ -0,0 +1,355 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Refreshing the IEDB exports with a record of what changed.
+
+refresh_export (or tcell.refresh / mhc.refresh) keeps the normalized rows
+of the current export, downloads the new one and matches the rows of both
+by a hash of the epitope IRI, epitope, MHC restriction and every assay
+field. Rows of the new export without a match are inserted and rows of the
+old export without one are removed. An edited row counts as one of each.
+The result is an ExportDelta, which is also saved next to the export.
+
+Derived data is then updated from the delta rather than rebuilt:
+    - epitope tables cached by aggregate.load_epitope_allele_table
+      subtract the removed rows and add the inserted ones
+    - ExportDelta.update_similarity_index and update_kmer_index bring
+      indexes built from the old export up to date, given the load_dataframe
+      filters they were built with (see ExportDelta.epitope_changes)
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from .aggregate import EpitopeAlleleTable, cached_table_path, row_hashes
+from .columnar import source_fingerprint
+from .common import _source_module, atomic_write
+from .columns import ASSAY_GROUP_CANDIDATES, get_epitope_IRI, get_epitope_name, get_mhc_allele
+
+def snapshot_hashes(df : pd.DataFrame) -> np.ndarray:
+    """
+    uint64 hash of every row of an IEDB DataFrame, from its epitope IRI,
+    epitope, MHC restriction and assay columns.
+    """
+    keys = [
+        series.name
+        for series in (get_epitope_IRI(df), get_epitope_name(df), get_mhc_allele(df))
+        if series is not None
+    ]
+    assay_groups = [group.lower() for group in ASSAY_GROUP_CANDIDATES]
+    keys += [
+        key for key in df.columns
+        if key not in keys and any(group in key[0].lower() for group in assay_groups)
+    ]
+    columns = pd.DataFrame({i: df[key] for (i, key) in enumerate(keys)}, index=df.index)
+    return pd.util.hash_pandas_object(columns, index=False).to_numpy()
+
+def _unmatched(hashes, other_hashes):
+    """
+    Positions of the rows of hashes without a match in other_hashes. Equal
+    hashes are matched in order, so if a hash occurs 3 times in hashes and
+    once in other_hashes then its last 2 occurrences are unmatched.
+    """
+    order = np.argsort(hashes, kind="stable")
+    sorted_hashes = hashes[order]
+    group_starts = np.searchsorted(sorted_hashes, sorted_hashes, side="left")
+    occurrence = np.empty(len(hashes), dtype="int64")
+    occurrence[order] = np.arange(len(hashes)) - group_starts
+    other_sorted = np.sort(other_hashes)
+    n_other = np.searchsorted(other_sorted, hashes, side="right") - \
+        np.searchsorted(other_sorted, hashes, side="left")
+    return np.flatnonzero(occurrence >= n_other)
+
+# arguments of load_dataframe which aren't filters of _filter_mask
+_LOAD_OPTIONS = ("nrows", "materialize", "reduced_alphabet", "warn_bad_lines")
+
+def _epitope_set(df):
+    epitopes = get_epitope_name(df)
+    if epitopes is None:
+        return set()
+    return set(epitopes.dropna().unique().tolist())
+
+class ExportDelta(object):
+    """
+    Rows which changed between two versions of an IEDB export.
+
+    Parameters
+    ----------
+    inserted : pd.DataFrame
+        Rows of the new export without a match in the old one, indexed by
+        their position in the new export
+
+    removed : pd.DataFrame
+        Rows of the old export without a match in the new one, indexed by
+        their position in the old export
+
+    added_epitopes, removed_epitopes : set
+        Epitopes which only occur in the new export, or only in the old one
+        (of all rows, see epitope_changes for filtered rows)
+
+    old_fingerprint, new_fingerprint : str or None
+        columnar.source_fingerprint of the exports (None if there was no
+        old export)
+
+    source : str
+        "tcell" or "mhc"
+    """
+    def __init__(
+            self,
+            inserted,
+            removed,
+            added_epitopes,
+            removed_epitopes,
+            old_fingerprint=None,
+            new_fingerprint=None,
+            source="tcell"):
+        self.inserted = inserted
+        self.removed = removed
+        self.added_epitopes = added_epitopes
+        self.removed_epitopes = removed_epitopes
+        self.old_fingerprint = old_fingerprint
+        self.new_fingerprint = new_fingerprint
+        self.source = source
+
+    def __setstate__(self, state):
+        # deltas saved before the source was recorded
+        state.setdefault("source", "tcell")
+        self.__dict__.update(state)
+
+    @classmethod
+    def compare(cls, old : pd.DataFrame, new : pd.DataFrame, **kwargs):
+        """
+        Delta between the normalized rows of two exports.
+        """
+        old_hashes = snapshot_hashes(old)
+        new_hashes = snapshot_hashes(new)
+        inserted = new.iloc[_unmatched(new_hashes, old_hashes)]
+        removed = old.iloc[_unmatched(old_hashes, new_hashes)]
+        old_epitopes = _epitope_set(old)
+        new_epitopes = _epitope_set(new)
+        return cls(
+            inserted=inserted,
+            removed=removed,
+            added_epitopes=_epitope_set(inserted) - old_epitopes,
+            removed_epitopes=_epitope_set(removed) - new_epitopes,
+            **kwargs)
+
+    def __len__(self):
+        return len(self.inserted) + len(self.removed)
+
+    def __repr__(self):
+        return "ExportDelta(n_inserted=%d, n_removed=%d)" % (
+            len(self.inserted), len(self.removed))
+
+    def _epitope_counts(self, rows, load_kwargs):
+        """
+        Number of rows of each epitope among the (inserted or removed) rows
+        which pass the filters of load_dataframe(**load_kwargs).
+        """
+        module = _source_module(self.source)
+        filters = {
+            key: value for (key, value) in load_kwargs.items()
+            if key not in _LOAD_OPTIONS
+        }
+        mask = np.asarray(module._filter_mask(rows, **filters), dtype=bool)
+        if load_kwargs.get("nrows") is not None:
+            # rows are indexed by their position in their export
+            mask &= rows.index.to_numpy() < load_kwargs["nrows"]
+        epitopes = get_epitope_name(rows)
+        if epitopes is None:
+            return pd.Series(dtype="int64")
+        counts = epitopes[mask].value_counts()
+        return counts[counts > 0]
+
+    def epitope_changes(self, **load_kwargs):
+        """
+        Epitopes which pass the filters of load_dataframe(**load_kwargs) of
+        the source in the new export but not in the old one, and epitopes
+        which pass them in the old export but not in the new one, i.e. what
+        changed in an index built with from_iedb(**load_kwargs).
+
+        The rows of the old export passing the filters are those of the new
+        export, minus the inserted rows and plus the removed rows which pass
+        them, so only the epitopes of those rows are checked.
+        """
+        inserted = self._epitope_counts(self.inserted, load_kwargs)
+        removed = self._epitope_counts(self.removed, load_kwargs)
+        candidates = inserted.index.union(removed.index)
+        if len(candidates) == 0:
+            return set(), set()
+        new_df = _source_module(self.source).load_dataframe(**load_kwargs)
+        new_counts = get_epitope_name(new_df).value_counts().reindex(
+            candidates, fill_value=0)
+        old_counts = new_counts - \
+            inserted.reindex(candidates, fill_value=0) + \
+            removed.reindex(candidates, fill_value=0)
+        added = candidates[(new_counts > 0).to_numpy() & (old_counts == 0).to_numpy()]
+        gone = candidates[(old_counts > 0).to_numpy() & (new_counts == 0).to_numpy()]
+        return set(added.tolist()), set(gone.tolist())
+
+    def update_similarity_index(self, index, **load_kwargs):
+        """
+        Add and remove the epitopes which changed to a SimilarityIndex of
+        the old export (in place), only rebuilding the lengths which change.
+        Pass the load_dataframe filters the index was built with (e.g. by
+        SimilarityIndex.from_iedb), see epitope_changes.
+        """
+        added, removed = self.epitope_changes(**load_kwargs)
+        index.remove(removed)
+        index.add(added)
+        return index
+
+    def update_kmer_index(self, index, **load_kwargs):
+        """
+        Remove and add the epitopes which changed to a KmerIndex of the old
+        export (in place), merging the codes of the added epitopes into it.
+        Pass the load_dataframe filters the index was built with (e.g. by
+        KmerIndex.from_iedb), see epitope_changes.
+        """
+        added, removed = self.epitope_changes(**load_kwargs)
+        index.remove(removed)
+        index.add(added)
+        return index
+
+    def save(self, path : str):
+        with atomic_write(path) as tmp_path, open(tmp_path, "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path : str):
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+def delta_path(csv_path : str) -> str:
+    """
+    Location of the delta of the last refresh of an IEDB CSV (next to it).
+    """
+    base, _ = os.path.splitext(csv_path)
+    return base + ".delta.pickle"
+
+def _cached_tables(csv_path):
+    """
+    Paths and tables cached by load_epitope_allele_table for an export.
+    """
+    directory = os.path.dirname(csv_path) or "."
+    prefix = os.path.basename(os.path.splitext(csv_path)[0]) + ".epitope_alleles-"
+    tables = []
+    for filename in sorted(os.listdir(directory)):
+        if not (filename.startswith(prefix) and filename.endswith(".npz")):
+            continue
+        path = os.path.join(directory, filename)
+        try:
+            table = EpitopeAlleleTable.load(path)
+        except Exception as e:
+            logging.warning("Ignoring unreadable epitope table %s: %s", path, e)
+            continue
+        tables.append((path, table))
+    return tables
+
+def _updatable(path, table, csv_path, df):
+    """
+    Can the delta of an export be applied to a table cached from it?
+    Tables of partial loads (nrows) or which don't match the export are
+    removed instead, to be rebuilt on their next load.
+    """
+    load_kwargs = table.load_kwargs
+    return (
+        isinstance(load_kwargs, dict) and
+        load_kwargs.get("nrows") is None and
+        cached_table_path(csv_path, load_kwargs) == path and
+        table.n_source_rows == len(df) and
+        table.extends(row_hashes(df)))
+
+def refresh_export(source : str = "tcell", url : str | None = None) -> ExportDelta:
+    """
+    Download a new copy of the T-cell ("tcell") or MHC ligand ("mhc")
+    export, compare it to the current one and update the epitope tables
+    cached from it.
+
+    Parameters
+    ----------
+    source : str
+        "tcell" or "mhc"
+
+    url : str, optional
+        Where to download the export from, defaults to the IEDB. Any URL
+        datacache can fetch works, including file:// URLs.
+
+    Returns ExportDelta, which is also saved at delta_path of the export.
+    """
+    module = _source_module(source)
+    try:
+        csv_path = module.local_path(auto_download=False)
+    except ValueError:
+        csv_path = None
+    if csv_path is None or not os.path.exists(csv_path):
+        old = None
+        old_fingerprint = None
+        tables = []
+    else:
+        old = module._load_base_dataframe()
+        old_fingerprint = source_fingerprint(csv_path)
+        tables = []
+        for path, table in _cached_tables(csv_path):
+            old_rows = module.load_dataframe(**table.load_kwargs) \
+                if isinstance(table.load_kwargs, dict) else None
+            if old_rows is not None and _updatable(path, table, csv_path, old_rows):
+                tables.append((path, table, old_rows.index))
+            else:
+                os.remove(path)
+
+    module.download(force=True, url=url)
+    csv_path = module.local_path(auto_download=False)
+    new = module._load_base_dataframe()
+    if old is None:
+        old = new.iloc[:0]
+    delta = ExportDelta.compare(
+        old,
+        new,
+        old_fingerprint=old_fingerprint,
+        new_fingerprint=source_fingerprint(csv_path),
+        source=source)
+    logging.info("Refreshed %s export: %s", source, delta)
+
+    for path, table, old_index in tables:
+        new_rows = module.load_dataframe(**table.load_kwargs)
+        table = table.update(
+            inserted=delta.inserted[delta.inserted.index.isin(new_rows.index)],
+            removed=delta.removed[delta.removed.index.isin(old_index)],
+            hashes=row_hashes(new_rows))
+        table.source_fingerprint = delta.new_fingerprint
+        try:
+            table.save(path)
+        except OSError as e:
+            logging.warning("Unable to write epitope table %s: %s", path, e)
+
+    try:
+        delta.save(delta_path(csv_path))
+    except OSError as e:
+        logging.warning("Unable to write IEDB delta for %s: %s", csv_path, e)
+    return delta
+
+def load_delta(source : str = "tcell") -> ExportDelta | None:
+    """
+    ExportDelta of the last refresh of an export, if there was one.
+    """
+    path = delta_path(_source_module(source).local_path(auto_download=False))
+    if not os.path.exists(path):
+        return None
+    return ExportDelta.load(path)
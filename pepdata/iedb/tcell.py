@@ -16,33 +16,48 @@ from __future__ import annotations
 import logging
 import os
 
-import numpy as np
 import pandas as pd
 
 
-from .alleles import load_alleles_dict
+from .alleles import mhc_class_mask, normalize_mhc_class
 from .memoize import  memoize
-from .common import  bad_amino_acids, cache
+from .cleaning import clean_dataframe, clean_epitopes
+from .common import cache, is_selective, str_contains, str_startswith
+from .columnar import ROW_GROUP_SIZE, load_table, scan_table, source_fingerprint, table_columns
 from .columns import (
+    categorize,
+    find_keys,
     get_assay_method,
     get_host_name,
     get_mhc_allele,
     get_mhc_class,
     get_epitope_name,
-    
 )
 
 TCELL_COMPACT_FILENAME = "tcell_full.csv"
 TCELL_COMPACT_URL = "http://www.iedb.org/downloader.php?file_name=doc/tcell_full_v3.zip"
 TCELL_COMPACT_DECOMPRESS = True
 
-def download(force=False):
+def download(force=False, url=None):
+    """
+    Download the export (unless it's already present and force is False),
+    optionally from another URL than the IEDB's.
+    """
     return cache.fetch(
         filename=TCELL_COMPACT_FILENAME,
-        url=TCELL_COMPACT_URL,
+        url=TCELL_COMPACT_URL if url is None else url,
         decompress=TCELL_COMPACT_DECOMPRESS,
         force=force)
 
+def refresh(url=None):
+    """
+    Download a new copy of the export and update the epitope tables cached
+    from the current one, returning the pepdata.iedb.refresh.ExportDelta
+    of rows inserted and removed.
+    """
+    from .refresh import refresh_export
+    return refresh_export("tcell", url=url)
+
 def local_path(auto_download=True):
     path = cache.local_path(
         filename=TCELL_COMPACT_FILENAME,
@@ -59,7 +74,11 @@ def local_path(auto_download=True):
 def delete():
     os.remove(local_path())
 
-@memoize
+def _source_fingerprint():
+    path = local_path()
+    return (path, source_fingerprint(path))
+
+@memoize(maxsize=8, fingerprint=_source_fingerprint)
 def load_dataframe(
         mhc_class : str | None = None,  # 1, 2, or None for neither
         hla : str | None  = None,
@@ -69,10 +88,25 @@ def load_dataframe(
         assay_method : str | None = None,
         only_standard_amino_acids : bool = True,
         reduced_alphabet : dict | None = None,  # 20 letter AA strings -> simpler alphabet
-        nrows : int | None = None):
+        nrows : int | None = None,
+        materialize : bool | None = None):
     """
     Load IEDB T-cell data without aggregating multiple entries for same epitope
 
+    Rows are found in one of two ways, with the same result:
+        - masking the unfiltered export, which is loaded once (per nrows)
+          and kept in memory, after which every combination of filters
+          only costs a vectorized mask
+        - scanning the export for the matching rows (see iter_dataframes),
+          which reads it again for each combination of filters but only
+          decodes the columns needed to filter, and doesn't keep the full
+          export in memory (it's parsed once to write the Parquet copy if
+          that's missing)
+    If the unfiltered export is already in memory it's always masked.
+    Otherwise materialize decides, by default scanning when any of
+    mhc_class, hla, human_only, peptide_length or assay_method is given
+    and loading the whole export for broader queries.
+
     Parameters
     ----------
     mhc_class: {None, 1, 2}
@@ -102,74 +136,176 @@ def load_dataframe(
 
     nrows: int, optional
         Don't load the full IEDB dataset but instead read only the first nrows
+
+    materialize: bool, optional
+        Load the whole export to mask it (True) or scan for the matching
+        rows (False), the default (None) decides from the filters
+    """
+    filters = dict(
+        mhc_class=mhc_class,
+        hla=hla,
+        exclude_hla=exclude_hla,
+        human_only=human_only,
+        peptide_length=peptide_length,
+        assay_method=assay_method,
+        only_standard_amino_acids=only_standard_amino_acids)
+    df = _load_base_dataframe.cache_get(nrows=nrows)
+    if df is None:
+        if materialize is None:
+            materialize = not is_selective(filters)
+        if not materialize:
+            chunks = _scan(nrows=nrows, build_table=True, **filters)
+            return categorize(pd.concat(list(chunks)))
+        df = _load_base_dataframe(nrows=nrows)
+    result = df[_filter_mask(df, **filters)]
+    logging.info("Returning %d / %d entries after filtering", len(result), len(df))
+    return result
+
+@memoize(maxsize=2, fingerprint=_source_fingerprint)
+def _load_base_dataframe(nrows : int | None = None):
+    """
+    Unfiltered T-cell export with cleaned epitopes (see
+    pepdata.iedb.cleaning), loaded once and shared by every combination of
+    filters passed to load_dataframe.
     """
     path = local_path()
-    df = pd.read_csv(
-            path,
-            header=[0, 1],
-            skipinitialspace=True,
-            nrows=nrows,
-            low_memory=False,
-            on_bad_lines='warn',
-            encoding="latin-1")
-    
-    mhc = get_mhc_allele(df)
-    mhc_class_series = get_mhc_class(df)
-    epitopes = get_epitope_name(df)
-    organism = get_host_name(df)
-    assay_method_series = get_assay_method(df)
-
-    if epitopes is None:
+    if get_epitope_name(pd.DataFrame(columns=table_columns(path))) is None:
         raise ValueError(
             "Could not find epitope name column in IEDB T-cell data. "
-            f"Available columns: {list(df.columns)}"
+            f"Available columns: {list(table_columns(path))}"
         )
+    df = load_table(path, nrows=nrows)
+    clean_dataframe(df)
+    return categorize(df)
 
-    # Sometimes the IEDB seems to put in an extra comma in the
-    # header line, which creates an unnamed column of NaNs.
-    # To deal with this, drop any columns which are all NaN
-    df = df.dropna(axis=1, how="all")
-
-    n = len(df)
+def iter_dataframes(
+        chunksize : int = ROW_GROUP_SIZE,
+        mhc_class : str | None = None,
+        hla : str | None  = None,
+        exclude_hla : str | None  = None,
+        human_only : bool =False,
+        peptide_length : int | None = None,
+        assay_method : str | None = None,
+        only_standard_amino_acids : bool = True,
+        reduced_alphabet : dict | None = None,
+        nrows : int | None = None):
+    """
+    Generate IEDB T-cell data in filtered chunks, each coming from at most
+    chunksize rows of the export. Takes the same filters as load_dataframe
+    and concatenating the chunks gives the same rows as load_dataframe.
 
-    null_epitope_seq = epitopes.isnull()
-    n_null = null_epitope_seq.sum()
+    Unlike load_dataframe this never holds the whole export in memory, so
+    if the Parquet copy of the CSV doesn't exist yet the CSV is streamed
+    instead of being used to build it.
+    """
+    return _scan(
+        mhc_class=mhc_class,
+        hla=hla,
+        exclude_hla=exclude_hla,
+        human_only=human_only,
+        peptide_length=peptide_length,
+        assay_method=assay_method,
+        only_standard_amino_acids=only_standard_amino_acids,
+        nrows=nrows,
+        chunksize=chunksize)
+
+def _scan(
+        mhc_class=None,
+        hla=None,
+        exclude_hla=None,
+        human_only=False,
+        peptide_length=None,
+        assay_method=None,
+        only_standard_amino_acids=True,
+        nrows=None,
+        chunksize=ROW_GROUP_SIZE,
+        build_table=False):
+    path = local_path()
+    mhc_key, mhc_class_key, epitope_key, organism_key, assay_method_key = \
+        find_keys(
+            table_columns(path),
+            [
+                get_mhc_allele,
+                get_mhc_class,
+                get_epitope_name,
+                get_host_name,
+                get_assay_method,
+            ])
+
+    if epitope_key is None:
+        raise ValueError(
+            "Could not find epitope name column in IEDB T-cell data. "
+            f"Available columns: {list(table_columns(path))}"
+        )
 
-    if n_null > 0:
-        logging.info("Dropping %d null sequences", n_null)
+    mhc_class = normalize_mhc_class(mhc_class)
+
+    filter_columns = [
+        key for key in [
+            mhc_key, mhc_class_key, epitope_key, organism_key, assay_method_key]
+        if key is not None
+    ]
+
+    n = 0
+
+    def mask_fn(chunk):
+        nonlocal n
+        n += len(chunk)
+        return _filter_mask(
+            categorize(chunk),
+            mhc_class=mhc_class,
+            hla=hla,
+            exclude_hla=exclude_hla,
+            human_only=human_only,
+            peptide_length=peptide_length,
+            assay_method=assay_method,
+            only_standard_amino_acids=only_standard_amino_acids)
+
+    n_returned = 0
+    for df in scan_table(
+            path,
+            mask_fn,
+            filter_columns=filter_columns,
+            nrows=nrows,
+            chunksize=chunksize,
+            build_table=build_table):
+        df = df.copy()
+        clean_dataframe(df)
+        n_returned += len(df)
+        yield categorize(df)
+
+    logging.info("Returning %d / %d entries after filtering", n_returned, n)
+
+def _filter_mask(
+        df,
+        mhc_class=None,
+        hla=None,
+        exclude_hla=None,
+        human_only=False,
+        peptide_length=None,
+        assay_method=None,
+        only_standard_amino_acids=True):
+    """
+    Boolean mask of the rows in (a chunk of) the T-cell export which pass
+    the filters of load_dataframe. Only needs the columns used to filter.
+    """
+    mhc = get_mhc_allele(df)
+    mhc_class_series = get_mhc_class(df)
+    epitopes = clean_epitopes(get_epitope_name(df))
+    organism = get_host_name(df)
+    assay_method_series = get_assay_method(df)
 
-    mask = ~null_epitope_seq
+    mask = pd.Series(~epitopes.null, index=df.index)
 
     if only_standard_amino_acids:
         # if have rare or unknown amino acids, drop the sequence
-        bad_epitope_seq = \
-            epitopes.str.contains(bad_amino_acids, na=False).astype("bool")
-        n_bad = bad_epitope_seq.sum()
-        if n_bad > 0:
-            logging.info("Dropping %d bad sequences", n_bad)
-
-        mask &= ~bad_epitope_seq
+        mask &= ~epitopes.nonstandard
 
     if human_only:
-        mask &= organism.str.startswith('Homo sapiens', na=False).astype('bool')
-
+        mask &= str_startswith(organism, 'Homo sapiens')
 
     if mhc_class is not None:
-        # since MHC classes can be specified as either strings ("I") or integers
-        # standard them to be strings
-        if mhc_class == 1:
-            mhc_class = "I"
-        elif mhc_class == 2:
-            mhc_class = "II"
-        if mhc_class not in {"I", "II"}:
-            raise ValueError("Invalid MHC class: %s" % mhc_class)
-        allele_dict = load_alleles_dict()
-        mhc_class_mask = [False] * len(df)
-        for i, allele_name in enumerate(mhc):
-            allele_object = allele_dict.get(allele_name)
-            if allele_object and allele_object.mhc_class == mhc_class:
-                mhc_class_mask[i] = True
-        mask &= np.array(mhc_class_mask)
+        mask &= mhc_class_mask(mhc, mhc_class, mhc_class_series)
 
     # Match known alleles such as "HLA-A*02:01",
     # broader groupings such as "HLA-A2"
@@ -179,19 +315,16 @@ def load_dataframe(
     #  "Class I,allele undetermined"
 
     if hla:
-        mask &= mhc.str.contains(hla, na=False)
+        mask &= str_contains(mhc, hla)
 
     if exclude_hla:
-        mask &= ~(mhc.str.contains(exclude_hla, na=False))
+        mask &= ~str_contains(mhc, exclude_hla)
 
     if assay_method is not None and assay_method_series is not None:
-        mask &= assay_method_series.str.contains(assay_method, na=False)
+        mask &= str_contains(assay_method_series, assay_method)
 
     if peptide_length:
         assert peptide_length > 0
-        mask &= epitopes.str.len() == peptide_length
-
-    df = df[mask]
+        mask &= epitopes.lengths == peptide_length
 
-    logging.info("Returning %d / %d entries after filtering", len(df), n)
-    return df
+    return mask
@@ -0,0 +1,343 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Index of epitope sequences for finding where they occur in (or overlap)
+a set of protein sequences.
+
+Every epitope is identified by an integer code of its first ANCHOR_LENGTH
+letters (the whole epitope if it's shorter). Codes of every window of the
+concatenated proteins are computed with a few vectorized passes and looked
+up in the sorted epitope codes, so the cost is one sweep over the proteins
+per distinct epitope length rather than one substring search per epitope.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+from .amino_acid_alphabet import extended_amino_acid_letters
+from .encoded_peptides import encode_peptides, make_lookup_table
+
+ALPHABET = extended_amino_acid_letters
+
+# longest prefix whose code fits in an int64
+ANCHOR_LENGTH = int(63 / np.log2(len(ALPHABET)))
+
+# residues of protein sequence handled per pass
+DEFAULT_CHUNK_SIZE = 2 ** 24
+
+_letter_set = set(ALPHABET)
+
+def _codes_of_rows(indices, k):
+    codes = np.zeros(len(indices), dtype="int64")
+    for t in range(k):
+        codes = codes * len(ALPHABET) + indices[:, t]
+    return codes
+
+def _sorted_entries(epitopes):
+    """
+    Distinct epitopes made of letters of the alphabet, with their lengths
+    and codes, sorted by length, then code, then sequence.
+    """
+    epitopes = sorted({
+        str(e) for e in epitopes
+        if len(str(e)) > 0 and set(str(e)) <= _letter_set
+    })
+    if len(epitopes) == 0:
+        return np.zeros(0, dtype="U1"), np.zeros(0, dtype="int64"), np.zeros(0, dtype="int64")
+    indices = encode_peptides(epitopes, alphabet=ALPHABET).indices
+    lengths = np.array([len(e) for e in epitopes], dtype="int64")
+    codes = np.zeros(len(epitopes), dtype="int64")
+    for k in np.unique(np.minimum(lengths, ANCHOR_LENGTH)):
+        rows = np.minimum(lengths, ANCHOR_LENGTH) == k
+        codes[rows] = _codes_of_rows(indices[rows], k)
+    order = np.lexsort((codes, lengths))
+    return np.array(epitopes, dtype="U")[order], lengths[order], codes[order]
+
+class _Proteome(object):
+    """
+    Proteins concatenated into one array of letter indices, with a
+    separator (an invalid letter) after each protein.
+    """
+    def __init__(self, names, sequences):
+        self.names = names
+        table = make_lookup_table(ALPHABET)
+        buffer = "\n".join(sequences).encode("ascii", errors="replace") + b"\n"
+        self.letters = table[np.frombuffer(buffer, dtype="uint8")]
+        invalid = self.letters >= len(ALPHABET)
+        self.letters[invalid] = 0
+        self.n_invalid = np.concatenate([[0], np.cumsum(invalid)])
+        lengths = np.array([len(s) for s in sequences], dtype="int64")
+        self.starts = np.cumsum(lengths + 1) - lengths - 1
+        self._window_codes = {}
+
+    def window_codes(self, k):
+        """
+        Code of the k letters starting at each position.
+        """
+        if k not in self._window_codes:
+            n = len(self.letters) - k + 1
+            codes = np.zeros(max(n, 0), dtype="int64")
+            for t in range(k):
+                codes = codes * len(ALPHABET) + self.letters[t:t + n]
+            self._window_codes[k] = codes
+        return self._window_codes[k]
+
+    def valid_starts(self, length):
+        """
+        Positions where a window of the given length lies within one
+        protein and only contains letters of the alphabet.
+        """
+        n = len(self.letters) - length + 1
+        if n <= 0:
+            return np.zeros(0, dtype="int64")
+        n_invalid = self.n_invalid[length:length + n] - self.n_invalid[:n]
+        return np.flatnonzero(n_invalid == 0)
+
+    def locate(self, positions):
+        """
+        Protein names and offsets of positions in the concatenated sequence.
+        """
+        protein_indices = np.searchsorted(self.starts, positions, side="right") - 1
+        return (
+            np.asarray(self.names, dtype=object)[protein_indices],
+            positions - self.starts[protein_indices])
+
+def _chunks(proteins, chunk_size):
+    if isinstance(proteins, dict):
+        items = list(proteins.items())
+    else:
+        items = list(enumerate(proteins))
+    chunk = []
+    n_residues = 0
+    for name, sequence in items:
+        chunk.append((name, str(sequence)))
+        n_residues += len(sequence)
+        if n_residues >= chunk_size:
+            yield _Proteome(*zip(*chunk))
+            chunk = []
+            n_residues = 0
+    if chunk:
+        yield _Proteome(*zip(*chunk))
+
+class KmerIndex(object):
+    """
+    Exact substring index of epitope sequences. Epitopes may use any letter
+    of extended_amino_acid_letters, other sequences are ignored.
+
+    Parameters
+    ----------
+    epitopes
+        Sequences to index, duplicates are ignored
+    """
+    def __init__(self, epitopes=()):
+        self.epitopes, self.lengths, self.codes = _sorted_entries(epitopes)
+
+    @classmethod
+    def from_iedb(cls, source="tcell", **load_kwargs):
+        """
+        Index the epitopes of pepdata.iedb.tcell or pepdata.iedb.mhc,
+        with load_kwargs passed to their load_dataframe function.
+        """
+        from .iedb.columns import get_epitope_name
+        from .iedb.common import _source_module
+        module = _source_module(source)
+        df = module.load_dataframe(**load_kwargs)
+        return cls(get_epitope_name(df).dropna().unique())
+
+    def __len__(self):
+        return len(self.epitopes)
+
+    def __contains__(self, epitope):
+        return bool(np.isin(epitope, self.epitopes))
+
+    def _positions(self, epitopes, lengths, codes):
+        """
+        Where each of some sorted entries belongs in the sorted arrays of
+        the index, and whether it's already there.
+        """
+        positions = np.zeros(len(epitopes), dtype="int64")
+        present = np.zeros(len(epitopes), dtype="bool")
+        for length in np.unique(lengths):
+            lo, hi = np.searchsorted(self.lengths, [length, length + 1])
+            rows = np.flatnonzero(lengths == length)
+            first = lo + np.searchsorted(self.codes[lo:hi], codes[rows], side="left")
+            last = lo + np.searchsorted(self.codes[lo:hi], codes[rows], side="right")
+            positions[rows] = first
+            if length <= ANCHOR_LENGTH:
+                present[rows] = last > first
+                continue
+            # epitopes sharing their anchor are ordered by sequence
+            tied = last > first
+            for row, start, end in zip(rows[tied], first[tied], last[tied]):
+                i = int(np.searchsorted(self.epitopes[start:end], epitopes[row]))
+                positions[row] = start + i
+                present[row] = i < end - start and self.epitopes[start + i] == epitopes[row]
+        return positions, present
+
+    def add(self, epitopes):
+        """
+        Add epitopes to the index (in place), merging their codes into the
+        sorted arrays without encoding the indexed epitopes again.
+        """
+        epitopes, lengths, codes = _sorted_entries(epitopes)
+        positions, present = self._positions(epitopes, lengths, codes)
+        new = ~present
+        dtype = np.result_type(self.epitopes.dtype, epitopes.dtype)
+        self.epitopes = np.insert(
+            self.epitopes.astype(dtype), positions[new], epitopes[new])
+        self.lengths = np.insert(self.lengths, positions[new], lengths[new])
+        self.codes = np.insert(self.codes, positions[new], codes[new])
+        return self
+
+    def remove(self, epitopes):
+        """
+        Remove epitopes from the index (in place).
+        """
+        epitopes, lengths, codes = _sorted_entries(epitopes)
+        positions, present = self._positions(epitopes, lengths, codes)
+        removed = positions[present]
+        self.epitopes = np.delete(self.epitopes, removed)
+        self.lengths = np.delete(self.lengths, removed)
+        self.codes = np.delete(self.codes, removed)
+        return self
+
+    def _search_proteome(self, proteome):
+        results = []
+        for length in np.unique(self.lengths):
+            first, last = np.searchsorted(self.lengths, [length, length + 1])
+            codes = self.codes[first:last]
+            k = min(int(length), ANCHOR_LENGTH)
+            starts = proteome.valid_starts(length)
+            window_codes = proteome.window_codes(k)[starts]
+            lo = np.searchsorted(codes, window_codes, side="left")
+            hi = np.searchsorted(codes, window_codes, side="right")
+            n_matches = hi - lo
+            positions = np.repeat(starts, n_matches)
+            rows = first + np.arange(n_matches.sum()) + np.repeat(
+                lo - np.cumsum(n_matches) + n_matches, n_matches)
+            if length > ANCHOR_LENGTH and len(rows) > 0:
+                # the code only covers a prefix, check the rest of the epitope
+                letters = proteome.letters[
+                    positions[:, None] + np.arange(length)[None, :]]
+                expected = encode_peptides(
+                    self.epitopes[rows], alphabet=ALPHABET).indices
+                keep = (letters == expected).all(axis=1)
+                positions, rows = positions[keep], rows[keep]
+            results.append((rows, positions))
+        return results
+
+    def search(self, proteins, chunk_size : int = DEFAULT_CHUNK_SIZE):
+        """
+        Find every occurrence of an indexed epitope in the proteins.
+
+        Parameters
+        ----------
+        proteins
+            Dictionary of protein names to sequences, or a list of sequences
+            (named by their position)
+
+        chunk_size
+            Approximate number of residues searched at once
+
+        Returns DataFrame with columns "epitope", "protein" and "offset"
+        """
+        frames = []
+        for proteome in _chunks(proteins, chunk_size):
+            for rows, positions in self._search_proteome(proteome):
+                names, offsets = proteome.locate(positions)
+                frames.append(pd.DataFrame({
+                    "epitope": self.epitopes[rows].astype(object),
+                    "protein": names,
+                    "offset": offsets,
+                }))
+        columns = ["epitope", "protein", "offset"]
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(frames, ignore_index=True)[columns]
+
+    def overlaps(self, proteins, k : int = 9, chunk_size : int = DEFAULT_CHUNK_SIZE):
+        """
+        Find every k-mer shared by an indexed epitope and a protein, i.e.
+        epitopes which partially overlap the proteins.
+
+        Returns DataFrame with columns "epitope", "protein", "offset" (of the
+        k-mer in the protein) and "epitope_offset" (of the k-mer in the epitope)
+        """
+        if not 0 < k <= ANCHOR_LENGTH:
+            raise ValueError("Expected 0 < k <= %d, got %d" % (ANCHOR_LENGTH, k))
+        # every k-mer of every epitope, sorted by code
+        kmer_rows, kmer_offsets, kmer_codes = [], [], []
+        for length in np.unique(self.lengths[self.lengths >= k]):
+            first, last = np.searchsorted(self.lengths, [length, length + 1])
+            indices = encode_peptides(
+                self.epitopes[first:last], alphabet=ALPHABET).indices
+            n_windows = length - k + 1
+            windows = np.lib.stride_tricks.sliding_window_view(
+                indices, k, axis=1).reshape(-1, k)
+            kmer_rows.append(np.repeat(np.arange(first, last), n_windows))
+            kmer_offsets.append(np.tile(np.arange(n_windows), last - first))
+            kmer_codes.append(_codes_of_rows(windows, k))
+        columns = ["epitope", "protein", "offset", "epitope_offset"]
+        if not kmer_rows:
+            return pd.DataFrame(columns=columns)
+        kmer_rows = np.concatenate(kmer_rows)
+        kmer_offsets = np.concatenate(kmer_offsets)
+        kmer_codes = np.concatenate(kmer_codes)
+        order = np.argsort(kmer_codes, kind="stable")
+        kmer_rows, kmer_offsets, kmer_codes = \
+            kmer_rows[order], kmer_offsets[order], kmer_codes[order]
+        frames = []
+        for proteome in _chunks(proteins, chunk_size):
+            starts = proteome.valid_starts(k)
+            window_codes = proteome.window_codes(k)[starts]
+            lo = np.searchsorted(kmer_codes, window_codes, side="left")
+            hi = np.searchsorted(kmer_codes, window_codes, side="right")
+            n_matches = hi - lo
+            matches = np.arange(n_matches.sum()) + np.repeat(
+                lo - np.cumsum(n_matches) + n_matches, n_matches)
+            names, offsets = proteome.locate(np.repeat(starts, n_matches))
+            frames.append(pd.DataFrame({
+                "epitope": self.epitopes[kmer_rows[matches]].astype(object),
+                "protein": names,
+                "offset": offsets,
+                "epitope_offset": kmer_offsets[matches],
+            }))
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(frames, ignore_index=True)[columns]
+
+    def save(self, path):
+        """
+        Write the index to a .npz file, which load reads without rebuilding.
+        """
+        from .iedb.common import atomic_write
+        with atomic_write(path, suffix=".npz") as tmp_path:
+            np.savez(
+                tmp_path,
+                epitopes=self.epitopes,
+                lengths=self.lengths,
+                codes=self.codes,
+                anchor_length=ANCHOR_LENGTH)
+
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        with np.load(path, allow_pickle=False) as data:
+            if int(data["anchor_length"]) != ANCHOR_LENGTH:
+                return cls(data["epitopes"])
+            index.epitopes = data["epitopes"]
+            index.lengths = data["lengths"]
+            index.codes = data["codes"]
+        return index
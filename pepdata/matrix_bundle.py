@@ -0,0 +1,278 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+All amino acid matrices and property vectors of pepdata stored as one
+memory-mappable array, so that processes load them without parsing any
+text and share the pages of the file. The arrays are writable, with writes
+staying private to the process (see read_bundle).
+
+The bundle is a .npy file of bytes plus a .npy index of the offset, shape
+and dtype of each array in it, both named after a hash of the source files
+(the tables under pepdata/matrices, amino_acid_properties.py and
+chou_fasman.py) so that editing a source is enough to make the bundle stale.
+It is built on first use into the pepdata cache directory of datacache
+(where the IEDB exports are downloaded), or ahead of time with
+
+    python -m pepdata.matrix_bundle [directory]
+
+which by default writes it next to the source tables. Set the
+PEPDATA_MATRIX_BUNDLE_DIR environment variable to use another directory.
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import zlib
+from os.path import exists, join
+
+import numpy as np
+
+from .static_data import MATRIX_DIR, PACKAGE_DIR
+
+# change when the layout of the bundle or the set of arrays changes
+BUNDLE_FORMAT = 1
+
+ENV_KEY = "PEPDATA_MATRIX_BUNDLE_DIR"
+
+source_paths = [
+    join(MATRIX_DIR, "BLOSUM30"),
+    join(MATRIX_DIR, "BLOSUM50"),
+    join(MATRIX_DIR, "BLOSUM62"),
+    join(MATRIX_DIR, "pmbec.mat"),
+    join(MATRIX_DIR, "strand_vs_coil.txt"),
+    join(MATRIX_DIR, "helix_vs_strand.txt"),
+    join(MATRIX_DIR, "helix_vs_coil.txt"),
+    join(PACKAGE_DIR, "amino_acid_properties.py"),
+    join(PACKAGE_DIR, "chou_fasman.py"),
+]
+
+def source_fingerprint() -> str:
+    """
+    Checksum of the bundle format and the contents of every source file.
+    """
+    checksum = zlib.crc32(b"%d" % BUNDLE_FORMAT)
+    for path in source_paths:
+        with open(path, "rb") as f:
+            checksum = zlib.crc32(os.path.basename(path).encode() + b"\0", checksum)
+            checksum = zlib.crc32(f.read(), checksum)
+    return "%08x" % checksum
+
+def parse_source_arrays() -> dict:
+    """
+    Parse every array of the bundle from the source files, keyed by e.g.
+    "blosum62", "pmbec", "strand_vs_coil" or "property/hydropathy".
+    """
+    from . import blosum, pmbec, residue_contact_energies
+    from .amino_acid_alphabet import dict_to_amino_acid_matrix
+    from .property_features import property_names, property_table, property_vector
+
+    arrays = {}
+    for name, filename in blosum._blosum_filenames.items():
+        with open(join(MATRIX_DIR, filename), "r") as f:
+            arrays[name] = dict_to_amino_acid_matrix(blosum.parse_blosum_table(f.read()))
+    arrays["pmbec"] = dict_to_amino_acid_matrix(pmbec.read_pmbec_coefficients())
+    for name, transposed_name in residue_contact_energies._interaction_tables.items():
+        with open(join(MATRIX_DIR, name + ".txt"), "r") as f:
+            d = residue_contact_energies.parse_interaction_table(f.read())
+        arrays[name] = dict_to_amino_acid_matrix(d)
+        arrays[transposed_name] = dict_to_amino_acid_matrix(
+            residue_contact_energies.transpose_interaction_dict(d))
+    for name in property_names:
+        arrays["property/" + name] = property_vector(property_table(name))
+    return arrays
+
+def _user_cache_dir():
+    import datacache
+    return datacache.Cache("pepdata").cache_directory_path
+
+def _iter_bundle_dirs():
+    if os.environ.get(ENV_KEY):
+        yield os.environ[ENV_KEY]
+    else:
+        yield MATRIX_DIR
+        # only looked up (importing datacache) without a prebuilt bundle
+        yield _user_cache_dir()
+
+def bundle_dirs() -> list:
+    """
+    Directories searched for the bundle, in order. The last one is where
+    it gets built on first use.
+    """
+    return list(_iter_bundle_dirs())
+
+# byte alignment of every array in the bundle
+ALIGNMENT = 64
+
+MAX_NDIM = 2
+
+# where each array lies in the bundle, stored as a small .npy file so that
+# reading it needs nothing but numpy
+_index_dtype = np.dtype([
+    ("name", "U64"),
+    ("dtype", "U8"),
+    ("offset", "int64"),
+    ("ndim", "int64"),
+    ("shape", "int64", (MAX_NDIM,)),
+])
+
+def array_layout(arrays : dict):
+    """
+    Index of where each of a dictionary of arrays goes in one buffer (at
+    ALIGNMENT byte boundaries) and the size of that buffer. Also used by
+    pepdata.shared_arrays for shared memory.
+    """
+    index = np.zeros(len(arrays), dtype=_index_dtype)
+    offset = 0
+    for entry, (name, array) in zip(index, arrays.items()):
+        if len(name) > _index_dtype["name"].itemsize // 4:
+            raise ValueError("Array name '%s' is too long" % name)
+        if array.ndim > MAX_NDIM or array.dtype.hasobject:
+            raise ValueError(
+                "Can't store array '%s' of dtype %s and shape %s" % (
+                    name, array.dtype, array.shape))
+        entry["name"] = name
+        entry["dtype"] = array.dtype.str
+        entry["offset"] = offset
+        entry["ndim"] = array.ndim
+        entry["shape"][:array.ndim] = array.shape
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    return index, offset
+
+def fill_buffer(buffer : np.ndarray, index : np.ndarray, arrays : dict):
+    """
+    Copy arrays into a uint8 buffer at the offsets of their index.
+    """
+    for entry, array in zip(index, arrays.values()):
+        start = entry["offset"]
+        buffer[start:start + array.nbytes] = \
+            np.ascontiguousarray(array).reshape(-1).view("uint8")
+
+def array_views(buffer : np.ndarray, index : np.ndarray) -> dict:
+    """
+    Arrays of an index as views of the uint8 buffer they were copied into.
+    """
+    arrays = {}
+    for entry in index.tolist():
+        name, dtype, start, ndim, shape = entry
+        dtype = np.dtype(dtype)
+        shape = tuple(shape[:ndim])
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        arrays[name] = buffer[start:start + nbytes].view(dtype).reshape(shape)
+    return arrays
+
+def _bundle_paths(directory, fingerprint):
+    stem = join(directory, "matrix_bundle-%s" % fingerprint)
+    return stem + ".npy", stem + ".index.npy"
+
+def write_bundle(directory : str, arrays : dict | None = None) -> str:
+    """
+    Write the bundle of the current sources into a directory, replacing
+    bundles of older sources. Returns the path of the .npy file.
+    """
+    if arrays is None:
+        arrays = parse_source_arrays()
+    fingerprint = source_fingerprint()
+    data_path, index_path = _bundle_paths(directory, fingerprint)
+    index, nbytes = array_layout(arrays)
+    data = np.zeros(nbytes, dtype="uint8")
+    fill_buffer(data, index, arrays)
+
+    os.makedirs(directory, exist_ok=True)
+    # the index is written last, so a bundle with an index is complete
+    from .iedb.common import atomic_write
+    for path, array in ((data_path, data), (index_path, index)):
+        with atomic_write(path, suffix=".npy") as tmp_path:
+            np.save(tmp_path, array)
+
+    for filename in os.listdir(directory):
+        if filename.startswith("matrix_bundle-") and fingerprint not in filename:
+            try:
+                os.remove(join(directory, filename))
+            except OSError:
+                pass
+    return data_path
+
+def read_bundle(directory : str) -> dict | None:
+    """
+    Memory-map the bundle of the current sources from a directory, or
+    return None if it has none. The file is mapped copy-on-write: arrays
+    are writable like parsed ones, and pages stay shared with other
+    processes until the process writes to them, but writes never reach the
+    file.
+    """
+    data_path, index_path = _bundle_paths(directory, source_fingerprint())
+    if not exists(index_path):
+        return None
+    index = np.load(index_path, allow_pickle=False)
+    return array_views(np.load(data_path, mmap_mode="c"), index)
+
+_arrays = None
+
+def load_arrays() -> dict:
+    """
+    Arrays of the bundle, building it on first use if no directory of
+    bundle_dirs() has one for the current sources. If it can't be written
+    the arrays are parsed from the sources.
+    """
+    global _arrays
+    if _arrays is None:
+        for directory in _iter_bundle_dirs():
+            _arrays = read_bundle(directory)
+            if _arrays is not None:
+                return _arrays
+        arrays = parse_source_arrays()
+        try:
+            write_bundle(directory, arrays)
+            _arrays = read_bundle(directory)
+        except OSError:
+            _arrays = arrays
+    return _arrays
+
+def install_arrays(arrays : dict):
+    """
+    Use other arrays in place of those of the bundle (e.g. views of shared
+    memory, see pepdata.shared_arrays), also rebinding the attributes of
+    pepdata modules which hold arrays used so far, such as
+    pepdata.blosum.blosum62_matrix.
+    """
+    global _arrays
+    old_arrays = _arrays or {}
+    old_names = {id(array): name for (name, array) in old_arrays.items()}
+    _arrays = arrays
+    for module_name, module in list(sys.modules.items()):
+        if module is None or not module_name.startswith("pepdata."):
+            continue
+        for attr, value in list(vars(module).items()):
+            name = old_names.get(id(value))
+            if name is None or old_arrays[name] is not value:
+                continue
+            if name in arrays:
+                setattr(module, attr, arrays[name])
+            else:
+                # read again on next access, by the module's __getattr__
+                delattr(module, attr)
+
+def get_array(name : str) -> np.ndarray:
+    """
+    One array of the bundle, e.g. get_array("blosum62") or
+    get_array("property/hydropathy").
+    """
+    arrays = load_arrays()
+    if name not in arrays:
+        raise KeyError(
+            "Unknown matrix '%s', expected one of %s" % (name, sorted(arrays)))
+    return arrays[name]
+
+if __name__ == "__main__":
+    print(write_bundle(sys.argv[1] if len(sys.argv) > 1 else MATRIX_DIR))
@@ -13,37 +13,332 @@
 # limitations under the License.
 
 
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import os
+import string
+
 import numpy as np
-from sklearn.feature_extraction.text import CountVectorizer
+from scipy import sparse
 from sklearn.preprocessing import normalize
 
-def make_count_vectorizer(reduced_alphabet, max_ngram):
-    if reduced_alphabet is None:
-        preprocessor = None
-    else:
-        preprocessor = lambda s: "".join([reduced_alphabet[si] for si in s])
+from .amino_acid_alphabet import canonical_amino_acid_letters
+from .encoded_peptides import encode_peptides, reduced_alphabet_letters
+
+# use a table from every possible n-gram code to its column (rather than
+# a binary search of the vocabulary) when there are at most this many codes
+DENSE_CODE_LIMIT = 2 ** 22
+
+# number of peptides featurized by each task of transform_parallel
+DEFAULT_CHUNK_SIZE = 100000
+
+# stands in for characters outside of the alphabet of an NgramCounter
+_BREAK_LETTER = "\0"
+
+# odd 64-bit constant (from the golden ratio) used to hash n-gram codes
+_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+class NgramCounter(object):
+    """
+    Count the character n-grams of peptides, giving the same features as
+    sklearn's CountVectorizer(analyzer='char', ngram_range=(1, max_ngram))
+    but without tokenizing strings in Python.
+
+    Peptides are integer encoded (applying the reduced alphabet in the
+    lookup table) and the n-grams of each length become integer codes with
+    base-A arithmetic, which are counted by sorting each row of codes.
+
+    Like CountVectorizer, letters are lowercased unless a reduced alphabet
+    is given, and the vocabulary is the sorted set of n-grams seen by fit.
+    Characters outside of the alphabet (any letter, or the keys of the
+    reduced alphabet), such as digits or '-', break n-grams: neither they
+    nor the n-grams containing them are counted.
+
+    Parameters
+    ----------
+    max_ngram : int
+
+    reduced_alphabet : dict, optional
+
+    dtype : numpy dtype
+
+    alphabet : list of str, optional
+        Letters to count when there's no reduced alphabet (default: any
+        letter, as with CountVectorizer)
+
+    stateless : bool
+        Don't learn a vocabulary, instead use every n-gram of the alphabet
+        in sorted order, or hash n-grams into n_features columns if given.
+        Features then only depend on the parameters of the counter.
+
+    n_features : int, optional
+        Number of hashed columns of a stateless counter
+    """
+    def __init__(
+            self,
+            max_ngram=1,
+            reduced_alphabet=None,
+            dtype=np.float64,
+            alphabet=None,
+            stateless=False,
+            n_features=None):
+        self.max_ngram = max_ngram
+        self.dtype = dtype
+        if reduced_alphabet is not None:
+            self.alphabet = reduced_alphabet_letters(reduced_alphabet)
+            self.letter_map = dict(reduced_alphabet)
+        else:
+            if alphabet is None:
+                alphabet = string.ascii_lowercase
+            self.alphabet = sorted({c.lower() for c in alphabet})
+            self.letter_map = {}
+            for c in self.alphabet:
+                self.letter_map[c] = self.letter_map[c.upper()] = c
+        self.n_codes = self._code_offset(max_ngram + 1)
+        if self.n_codes >= 2 ** 63:
+            raise ValueError("max_ngram=%d too large" % max_ngram)
+        self.code_dtype = "int32" if self.n_codes < 2 ** 31 else "int64"
+        self.stateless = stateless
+        self.n_features = n_features
+        if n_features is not None and not stateless:
+            raise ValueError("n_features is only used by stateless counters")
+        self.vocabulary_ = None
+        # sorted n-gram codes of the vocabulary and the column of each
+        self._codes = None
+        self._columns = None
+        self._code_columns = None
+        if stateless and n_features is None:
+            if self.n_codes > DENSE_CODE_LIMIT:
+                raise ValueError(
+                    "Too many n-grams (%d) to enumerate, use n_features" % (
+                        self.n_codes,))
+            self._fit_codes(np.arange(self.n_codes))
+
+    @property
+    def n_columns(self):
+        if self.n_features is not None:
+            return self.n_features
+        return len(self.vocabulary_)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # cheap to rebuild from _codes and _columns
+        state["_code_columns"] = None
+        return state
+
+    def __setstate__(self, state):
+        state.setdefault("stateless", False)
+        state.setdefault("n_features", None)
+        self.__dict__.update(state)
+
+    def _code_offset(self, n):
+        """
+        Codes of n-grams of each length are kept apart by adding the
+        number of shorter n-grams.
+        """
+        return sum(len(self.alphabet) ** m for m in range(1, n))
+
+    def _decode(self, codes):
+        """
+        N-gram strings of an array of codes.
+        """
+        ngrams = []
+        for n in range(1, self.max_ngram + 1):
+            in_range = (codes >= self._code_offset(n)) & \
+                (codes < self._code_offset(n + 1))
+            letters = []
+            remainder = codes[in_range] - self._code_offset(n)
+            for _ in range(n):
+                remainder, i = np.divmod(remainder, len(self.alphabet))
+                letters.append(np.array(self.alphabet, dtype=object)[i])
+            ngrams.extend("".join(reversed(chars)) for chars in zip(*letters))
+        return ngrams
+
+    def _ngram_codes(self, amino_acid_strings):
+        """
+        Matrix with a row for every peptide and the code of every n-gram
+        position in its columns, or -1 past the end of the peptide and for
+        n-grams containing characters outside of the alphabet.
+        """
+        # characters outside of the alphabet are encoded as an extra letter
+        # which marks the n-grams containing them
+        encoded = encode_peptides(
+            amino_acid_strings,
+            alphabet=self.alphabet + [_BREAK_LETTER],
+            reduced_alphabet=self.letter_map,
+            unknown_letter=_BREAK_LETTER)
+        indices = encoded.indices.astype(self.code_dtype)
+        breaks = encoded.indices == len(self.alphabet)
+        if breaks.any():
+            n_breaks_before = np.zeros(
+                (len(indices), encoded.max_length + 1), dtype="int64")
+            np.cumsum(breaks, axis=1, out=n_breaks_before[:, 1:])
+        else:
+            n_breaks_before = None
+        all_codes = [np.zeros((len(indices), 0), dtype=self.code_dtype)]
+        for n in range(1, self.max_ngram + 1):
+            width = encoded.max_length - n + 1
+            if width <= 0:
+                break
+            codes = np.zeros((len(indices), width), dtype=self.code_dtype)
+            for t in range(n):
+                codes = codes * len(self.alphabet) + indices[:, t:t + width]
+            codes += self._code_offset(n)
+            past_end = np.arange(width)[None, :] + n > encoded.lengths[:, None]
+            codes[past_end] = -1
+            if n_breaks_before is not None:
+                codes[n_breaks_before[:, n:] > n_breaks_before[:, :width]] = -1
+            all_codes.append(codes)
+        return np.concatenate(all_codes, axis=1)
+
+    def _fit_codes(self, codes):
+        codes = codes[codes >= 0]
+        if self.n_codes <= DENSE_CODE_LIMIT:
+            self._codes = np.flatnonzero(
+                np.bincount(codes, minlength=self.n_codes))
+        else:
+            self._codes = np.unique(codes)
+        self._code_columns = None
+        ngrams = self._decode(self._codes)
+        self.vocabulary_ = {
+            ngram: i for (i, ngram) in enumerate(sorted(ngrams))
+        }
+        self._columns = np.array(
+            [self.vocabulary_[ngram] for ngram in ngrams], dtype="int64")
+
+    def _code_to_column(self, codes):
+        """
+        Vocabulary column of every code, or -1 for codes which aren't in it.
+        """
+        if self.n_features is not None:
+            hashed = (codes.astype("uint64") * _HASH_MULTIPLIER) >> np.uint64(32)
+            columns = (hashed % np.uint64(self.n_features)).astype("int64")
+            columns[codes < 0] = -1
+            return columns
+        if self.n_codes <= DENSE_CODE_LIMIT:
+            if self._code_columns is None:
+                self._code_columns = np.full(
+                    self.n_codes + 1, -1, dtype=self.code_dtype)
+                self._code_columns[self._codes] = self._columns
+            # code -1 looks up the extra last entry
+            return self._code_columns[codes]
+        positions = np.searchsorted(self._codes, codes)
+        positions[positions == len(self._codes)] = 0
+        known = (self._codes[positions] == codes) & (codes >= 0)
+        return np.where(known, self._columns[positions], -1)
+
+    def _count(self, codes):
+        """
+        Sparse CSR matrix of n-gram counts, ignoring n-grams not seen by fit.
+        Duplicate columns are merged by sorting each (short) row rather than
+        by a global sort of all the n-gram occurrences.
+        """
+        n_rows = len(codes)
+        n_columns = self.n_columns
+        columns = self._code_to_column(codes)
+        columns[columns < 0] = n_columns
+        columns.sort(axis=1)
+        valid = columns < n_columns
+        starts = valid.copy()
+        starts[:, 1:] &= columns[:, 1:] != columns[:, :-1]
+        start_positions = np.flatnonzero(starts)
+        n_valid_before = np.concatenate([[0], np.cumsum(valid.ravel())])
+        counts = np.diff(
+            n_valid_before[np.append(start_positions, valid.size)])
+        indptr = np.concatenate([[0], np.cumsum(starts.sum(axis=1))])
+        return sparse.csr_matrix(
+            (
+                counts.astype(self.dtype),
+                columns.ravel()[start_positions],
+                indptr
+            ),
+            shape=(n_rows, n_columns))
 
-    return CountVectorizer(
-        analyzer='char',
-        ngram_range=(1, max_ngram),
-        dtype=np.float64,
-        preprocessor=preprocessor)
+    def fit(self, amino_acid_strings):
+        if not self.stateless:
+            self._fit_codes(self._ngram_codes(amino_acid_strings))
+        return self
+
+    def fit_transform(self, amino_acid_strings):
+        codes = self._ngram_codes(amino_acid_strings)
+        if not self.stateless:
+            self._fit_codes(codes)
+        return self._count(codes)
+
+    def transform(self, amino_acid_strings):
+        assert self.stateless or self.vocabulary_ is not None, \
+            "Must call 'fit' before 'transform'"
+        return self._count(self._ngram_codes(amino_acid_strings))
+
+    def get_feature_names_out(self):
+        if self.n_features is not None:
+            raise ValueError("Hashed features have no names")
+        return np.array(sorted(self.vocabulary_, key=self.vocabulary_.get), dtype=object)
 
 class PeptideVectorizer(object):
     """
     Make n-gram frequency vectors from peptide sequences
+
+    Parameters
+    ----------
+    max_ngram : int
+        Count n-grams of lengths 1 through max_ngram
+
+    normalize_row : bool
+        Divide each row by its sum, so rows are n-gram frequencies
+
+    reduced_alphabet : dict, optional
+        Remap amino acid letters to some other alphabet before counting
+
+    training_already_reduced : bool
+        Training sequences already use the reduced alphabet
+
+    sparse : bool
+        Return scipy.sparse CSR matrices instead of dense arrays, which
+        avoids materializing a column for every possible n-gram
+
+    dtype : numpy dtype
+        Type of the returned values, e.g. np.float32 to halve memory use
+
+    n_jobs : int
+        Number of processes used by transform (see transform_parallel),
+        None or -1 to use every CPU
+
+    stateless : bool
+        Don't learn n-grams from training data: columns are every n-gram of
+        the 20 amino acids (or the reduced alphabet) in sorted order, or
+        hashed n-grams if n_features is given. No fitting is needed and
+        vectors made by separately constructed vectorizers are compatible.
+        Letters outside of that alphabet, such as X, are skipped along with
+        the n-grams containing them, as a fitted vectorizer drops n-grams
+        it hasn't seen.
+
+    n_features : int, optional
+        Number of columns of hashed n-grams in stateless mode, for
+        alphabets and max_ngram with too many n-grams to enumerate
     """
     def __init__(
             self,
             max_ngram=1,
             normalize_row=True,
             reduced_alphabet=None,
-            training_already_reduced=False):
+            training_already_reduced=False,
+            sparse=False,
+            dtype=np.float64,
+            n_jobs=1,
+            stateless=False,
+            n_features=None):
         self.reduced_alphabet = reduced_alphabet
         self.max_ngram = max_ngram
         self.normalize_row = normalize_row
         self.training_already_reduced = training_already_reduced
+        self.sparse = sparse
+        self.dtype = dtype
+        self.n_jobs = n_jobs
+        self.stateless = stateless
+        self.n_features = n_features
         self.count_vectorizer = None
+        if stateless:
+            self.count_vectorizer = self._make_counter()
 
     def __getstate__(self):
         return {
@@ -52,30 +347,106 @@ class PeptideVectorizer(object):
             'training_already_reduced': self.training_already_reduced,
             'normalize_row': self.normalize_row,
             'max_ngram': self.max_ngram,
+            'sparse': self.sparse,
+            'dtype': self.dtype,
+            'n_jobs': self.n_jobs,
+            'stateless': self.stateless,
+            'n_features': self.n_features,
         }
 
-    def fit_transform(self, amino_acid_strings):
-        self.count_vectorizer = \
-            make_count_vectorizer(self.reduced_alphabet, self.max_ngram)
-
-        if self.training_already_reduced:
-            c = make_count_vectorizer(None, self.max_ngram)
-            X = c.fit_transform(amino_acid_strings).todense()
-            self.count_vectorizer.vocabulary_ = c.vocabulary_
-        else:
-            c = self.count_vectorizer
-            X = c.fit_transform(amino_acid_strings).todense()
+    def __setstate__(self, state):
+        # vectorizers pickled before these options existed
+        state.setdefault('sparse', False)
+        state.setdefault('dtype', np.float64)
+        state.setdefault('n_jobs', 1)
+        state.setdefault('stateless', False)
+        state.setdefault('n_features', None)
+        self.__dict__.update(state)
 
+    def _finish(self, X):
+        """
+        Normalize the sparse counts and only densify them if asked to.
+        """
         if self.normalize_row:
-            X = normalize(X, norm='l1')
-        return X
+            X = normalize(X, norm='l1', copy=False)
+        if self.sparse:
+            return X.tocsr()
+        return X.toarray()
+
+    def _make_counter(self):
+        return NgramCounter(
+            max_ngram=self.max_ngram,
+            reduced_alphabet=self.reduced_alphabet,
+            dtype=self.dtype,
+            alphabet=canonical_amino_acid_letters if self.stateless else None,
+            stateless=self.stateless,
+            n_features=self.n_features)
+
+    def fit_transform(self, amino_acid_strings):
+        # reduced alphabets map their own letters to themselves, so training
+        # sequences which are already reduced go through the same counter
+        if not self.stateless:
+            self.count_vectorizer = self._make_counter()
+        X = self.count_vectorizer.fit_transform(amino_acid_strings)
+        return self._finish(X)
 
     def fit(self, amino_acid_strings):
         self.fit_transform(amino_acid_strings)
 
     def transform(self, amino_acid_strings):
+        if self.n_jobs != 1:
+            return self.transform_parallel(amino_acid_strings, n_jobs=self.n_jobs)
+        return self._transform(amino_acid_strings)
+
+    def _transform(self, amino_acid_strings):
         assert self.count_vectorizer, "Must call 'fit' before 'transform'"
-        X = self.count_vectorizer.transform(amino_acid_strings).todense()
-        if self.normalize_row:
-            X = normalize(X, norm='l1')
-        return X
+        X = self.count_vectorizer.transform(amino_acid_strings)
+        return self._finish(X)
+
+    def transform_parallel(
+            self,
+            amino_acid_strings,
+            n_jobs=None,
+            chunk_size=DEFAULT_CHUNK_SIZE,
+            backend="process"):
+        """
+        Featurize chunks of the peptides in a pool of workers and stack the
+        results in input order, giving the same result as transform.
+
+        Parameters
+        ----------
+        amino_acid_strings
+            List, array or Series of peptides
+
+        n_jobs : int, optional
+            Number of workers, defaults to the number of CPUs
+
+        chunk_size : int
+            Number of peptides featurized by each task
+
+        backend : {"process", "thread"}
+            Featurize in a process pool, or a thread pool which avoids
+            copying peptides and results between processes but only runs
+            the NumPy parts of featurization concurrently
+        """
+        assert self.count_vectorizer, "Must call 'fit' before 'transform'"
+        if n_jobs is None or n_jobs == -1:
+            n_jobs = os.cpu_count() or 1
+        amino_acid_strings = list(amino_acid_strings)
+        chunks = [
+            amino_acid_strings[i:i + chunk_size]
+            for i in range(0, len(amino_acid_strings), chunk_size)
+        ]
+        if n_jobs == 1 or len(chunks) <= 1:
+            return self._transform(amino_acid_strings)
+        if backend == "process":
+            executor_class = ProcessPoolExecutor
+        elif backend == "thread":
+            executor_class = ThreadPoolExecutor
+        else:
+            raise ValueError("Unknown backend: %s" % backend)
+        with executor_class(max_workers=min(n_jobs, len(chunks))) as executor:
+            results = list(executor.map(self._transform, chunks))
+        if self.sparse:
+            return sparse.vstack(results, format="csr")
+        return np.vstack(results)
@@ -16,11 +16,11 @@ from os.path import join
 
 from .static_data import MATRIX_DIR
 
-from .amino_acid_alphabet import dict_to_amino_acid_matrix
+from . import matrix_bundle
 
 def read_pmbec_coefficients(
         key_type='row',
-        verbose=True,
+        verbose=False,
         filename=join(MATRIX_DIR, 'pmbec.mat')):
     """
     Parameters
@@ -82,6 +82,17 @@ def read_pmbec_coefficients(
                 add_pair(row_letter, col_letter, value)
     return d
 
-# dictionary of PMBEC coefficient accessed like pmbec_dict["V"]["R"]
-pmbec_dict = read_pmbec_coefficients(key_type="row")
-pmbec_matrix = dict_to_amino_acid_matrix(pmbec_dict)
+def __getattr__(attr):
+    # the coefficients are parsed on first access of pmbec_dict, the matrix
+    # is read from pepdata.matrix_bundle on first access of pmbec_matrix
+    if attr == "pmbec_dict":
+        # dictionary of PMBEC coefficient accessed like pmbec_dict["V"]["R"]
+        globals()[attr] = read_pmbec_coefficients(key_type="row")
+        return globals()[attr]
+    if attr == "pmbec_matrix":
+        globals()[attr] = matrix_bundle.get_array("pmbec")
+        return globals()[attr]
+    raise AttributeError("module %r has no attribute %r" % (__name__, attr))
+
+def __dir__():
+    return sorted(list(globals()) + ["pmbec_dict", "pmbec_matrix"])
@@ -0,0 +1,186 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Featurize batches of peptides by the physical/chemical properties of
+their amino acids, using one (20 x P) matrix of the selected properties.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+
+from . import matrix_bundle
+from .amino_acid_alphabet import amino_acid_letter_indices
+from .encoded_peptides import PADDING_INDEX, as_canonical_encoding
+
+property_names = [
+    "hydropathy",
+    "volume",
+    "polarity",
+    "pK_side_chain",
+    "prct_exposed_residues",
+    "hydrophilicity",
+    "accessible_surface_area",
+    "local_flexibility",
+    "accessible_surface_area_folded",
+    "refractivity",
+    "mass",
+    "solvent_exposed_area",
+    "alpha_helix_score",
+    "beta_sheet_score",
+    "turn_score",
+]
+
+_chou_fasman_names = ("alpha_helix_score", "beta_sheet_score", "turn_score")
+
+def property_table(name : str) -> dict:
+    """
+    Dictionary of a property in pepdata.amino_acid_properties or
+    pepdata.chou_fasman, e.g. property_table("hydropathy"), parsed from
+    the source table (the dictionaries of those modules are read from the
+    matrix bundle, which is built from this).
+    """
+    if name not in property_names:
+        raise ValueError(
+            "Unknown property '%s', expected one of %s" % (name, property_names))
+    if name in _chou_fasman_names:
+        from . import chou_fasman
+        tables = chou_fasman.parse_chou_fasman(chou_fasman.chou_fasman_table)
+        return tables[_chou_fasman_names.index(name)]
+    from . import amino_acid_properties
+    if name in amino_acid_properties.property_tables:
+        return amino_acid_properties.parse_property_table(
+            amino_acid_properties.property_tables[name])
+    return getattr(amino_acid_properties, name)
+
+POOLINGS = ("mean", "min", "max", "sum")
+
+def property_vector(table : dict) -> np.ndarray:
+    """
+    Values of a property for the 20 canonical amino acids in index order.
+    Tables can be keyed by letter (amino_acid_properties) or by index
+    (chou_fasman).
+    """
+    values = np.full(20, np.nan)
+    for key, value in table.items():
+        i = amino_acid_letter_indices[key] if isinstance(key, str) else key
+        values[i] = value
+    if np.isnan(values).any():
+        raise ValueError("Missing amino acids in property table")
+    return values
+
+def property_matrix(
+        properties : list[str] | None = None,
+        standardize : bool = False) -> np.ndarray:
+    """
+    (20 x P) array of the given properties (default: all of property_names),
+    read from pepdata.matrix_bundle. If standardize is True each property is
+    shifted and scaled to have mean 0 and standard deviation 1 across the 20
+    amino acids.
+    """
+    if properties is None:
+        properties = list(property_names)
+    for name in properties:
+        if name not in property_names:
+            raise ValueError(
+                "Unknown property '%s', expected one of %s" % (name, property_names))
+    matrix = np.column_stack([
+        matrix_bundle.get_array("property/" + name) for name in properties
+    ])
+    if standardize:
+        matrix = (matrix - matrix.mean(axis=0)) / matrix.std(axis=0)
+    return matrix
+
+class PropertyFeaturizer(object):
+    """
+    Turn peptides into amino acid property features.
+
+    Parameters
+    ----------
+    properties : list of str, optional
+        Names in property_names, defaults to all of them
+
+    pooling : str or list of str, optional
+        Any of "mean", "min", "max" and "sum" to reduce over the positions
+        of each peptide, giving an (N x P) array per pooling (concatenated
+        along columns). Without pooling the result is (N x L x P) with NaN
+        past the end of shorter peptides.
+
+    standardize : bool
+        Standardize each property across the 20 amino acids
+
+    dtype : numpy dtype
+    """
+    def __init__(
+            self,
+            properties=None,
+            pooling=None,
+            standardize=False,
+            dtype=np.float32):
+        if properties is None:
+            properties = list(property_names)
+        self.properties = list(properties)
+        if isinstance(pooling, str):
+            pooling = [pooling]
+        for name in pooling or []:
+            if name not in POOLINGS:
+                raise ValueError(
+                    "Unknown pooling '%s', expected one of %s" % (name, POOLINGS))
+        self.pooling = pooling
+        self.standardize = standardize
+        self.dtype = dtype
+        self.matrix = property_matrix(
+            self.properties, standardize=standardize).astype(dtype)
+
+    @property
+    def feature_names(self):
+        if not self.pooling:
+            return list(self.properties)
+        return [
+            "%s_%s" % (pooling, name)
+            for pooling in self.pooling
+            for name in self.properties
+        ]
+
+    def _table(self, padding_value):
+        """
+        Matrix extended to every possible index, so that padding positions
+        gather padding_value.
+        """
+        table = np.full(
+            (PADDING_INDEX + 1, len(self.properties)), padding_value,
+            dtype=self.dtype)
+        table[:len(self.matrix)] = self.matrix
+        return table
+
+    def transform(self, peptides):
+        """
+        Features of a list of peptides or of EncodedPeptides (in canonical
+        amino acid order).
+        """
+        encoded = as_canonical_encoding(peptides)
+        indices = encoded.indices
+        if not self.pooling:
+            return self._table(np.nan)[indices]
+        results = []
+        for pooling in self.pooling:
+            if pooling == "min":
+                results.append(self._table(np.inf)[indices].min(axis=1))
+            elif pooling == "max":
+                results.append(self._table(-np.inf)[indices].max(axis=1))
+            else:
+                total = self._table(0)[indices].sum(axis=1)
+                if pooling == "mean":
+                    total /= encoded.lengths[:, None].astype(self.dtype)
+                results.append(total)
+        return np.concatenate(results, axis=1)
@@ -12,7 +12,8 @@
 
 from os.path import join
 
-from .amino_acid_alphabet import canonical_amino_acid_letters, dict_to_amino_acid_matrix
+from . import matrix_bundle
+from .amino_acid_alphabet import canonical_amino_acid_letters
 from .static_data import MATRIX_DIR
 
 
@@ -46,29 +47,43 @@ def transpose_interaction_dict(d):
     return transposed
 
 
-with open(join(MATRIX_DIR, 'strand_vs_coil.txt'), 'r') as f:
-    # Strand vs. Coil
-    strand_vs_coil_dict = parse_interaction_table(f.read())
-    strand_vs_coil_array = dict_to_amino_acid_matrix(strand_vs_coil_dict)
+# each table file gives an interaction and its transpose, e.g.
+# strand_vs_coil.txt gives strand_vs_coil_dict and coil_vs_strand_dict,
+# parsed on first access of either of them, while arrays such as
+# strand_vs_coil_array are read from pepdata.matrix_bundle
+_interaction_tables = {
+    "strand_vs_coil": "coil_vs_strand",
+    "helix_vs_strand": "strand_vs_helix",
+    "helix_vs_coil": "coil_vs_helix",
+}
 
-    # Coil vs. Strand
-    coil_vs_strand_dict = transpose_interaction_dict(strand_vs_coil_dict)
-    coil_vs_strand_array = dict_to_amino_acid_matrix(coil_vs_strand_dict)
+def _load_dicts(name):
+    with open(join(MATRIX_DIR, name + '.txt'), 'r') as f:
+        d = parse_interaction_table(f.read())
+    globals()[name + "_dict"] = d
+    globals()[_interaction_tables[name] + "_dict"] = transpose_interaction_dict(d)
 
-with open(join(MATRIX_DIR, 'helix_vs_strand.txt'), 'r') as f:
-    # Helix vs. Strand
-    helix_vs_strand_dict = parse_interaction_table(f.read())
-    helix_vs_strand_array = dict_to_amino_acid_matrix(helix_vs_strand_dict)
+def _table_name(interaction):
+    for name, transposed_name in _interaction_tables.items():
+        if interaction in (name, transposed_name):
+            return name
+    return None
 
-    # Strand vs. Helix
-    strand_vs_helix_dict = transpose_interaction_dict(helix_vs_strand_dict)
-    strand_vs_helix_array = dict_to_amino_acid_matrix(strand_vs_helix_dict)
+def __getattr__(attr):
+    interaction, _, suffix = attr.rpartition("_")
+    name = _table_name(interaction)
+    if name is not None and suffix == "dict":
+        _load_dicts(name)
+        return globals()[attr]
+    if name is not None and suffix == "array":
+        globals()[attr] = matrix_bundle.get_array(interaction)
+        return globals()[attr]
+    raise AttributeError("module %r has no attribute %r" % (__name__, attr))
 
-with open(join(MATRIX_DIR, 'helix_vs_coil.txt'), 'r') as f:
-    # Helix vs. Coil
-    helix_vs_coil_dict = parse_interaction_table(f.read())
-    helix_vs_coil_array = dict_to_amino_acid_matrix(helix_vs_coil_dict)
-
-    # Coil vs. Helix
-    coil_vs_helix_dict = transpose_interaction_dict(helix_vs_coil_dict)
-    coil_vs_helix_array = dict_to_amino_acid_matrix(coil_vs_helix_dict)
+def __dir__():
+    return sorted(list(globals()) + [
+        interaction + suffix
+        for item in _interaction_tables.items()
+        for interaction in item
+        for suffix in ("_dict", "_array")
+    ])
@@ -0,0 +1,407 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Opt-in sharing of loaded data between worker processes.
+
+A parent process (e.g. a gunicorn master with preload, or the process
+creating a multiprocessing pool) calls publish(), which copies the amino
+acid matrices of pepdata.matrix_bundle and the unfiltered IEDB exports of
+pepdata.iedb.tcell/mhc into one block of multiprocessing.shared_memory.
+Workers call attach(name) with the name of that block, after which
+blosum62_matrix etc. and tcell/mhc.load_dataframe use views of the shared
+block instead of loading their own copy:
+
+    shared = pepdata.shared_arrays.publish()
+    ...  # in each worker
+    pepdata.shared_arrays.attach(shared.name)
+    ...  # at shutdown
+    shared.unlink()
+
+IEDB DataFrames keep the dtypes and attrs of the loaders. Numeric columns
+and the codes of categorical columns are views of shared memory, and so
+are the UTF-8 bytes of string columns (and of the categories of
+categorical columns) with pyarrow installed, otherwise they're decoded once
+per worker. Columns of other dtypes (e.g. object columns of mixed values)
+are pickled and unpickled by each worker.
+"""
+
+from __future__ import annotations
+
+import io
+from multiprocessing import shared_memory
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from . import matrix_bundle
+
+MAGIC = b"PEPDATA1"
+
+# magic and the size of the index, followed by the index (as .npy bytes)
+# and then the arrays
+HEADER_SIZE = 64
+
+def _aligned(n):
+    return -(-n // matrix_bundle.ALIGNMENT) * matrix_bundle.ALIGNMENT
+
+class _SharedMemory(shared_memory.SharedMemory):
+    def __del__(self):
+        # arrays of the block may outlive this object, in which case the
+        # mapping is released along with the last of them
+        try:
+            self.close()
+        except (OSError, BufferError):
+            pass
+
+def _attach_memory(name):
+    """
+    Attach to an existing block without registering it with this process's
+    resource tracker, which would otherwise unlink it when a worker exits.
+    """
+    try:
+        return _SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 has no track option
+        from multiprocessing import resource_tracker
+        memory = _SharedMemory(name=name)
+        try:
+            resource_tracker.unregister(memory._name, "shared_memory")
+        except Exception:
+            pass
+        return memory
+
+class SharedArrays(object):
+    """
+    Named, read-only numpy arrays in one block of shared memory. Create
+    with SharedArrays.create (which copies the arrays in) or attach to an
+    existing block with SharedArrays.attach.
+
+    Parameters
+    ----------
+    memory : multiprocessing.shared_memory.SharedMemory
+
+    owner : bool
+        Whether this process created the block and should unlink it
+    """
+    def __init__(self, memory, owner=False):
+        self.memory = memory
+        self.owner = owner
+        header = bytes(memory.buf[:HEADER_SIZE])
+        if header[:len(MAGIC)] != MAGIC:
+            raise ValueError(
+                "Shared memory block '%s' wasn't created by pepdata" % memory.name)
+        index_nbytes = int(np.frombuffer(header, dtype="int64", count=1, offset=8)[0])
+        index = np.load(
+            io.BytesIO(bytes(memory.buf[HEADER_SIZE:HEADER_SIZE + index_nbytes])),
+            allow_pickle=False)
+        data_start = HEADER_SIZE + _aligned(index_nbytes)
+        # frombuffer (unlike np.ndarray(buffer=...)) holds on to the buffer,
+        # so the block can't be unmapped while any of its arrays are in use
+        data = np.frombuffer(memory.buf, dtype="uint8", offset=data_start)
+        data.flags.writeable = False
+        self.arrays = matrix_bundle.array_views(data, index)
+
+    @classmethod
+    def create(cls, arrays : dict, name : str | None = None):
+        index, nbytes = matrix_bundle.array_layout(arrays)
+        index_bytes = io.BytesIO()
+        np.save(index_bytes, index, allow_pickle=False)
+        index_bytes = index_bytes.getvalue()
+        data_start = HEADER_SIZE + _aligned(len(index_bytes))
+        memory = _SharedMemory(
+            name=name, create=True, size=max(data_start + nbytes, 1))
+        header = MAGIC + np.array([len(index_bytes)], dtype="int64").tobytes()
+        memory.buf[:len(header)] = header
+        memory.buf[HEADER_SIZE:HEADER_SIZE + len(index_bytes)] = index_bytes
+        data = np.frombuffer(memory.buf, dtype="uint8", offset=data_start)
+        matrix_bundle.fill_buffer(data, index, arrays)
+        del data
+        return cls(memory, owner=True)
+
+    @classmethod
+    def attach(cls, name : str):
+        return cls(_attach_memory(name))
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    @property
+    def nbytes(self):
+        return self.memory.size
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def __contains__(self, name):
+        return name in self.arrays
+
+    def __iter__(self):
+        return iter(self.arrays)
+
+    def __len__(self):
+        return len(self.arrays)
+
+    def keys(self):
+        return self.arrays.keys()
+
+    def close(self):
+        """
+        Unmap the block from this process. Only possible once nothing
+        refers to its arrays any more (e.g. DataFrames built from them),
+        until then the block stays mapped.
+        """
+        self.arrays = {}
+        try:
+            self.memory.close()
+        except BufferError:
+            pass
+
+    def unlink(self):
+        """
+        Free the block once every process has closed it. Called by the
+        process which created it, e.g. at shutdown.
+        """
+        self.close()
+        self.memory.unlink()
+
+def _encode_strings(values):
+    """
+    Offsets and concatenated UTF-8 bytes of a list of strings.
+    """
+    encoded = [value.encode("utf-8") for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype="int64")
+    offsets[1:] = np.cumsum([len(b) for b in encoded])
+    return offsets, np.frombuffer(b"".join(encoded), dtype="uint8")
+
+def _decode_strings(offsets, data, null=None):
+    """
+    Strings encoded by _encode_strings (missing where null is set), as an
+    ArrowStringArray viewing their bytes if pyarrow is available and
+    otherwise as an object array.
+    """
+    from .iedb.common import import_pyarrow
+    pa = import_pyarrow()
+    if pa is not None:
+        validity = None
+        if null is not None and null.any():
+            validity = pa.array(~null).buffers()[1]
+        array = pa.LargeStringArray.from_buffers(
+            len(offsets) - 1, pa.py_buffer(offsets), pa.py_buffer(data), validity)
+        return pd.arrays.ArrowStringArray(array)
+    data = data.tobytes()
+    values = np.array([
+        data[start:end].decode("utf-8")
+        for (start, end) in zip(offsets[:-1].tolist(), offsets[1:].tolist())
+    ], dtype=object)
+    if null is not None:
+        values[null] = None
+    return values
+
+def _is_strings(values):
+    if isinstance(values.dtype, pd.StringDtype):
+        return True
+    return values.dtype == object and all(isinstance(v, str) for v in values)
+
+def _pickled(value):
+    return np.frombuffer(
+        pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), dtype="uint8")
+
+def _unpickled(array):
+    return pickle.loads(array.tobytes())
+
+def _codes_dtype(n_categories):
+    for dtype in ("int8", "int16", "int32"):
+        if n_categories < np.iinfo(dtype).max:
+            return dtype
+    return "int64"
+
+def encode_dataframe(df : pd.DataFrame, prefix : str) -> dict:
+    """
+    Arrays (named prefix + ...) which decode_dataframe turns back into an
+    IEDB DataFrame with the same dtypes and attrs: numeric columns as they
+    are, categorical columns as codes and categories, string columns as
+    their UTF-8 bytes and any other column pickled.
+    """
+    from .iedb.columnar import flatten_columns
+    arrays = {}
+    arrays[prefix + "columns/offsets"], arrays[prefix + "columns/data"] = \
+        _encode_strings(flatten_columns(df.columns))
+    # the dtype of every column, or of its categories for categoricals
+    arrays[prefix + "dtypes/offsets"], arrays[prefix + "dtypes/data"] = \
+        _encode_strings([
+            str(dtype.categories.dtype if isinstance(dtype, pd.CategoricalDtype) else dtype)
+            for dtype in df.dtypes
+        ])
+    if df.attrs:
+        arrays[prefix + "attrs"] = _pickled(df.attrs)
+    if not df.index.equals(pd.RangeIndex(len(df))):
+        arrays[prefix + "index"] = df.index.to_numpy()
+    for i in range(df.shape[1]):
+        column = df.iloc[:, i]
+        name = "%s%d/" % (prefix, i)
+        if isinstance(column.dtype, np.dtype) and column.dtype.kind in "biufcmM":
+            arrays[name + "values"] = column.to_numpy()
+        elif isinstance(column.dtype, pd.CategoricalDtype):
+            categories = column.cat.categories
+            arrays[name + "codes"] = column.cat.codes.to_numpy().astype(
+                _codes_dtype(len(categories)))
+            if categories.dtype.kind in "biufc":
+                arrays[name + "categories"] = categories.to_numpy()
+            elif _is_strings(categories):
+                arrays[name + "categories/offsets"], arrays[name + "categories/data"] = \
+                    _encode_strings(list(categories))
+            else:
+                arrays[name + "categories/pickle"] = _pickled(categories)
+        elif isinstance(column.dtype, pd.StringDtype):
+            null = column.isnull().to_numpy()
+            arrays[name + "strings/offsets"], arrays[name + "strings/data"] = \
+                _encode_strings(column.fillna("").tolist())
+            arrays[name + "strings/null"] = null
+        else:
+            arrays[name + "pickle"] = _pickled(column.to_numpy())
+    return arrays
+
+def decode_dataframe(arrays : dict, prefix : str) -> pd.DataFrame:
+    """
+    DataFrame of the arrays written by encode_dataframe, whose columns
+    are views of those arrays where possible.
+    """
+    from .iedb.columnar import unflatten_columns
+    column_names = list(_decode_strings(
+        arrays[prefix + "columns/offsets"], arrays[prefix + "columns/data"]))
+    dtypes = list(_decode_strings(
+        arrays[prefix + "dtypes/offsets"], arrays[prefix + "dtypes/data"]))
+    columns = {}
+    for i in range(len(column_names)):
+        name = "%s%d/" % (prefix, i)
+        if name + "values" in arrays:
+            columns[i] = arrays[name + "values"]
+        elif name + "codes" in arrays:
+            if name + "categories" in arrays:
+                categories = pd.Index(arrays[name + "categories"])
+            elif name + "categories/pickle" in arrays:
+                categories = _unpickled(arrays[name + "categories/pickle"])
+            else:
+                categories = pd.Index(_decode_strings(
+                    arrays[name + "categories/offsets"],
+                    arrays[name + "categories/data"])).astype(
+                        pd.api.types.pandas_dtype(dtypes[i]))
+            columns[i] = pd.Categorical.from_codes(
+                arrays[name + "codes"], categories=categories)
+        elif name + "strings/offsets" in arrays:
+            values = _decode_strings(
+                arrays[name + "strings/offsets"],
+                arrays[name + "strings/data"],
+                arrays[name + "strings/null"])
+            columns[i] = pd.array(values, dtype=object) \
+                if isinstance(values, np.ndarray) else values
+            columns[i] = columns[i].astype(pd.api.types.pandas_dtype(dtypes[i]))
+        else:
+            columns[i] = _unpickled(arrays[name + "pickle"])
+    index = arrays.get(prefix + "index")
+    df = pd.DataFrame(columns, index=index, copy=False)
+    df.columns = unflatten_columns(column_names)
+    if prefix + "attrs" in arrays:
+        df.attrs = _unpickled(arrays[prefix + "attrs"])
+    return df
+
+IEDB_SOURCES = ("tcell", "mhc")
+
+def _iedb_prefix(source, nrows):
+    return "iedb/%s/%s/" % (source, "all" if nrows is None else nrows)
+
+def _parse_iedb_prefix(prefix):
+    _, source, nrows, _ = prefix.split("/")
+    return source, None if nrows == "all" else int(nrows)
+
+# blocks published or attached by this process, kept referenced so that
+# the arrays handed out stay mapped
+_registries = []
+
+def install(shared : SharedArrays):
+    """
+    Make this process use the matrices and IEDB DataFrames of a block.
+    Unlike the arrays of a matrix bundle, matrices from shared memory are
+    read-only, since a write would change them for every process.
+    """
+    matrices = {
+        name[len("matrix/"):]: array
+        for (name, array) in shared.arrays.items()
+        if name.startswith("matrix/")
+    }
+    if matrices:
+        matrix_bundle.install_arrays(matrices)
+    prefixes = sorted({
+        name[:name.index("/columns/")] + "/"
+        for name in shared.arrays
+        if name.startswith("iedb/") and "/columns/" in name
+    })
+    for prefix in prefixes:
+        from .iedb.common import _source_module
+        source, nrows = _parse_iedb_prefix(prefix)
+        df = decode_dataframe(shared.arrays, prefix)
+        # pinned, so that loads of other nrows don't evict it
+        _source_module(source)._load_base_dataframe.cache_pin(df, nrows=nrows)
+    _registries.append(shared)
+
+def publish(
+        matrices : bool = True,
+        iedb=IEDB_SOURCES,
+        nrows : int | None = None,
+        name : str | None = None) -> SharedArrays:
+    """
+    Load the matrices and IEDB exports in this process and copy them into
+    a new block of shared memory for workers to attach to.
+
+    Parameters
+    ----------
+    matrices : bool
+        Share every array of pepdata.matrix_bundle
+
+    iedb : list of str
+        Which of "tcell" and "mhc" to share, loading their full exports
+        (or the first nrows rows)
+
+    nrows : int, optional
+        Passed to the IEDB loaders
+
+    name : str, optional
+        Name of the block, defaults to a random name
+
+    Returns SharedArrays, whose name is passed to attach in the workers.
+    The creating process should call its unlink method at shutdown.
+    """
+    arrays = {}
+    if matrices:
+        for matrix_name, array in matrix_bundle.load_arrays().items():
+            arrays["matrix/" + matrix_name] = array
+    if isinstance(iedb, str):
+        iedb = [iedb]
+    for source in iedb:
+        from .iedb.common import _source_module
+        df = _source_module(source)._load_base_dataframe(nrows=nrows)
+        arrays.update(encode_dataframe(df, _iedb_prefix(source, nrows)))
+    shared = SharedArrays.create(arrays, name=name)
+    install(shared)
+    return shared
+
+def attach(name : str) -> SharedArrays:
+    """
+    Use the block published under a name in this process (e.g. in each
+    worker after it starts), without copying its arrays.
+    """
+    shared = SharedArrays.attach(name)
+    install(shared)
+    return shared
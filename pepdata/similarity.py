@@ -0,0 +1,146 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Position-wise similarity between batches of equal-length peptides under an
+amino acid substitution matrix (e.g. blosum62_matrix, pmbec_matrix or one of
+the residue contact energy arrays).
+
+The score of peptides a and b is sum_k matrix[a[k], b[k]]. For two batches
+this is computed as a matrix product: each peptide of the first batch becomes
+the concatenation of its letters' matrix rows and each peptide of the second
+batch becomes a one-hot vector, so a block of scores is one GEMM.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+
+from .amino_acid_alphabet import canonical_amino_acid_letters
+from .encoded_peptides import EncodedPeptides, as_canonical_encoding
+
+DEFAULT_CHUNK_SIZE = 4096
+
+def _peptide_length(encoded : EncodedPeptides) -> int:
+    if len(encoded) == 0:
+        return encoded.max_length
+    length = encoded.lengths[0]
+    if (encoded.lengths != length).any() or encoded.max_length != length:
+        raise ValueError(
+            "Expected peptides of equal length, got lengths %s" % (
+                sorted(set(encoded.lengths.tolist())),))
+    return int(length)
+
+def _substitution_matrix(matrix, dtype) -> np.ndarray:
+    """
+    Restrict a matrix such as blosum62_matrix (which has extra rows and columns
+    for ambiguous letters) to the 20 canonical amino acids.
+    """
+    n = len(canonical_amino_acid_letters)
+    matrix = np.asarray(matrix, dtype=dtype)
+    if matrix.ndim != 2 or matrix.shape[0] < n or matrix.shape[1] < n:
+        raise ValueError(
+            "Expected a matrix of at least %dx%d, got shape %s" % (
+                n, n, matrix.shape))
+    return matrix[:n, :n]
+
+def _profile(indices, matrix):
+    """
+    Row i is the concatenation of matrix[indices[i, k]] for every position k.
+    """
+    return matrix[indices].reshape(len(indices), -1)
+
+def _one_hot(indices, n_letters, dtype):
+    n, length = indices.shape
+    result = np.zeros((n, length * n_letters), dtype=dtype)
+    columns = np.arange(length) * n_letters + indices
+    result[np.arange(n)[:, None], columns] = 1
+    return result
+
+def iter_similarity_blocks(
+        a,
+        b,
+        matrix,
+        chunk_size : int = DEFAULT_CHUNK_SIZE,
+        dtype="float32"):
+    """
+    Generate (a_start, b_start, scores) for blocks of at most
+    chunk_size x chunk_size scores, so that the full M x N matrix
+    never needs to exist at once (e.g. to keep only the best matches).
+
+    Parameters
+    ----------
+    a, b
+        Lists of peptides or EncodedPeptides (in canonical amino acid
+        order), all of the same length
+
+    matrix
+        20x20 (or larger) array of amino acid substitution scores, e.g.
+        blosum62_matrix, pmbec_matrix or strand_vs_coil_array. Rows are
+        indexed by the letters of a, columns by the letters of b.
+
+    chunk_size
+        Number of peptides from each batch scored together
+
+    dtype
+        Type of the scores
+    """
+    a = as_canonical_encoding(a)
+    b = as_canonical_encoding(b)
+    length_a = _peptide_length(a)
+    length_b = _peptide_length(b)
+    if len(a) > 0 and len(b) > 0 and length_a != length_b:
+        raise ValueError(
+            "Can't compare peptides of length %d and %d" % (length_a, length_b))
+    matrix = _substitution_matrix(matrix, dtype)
+    n_letters = len(matrix)
+    for b_start in range(0, len(b), chunk_size):
+        b_one_hot = _one_hot(
+            b.indices[b_start:b_start + chunk_size], n_letters, dtype)
+        for a_start in range(0, len(a), chunk_size):
+            a_profile = _profile(a.indices[a_start:a_start + chunk_size], matrix)
+            yield a_start, b_start, a_profile @ b_one_hot.T
+
+def pairwise_similarity(
+        a,
+        b,
+        matrix,
+        chunk_size : int = DEFAULT_CHUNK_SIZE,
+        dtype="float32") -> np.ndarray:
+    """
+    Score every peptide of a against every peptide of b, returning an
+    M x N array. Intermediate arrays are bounded by chunk_size, see
+    iter_similarity_blocks for the parameters.
+    """
+    a = as_canonical_encoding(a)
+    b = as_canonical_encoding(b)
+    result = np.zeros((len(a), len(b)), dtype=dtype)
+    for a_start, b_start, block in iter_similarity_blocks(
+            a, b, matrix, chunk_size=chunk_size, dtype=dtype):
+        result[
+            a_start:a_start + block.shape[0],
+            b_start:b_start + block.shape[1]] = block
+    return result
+
+def paired_similarity(a, b, matrix, dtype="float32") -> np.ndarray:
+    """
+    Score a[i] against b[i] for each i of two batches of the same size.
+    """
+    a = as_canonical_encoding(a)
+    b = as_canonical_encoding(b)
+    if len(a) != len(b):
+        raise ValueError(
+            "Expected batches of the same size, got %d and %d" % (len(a), len(b)))
+    if len(a) > 0 and _peptide_length(a) != _peptide_length(b):
+        raise ValueError("Can't compare peptides of different lengths")
+    matrix = _substitution_matrix(matrix, dtype)
+    return matrix[a.indices, b.indices].sum(axis=1, dtype=dtype)
@@ -0,0 +1,448 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Index of peptide sequences (e.g. IEDB epitopes) answering "which indexed
+peptides are most similar to this one?" under a substitution matrix such as
+blosum62_matrix or pmbec_matrix.
+
+Peptides are grouped by length. A peptide scoring at least t against a query
+loses at most (best possible score - t) against the best letter at every
+position, so if the positions are split into m segments it loses at most
+1/m of that on at least one segment. Within a length the peptides are
+sorted once per segment by their letters at the segment's positions, which
+lays them out as a prefix tree per segment whose nodes are ranges of rows.
+Queries (many at once) descend each tree level by level, dropping every node
+which already lost more than its share, and only the peptides of the nodes
+left at the bottom are scored, so results are exact while most of the index
+is never visited. Top-k queries first search within a few mismatches of the
+best possible score to find a score which k peptides reach, and use that as
+their threshold.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+from .amino_acid_alphabet import canonical_amino_acid_letters
+from . import blosum
+from .encoded_peptides import encode_peptides
+
+N_LETTERS = len(canonical_amino_acid_letters)
+
+_canonical_letter_set = set(canonical_amino_acid_letters)
+
+# the first pass of a top-k query looks for peptides within this many average
+# mismatches of the best possible score, widening by half until k are found
+INITIAL_SLACK = 3.0
+
+# queries searched together, which bounds the memory of a search
+QUERY_BATCH_SIZE = 256
+
+# slack on pruning, so that losses summed in a different order than the
+# exact scores never drop a match with a score equal to the threshold
+_TOLERANCE = 1e-9
+
+def _concatenate_ranges(starts, ends):
+    """
+    Equivalent to np.concatenate([np.arange(s, e) for (s, e) in zip(starts, ends)])
+    """
+    lengths = ends - starts
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return np.arange(lengths.sum()) + offsets
+
+def _position_entropies(indices):
+    entropies = []
+    for column in indices.T:
+        counts = np.bincount(column, minlength=N_LETTERS)
+        p = counts[counts > 0] / len(column)
+        entropies.append(-(p * np.log(p)).sum())
+    return np.array(entropies)
+
+def _choose_segments(indices):
+    """
+    Split the positions of peptides of one length into segments, each long
+    enough to tell most peptides apart, with the most informative positions
+    spread across the segments.
+    """
+    n, length = indices.shape
+    segment_length = max(1, int(np.ceil(np.log(max(n, 2)) / np.log(N_LETTERS))))
+    n_segments = max(1, length // segment_length)
+    by_entropy = np.argsort(-_position_entropies(indices), kind="stable")
+    return [by_entropy[i::n_segments] for i in range(n_segments)]
+
+def _group_ranks(group_ids):
+    """
+    Position of every element within its run of equal (sorted) group ids.
+    """
+    return np.arange(len(group_ids)) - np.searchsorted(group_ids, group_ids)
+
+class _LengthGroup(object):
+    """
+    Sorted peptides of a single length, with their positions split into
+    segments. For each segment, orders[i] sorts the rows by their letters
+    at the segment's positions so that the rows sharing their first d of
+    those letters are a contiguous range: a node at depth d of a prefix tree.
+    """
+    def __init__(
+            self,
+            peptides,
+            indices,
+            segment_positions,
+            segment_offsets,
+            orders,
+            node_starts,
+            level_offsets):
+        self.peptides = peptides
+        self.indices = indices
+        # positions of segment i are segment_positions[
+        # segment_offsets[i]:segment_offsets[i + 1]], in tree order
+        self.segment_positions = segment_positions
+        self.segment_offsets = segment_offsets
+        # (n_segments x n_peptides) rows in the order of each segment's tree
+        self.orders = orders
+        # first (sorted) row of every node, level after level: the nodes
+        # below segment_positions[i] start at
+        # node_starts[level_offsets[i]:level_offsets[i + 1]]
+        self.node_starts = node_starts
+        self.level_offsets = level_offsets
+
+    @classmethod
+    def build(cls, peptides):
+        peptides = np.array(sorted(set(peptides)))
+        indices = encode_peptides(peptides).indices
+        segments = _choose_segments(indices)
+        orders = []
+        levels = []
+        for segment in segments:
+            order = np.lexsort(indices[:, segment[::-1]].T)
+            sorted_indices = indices[order]
+            new_node = np.zeros(len(peptides), dtype="bool")
+            new_node[0] = True
+            for position in segment:
+                column = sorted_indices[:, position]
+                new_node[1:] |= column[1:] != column[:-1]
+                levels.append(np.flatnonzero(new_node).astype("int32"))
+            orders.append(order.astype("int32"))
+        segment_offsets = np.zeros(len(segments) + 1, dtype="int64")
+        np.cumsum([len(segment) for segment in segments], out=segment_offsets[1:])
+        level_offsets = np.zeros(len(levels) + 1, dtype="int64")
+        np.cumsum([len(level) for level in levels], out=level_offsets[1:])
+        return cls(
+            peptides,
+            indices,
+            np.concatenate(segments),
+            segment_offsets,
+            np.array(orders),
+            np.concatenate(levels),
+            level_offsets)
+
+    def __len__(self):
+        return len(self.peptides)
+
+    def candidates(self, losses, max_losses):
+        """
+        Rows which might lose at most max_losses against the best letters.
+
+        Parameters
+        ----------
+        losses : np.ndarray
+            (n_queries x length x 20) score of the best letter at each
+            position minus the score of each letter
+
+        max_losses : np.ndarray
+            Largest total loss of a match, for each query
+
+        Returns the (distinct) query number and row of every candidate.
+        """
+        n_queries = len(losses)
+        n_segments = len(self.orders)
+        # a match loses at most its share of max_losses on some segment
+        budgets = max_losses / n_segments + _TOLERANCE
+        candidate_queries = []
+        candidate_rows = []
+        for i in range(n_segments):
+            queries = np.arange(n_queries)
+            starts = np.zeros(n_queries, dtype="int64")
+            ends = np.full(n_queries, len(self), dtype="int64")
+            prefix_losses = np.zeros(n_queries)
+            order = self.orders[i]
+            for level in range(self.segment_offsets[i], self.segment_offsets[i + 1]):
+                position = self.segment_positions[level]
+                level_starts = self.node_starts[
+                    self.level_offsets[level]:self.level_offsets[level + 1]]
+                first = np.searchsorted(level_starts, starts)
+                last = np.searchsorted(level_starts, ends)
+                nodes = _concatenate_ranges(first, last)
+                queries = np.repeat(queries, last - first)
+                starts = level_starts[nodes]
+                ends = np.append(level_starts[1:], len(self))[nodes]
+                prefix_losses = np.repeat(prefix_losses, last - first) + \
+                    losses[queries, position, self.indices[order[starts], position]]
+                keep = prefix_losses <= budgets[queries]
+                queries, starts, ends, prefix_losses = \
+                    queries[keep], starts[keep], ends[keep], prefix_losses[keep]
+            candidate_queries.append(np.repeat(queries, ends - starts))
+            candidate_rows.append(order[_concatenate_ranges(starts, ends)])
+        keys = np.unique(
+            np.concatenate(candidate_queries).astype("int64") * len(self) +
+            np.concatenate(candidate_rows))
+        return keys // len(self), keys % len(self)
+
+    def score_rows(self, query_scores, queries, rows):
+        length = self.indices.shape[1]
+        return query_scores[
+            queries[:, None], np.arange(length)[None, :], self.indices[rows]].sum(axis=1)
+
+    def _kth_best(self, query_scores, losses, thresholds, k):
+        """
+        A score which at least k peptides reach, for every query, or its
+        threshold if that's higher (or fewer than k peptides reach it).
+        """
+        best_scores = query_scores.max(axis=2).sum(axis=1)
+        worst_scores = query_scores.min(axis=2).sum(axis=1)
+        slack = INITIAL_SLACK * losses.mean(axis=(1, 2))
+        result = thresholds.copy()
+        pending = np.arange(len(query_scores))
+        while len(pending) > 0:
+            lowest = np.maximum(thresholds[pending], worst_scores[pending])
+            max_losses = np.minimum(
+                slack[pending], best_scores[pending] - thresholds[pending])
+            queries, rows = self.candidates(losses[pending], max_losses)
+            scores = self.score_rows(query_scores[pending], queries, rows)
+            order = np.lexsort((-scores, queries))
+            queries, scores = queries[order], scores[order]
+            kth = _group_ranks(queries) == k - 1
+            found = np.zeros(len(pending), dtype="bool")
+            found[queries[kth]] = True
+            result[pending[queries[kth]]] = np.maximum(
+                result[pending[queries[kth]]], scores[kth])
+            # nothing below the threshold (or the lowest possible score) is left
+            exhausted = best_scores[pending] - max_losses <= lowest
+            slack[pending] *= 1.5
+            pending = pending[~(found | exhausted)]
+        return result
+
+    def search(self, query_scores, k=None, threshold=None):
+        """
+        Matches of a batch of queries, given their (n_queries x length x 20)
+        scores of each query letter against each letter: arrays of the
+        query number, row and score of every match, grouped by query and
+        best first.
+        """
+        losses = query_scores.max(axis=2)[:, :, None] - query_scores
+        thresholds = np.full(
+            len(query_scores), -np.inf if threshold is None else threshold)
+        if k is not None:
+            thresholds = self._kth_best(query_scores, losses, thresholds, k)
+        best_scores = query_scores.max(axis=2).sum(axis=1)
+        queries, rows = self.candidates(losses, best_scores - thresholds)
+        scores = self.score_rows(query_scores, queries, rows)
+        keep = scores >= thresholds[queries]
+        queries, rows, scores = queries[keep], rows[keep], scores[keep]
+        # best score first, ties broken by sequence
+        order = np.lexsort((rows, -scores, queries))
+        if k is not None:
+            order = order[_group_ranks(queries[order]) < k]
+        return queries[order], rows[order], scores[order]
+
+class SimilarityIndex(object):
+    """
+    Exact top-k and threshold similarity search over a set of peptides.
+    Only peptides made of the 20 canonical amino acids are indexed.
+
+    Parameters
+    ----------
+    peptides
+        Sequences to index, duplicates are ignored
+
+    matrix
+        Default substitution matrix used to score queries (default:
+        blosum62_matrix)
+    """
+    def __init__(self, peptides=(), matrix=None):
+        self.matrix = blosum.blosum62_matrix if matrix is None else matrix
+        self.groups = {}
+        self.add(peptides)
+
+    @classmethod
+    def from_iedb(cls, source="tcell", matrix=None, **load_kwargs):
+        """
+        Index the epitopes of pepdata.iedb.tcell or pepdata.iedb.mhc,
+        with load_kwargs passed to their load_dataframe function.
+        """
+        from .iedb.columns import get_epitope_name
+        from .iedb.common import _source_module
+        module = _source_module(source)
+        df = module.load_dataframe(**load_kwargs)
+        return cls(get_epitope_name(df).dropna().unique(), matrix=matrix)
+
+    def __len__(self):
+        return sum(len(group) for group in self.groups.values())
+
+    def __contains__(self, peptide):
+        group = self.groups.get(len(peptide))
+        if group is None:
+            return False
+        i = np.searchsorted(group.peptides, peptide)
+        return i < len(group) and group.peptides[i] == peptide
+
+    @property
+    def peptides(self):
+        return set().union(*(group.peptides.tolist() for group in self.groups.values()))
+
+    def _by_length(self, peptides):
+        by_length = {}
+        for p in peptides:
+            p = str(p)
+            if len(p) > 0 and set(p) <= _canonical_letter_set:
+                by_length.setdefault(len(p), set()).add(p)
+        return by_length
+
+    def _rebuild(self, length, peptides):
+        if peptides:
+            self.groups[length] = _LengthGroup.build(peptides)
+        else:
+            self.groups.pop(length, None)
+
+    def add(self, peptides):
+        """
+        Add peptides to the index, rebuilding only the lengths which change.
+        """
+        for length, new in self._by_length(peptides).items():
+            current = set(self.groups[length].peptides.tolist()) \
+                if length in self.groups else set()
+            if not new <= current:
+                self._rebuild(length, current | new)
+
+    def remove(self, peptides):
+        """
+        Remove peptides from the index, rebuilding only the lengths which change.
+        """
+        for length, removed in self._by_length(peptides).items():
+            if length not in self.groups:
+                continue
+            current = set(self.groups[length].peptides.tolist())
+            if current & removed:
+                self._rebuild(length, current - removed)
+
+    def update(self, peptides):
+        """
+        Make the index contain exactly the given peptides (e.g. the epitopes
+        of a newer IEDB export), only rebuilding lengths which changed.
+        """
+        target = self._by_length(peptides)
+        for length in set(target) | set(self.groups):
+            current = set(self.groups[length].peptides.tolist()) \
+                if length in self.groups else set()
+            if current != target.get(length, set()):
+                self._rebuild(length, target.get(length, set()))
+
+    def _query_scores(self, matrix):
+        matrix = self.matrix if matrix is None else matrix
+        return np.asarray(matrix, dtype="float64")[:N_LETTERS, :N_LETTERS]
+
+    def query(self, peptide, k=10, threshold=None, matrix=None):
+        """
+        Indexed peptides of the same length as the query which score best
+        against it, as a list of (peptide, score) pairs, best first.
+
+        Parameters
+        ----------
+        peptide : str
+
+        k : int, optional
+            Maximum number of matches, or None for every match above threshold
+
+        threshold : float, optional
+            Minimum score of matches
+
+        matrix : array, optional
+            Substitution matrix, defaults to the matrix of the index
+        """
+        if k is None and threshold is None:
+            raise ValueError("Expected at least one of k or threshold")
+        group = self.groups.get(len(peptide))
+        if group is None:
+            return []
+        query_scores = self._query_scores(matrix)[encode_peptides([peptide]).indices]
+        _, rows, scores = group.search(query_scores, k=k, threshold=threshold)
+        return list(zip(group.peptides[rows].tolist(), scores.tolist()))
+
+    def search(self, peptides, k=10, threshold=None, matrix=None):
+        """
+        Query many peptides, see query for the parameters. Queries of the
+        same length are searched together, in batches of QUERY_BATCH_SIZE.
+
+        Returns DataFrame with columns "query", "match" and "score", with
+        the matches of each query best first and queries in the given order
+        """
+        if k is None and threshold is None:
+            raise ValueError("Expected at least one of k or threshold")
+        peptides = np.array([str(p) for p in peptides], dtype=object)
+        lengths = np.array([len(p) for p in peptides], dtype="int64")
+        matrix = self._query_scores(matrix)
+        query_numbers = [np.zeros(0, dtype="int64")]
+        matches = [np.zeros(0, dtype=object)]
+        scores = [np.zeros(0)]
+        for length, group in self.groups.items():
+            numbers = np.flatnonzero(lengths == length)
+            for batch_start in range(0, len(numbers), QUERY_BATCH_SIZE):
+                batch = numbers[batch_start:batch_start + QUERY_BATCH_SIZE]
+                query_scores = matrix[encode_peptides(peptides[batch].tolist()).indices]
+                batch_queries, rows, batch_scores = group.search(
+                    query_scores, k=k, threshold=threshold)
+                query_numbers.append(batch[batch_queries])
+                matches.append(group.peptides[rows])
+                scores.append(batch_scores)
+        query_numbers = np.concatenate(query_numbers)
+        order = np.argsort(query_numbers, kind="stable")
+        return pd.DataFrame({
+            "query": peptides[query_numbers[order]],
+            "match": np.concatenate(matches)[order].astype(object),
+            "score": np.concatenate(scores)[order],
+        })
+
+    def save(self, path):
+        """
+        Write the index to a .npz file, which load reads without rebuilding.
+        """
+        arrays = {"matrix": np.asarray(self.matrix)}
+        for length, group in self.groups.items():
+            arrays["%d/peptides" % length] = group.peptides
+            arrays["%d/indices" % length] = group.indices
+            arrays["%d/segment_positions" % length] = group.segment_positions
+            arrays["%d/segment_offsets" % length] = group.segment_offsets
+            arrays["%d/orders" % length] = group.orders
+            arrays["%d/node_starts" % length] = group.node_starts
+            arrays["%d/level_offsets" % length] = group.level_offsets
+        from .iedb.common import atomic_write
+        with atomic_write(path, suffix=".npz") as tmp_path:
+            np.savez(tmp_path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        with np.load(path, allow_pickle=False) as data:
+            index.matrix = data["matrix"]
+            lengths = {int(name.split("/")[0]) for name in data.files if "/" in name}
+            for length in lengths:
+                index.groups[length] = _LengthGroup(
+                    peptides=data["%d/peptides" % length],
+                    indices=data["%d/indices" % length],
+                    segment_positions=data["%d/segment_positions" % length],
+                    segment_offsets=data["%d/segment_offsets" % length],
+                    orders=data["%d/orders" % length],
+                    node_starts=data["%d/node_starts" % length],
+                    level_offsets=data["%d/level_offsets" % length])
+        return index
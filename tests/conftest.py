@@ -18,9 +18,134 @@ def patch_iedb_paths(monkeypatch):
         lambda auto_download=True: os.path.join(FIXTURES_DIR, "mhc_test_fixture.csv"),
     )
     # Clear memoize caches so each test gets fresh data from fixtures
-    from pepdata.iedb.tcell import load_dataframe as tcell_load
-    from pepdata.iedb.mhc import load_dataframe as mhc_load
-    if hasattr(tcell_load, '__wrapped__'):
-        pass  # functools.wraps doesn't expose the cache
-    # The memoize decorator stores in a closure dict — simplest to just
-    # not worry about it since tests use nrows= which varies the cache key
+    from pepdata.iedb import mhc, tcell
+    for module in [mhc, tcell]:
+        module.load_dataframe.cache_clear()
+        module._load_base_dataframe.cache_clear()
+
+
+# Small stand-ins for the IEDB exports, using the same two-row header layout.
+# Unlike the bundled fixtures these are written into a temporary directory
+# so tests can check files derived from them (e.g. the Parquet table cache).
+EXPORT_HEADER = [
+    ("Reference", "IEDB IRI"),
+    ("Epitope", "Epitope IRI"),
+    ("Epitope", "Object Type"),
+    ("Epitope", "Name"),
+    ("Epitope", "Modified Residue(s)"),
+    ("Epitope", "Source Organism"),
+    ("Host", "Name"),
+    ("Assay", "Method"),
+    ("Assay", "Response measured"),
+    ("Assay", "Units"),
+    ("Assay", "Qualitative Measurement"),
+    ("Assay", "Number of Subjects Tested"),
+    ("Assay", "Number of Subjects Responded"),
+    ("MHC Restriction", "Name"),
+    ("MHC Restriction", "Class"),
+]
+
+EXPORT_ALLELES = [
+    ("HLA-A*02:01", "I"),
+    ("HLA-A2", "I"),
+    ("HLA-A*24:02", "I"),
+    ("HLA-A24", "I"),
+    ("HLA-B*07:02", "I"),
+    ("HLA-DRB1*04:01", "II"),
+    ("H-2-Kb", "I"),
+    ("HLA class I", "I"),
+]
+
+EXPORT_PEPTIDES = [
+    "SIINFEKL",
+    "GILGFVFTL",
+    "NLVPMVATV",
+    "QYDPVAALF",
+    "RPHERNGFTVL",
+    "PKYVKQNTLKLAT",
+    "YLLPAIVHI",
+    "ELAGIGILTV",
+    "LLDFVRFMGV",
+    "KVAELVHFL",
+    "FLPSDFFPSV",
+    "AVFDRKSDAK",
+    "aymdtvsei",
+    "SLYNTVXTL",
+    "",
+    "KLVALGINAV + OX(M1)",
+]
+
+def make_export_rows(n_rows, seed=0):
+    rows = []
+    for i in range(n_rows):
+        j = i + seed
+        allele, mhc_class = EXPORT_ALLELES[j % len(EXPORT_ALLELES)]
+        peptide = EXPORT_PEPTIDES[(j * 7) % len(EXPORT_PEPTIDES)]
+        modified = "M1" if "+" in peptide else ""
+        positive = (j % 3) != 0
+        rows.append([
+            "http://www.iedb.org/reference/%d" % (1000 + j),
+            "http://www.iedb.org/epitope/%d" % (j % len(EXPORT_PEPTIDES)),
+            "Linear peptide",
+            peptide,
+            modified,
+            "Homo sapiens" if j % 4 else "Mus musculus",
+            "Homo sapiens (human)" if j % 5 else "Mus musculus (mouse)",
+            ["ELISPOT", "ICS", "51 chromium", "cellular MHC/mass spectrometry"][j % 4],
+            "IFNg release",
+            "nM" if j % 2 else "",
+            "Positive" if positive else "Negative",
+            str(1 + j % 4),
+            str((1 + j % 4) if positive else 0),
+            allele,
+            mhc_class,
+        ])
+    return rows
+
+def write_export(path, rows):
+    import csv
+    with open(path, "w", newline="", encoding="latin-1") as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_ALL)
+        writer.writerow([group for (group, _) in EXPORT_HEADER])
+        writer.writerow([col for (_, col) in EXPORT_HEADER])
+        writer.writerows(rows)
+    return str(path)
+
+
+@pytest.fixture
+def iedb_exports(tmp_path, monkeypatch):
+    """
+    Write small synthetic T-cell and MHC ligand exports into a temporary
+    directory and point the IEDB loaders at them.
+    """
+    tcell_path = write_export(tmp_path / "tcell_full.csv", make_export_rows(120))
+    mhc_path = write_export(tmp_path / "mhc_ligand_full.csv", make_export_rows(90, seed=3))
+    monkeypatch.setattr(
+        "pepdata.iedb.tcell.local_path",
+        lambda auto_download=True: tcell_path)
+    monkeypatch.setattr(
+        "pepdata.iedb.mhc.local_path",
+        lambda auto_download=True: mhc_path)
+    return {"tcell": tcell_path, "mhc": mhc_path}
+
+
+@pytest.fixture
+def allele_list(monkeypatch):
+    """
+    Replace the IEDB allele list (which has to be downloaded) with a
+    handful of alleles covering the synthetic exports.
+    """
+    from pepdata.iedb import alleles
+    allele_objects = [
+        alleles.Allele("HLA-A*02:01", "I", "A", "human", {"HLA-A*0201"}),
+        alleles.Allele("HLA-A2", "I", "A", "human", set()),
+        alleles.Allele("HLA-A*24:02", "I", "A", "human", set()),
+        alleles.Allele("HLA-A24", "I", "A", "human", set()),
+        alleles.Allele("HLA-B*07:02", "I", "B", "human", {"HLA-B7"}),
+        alleles.Allele("HLA-DRB1*04:01", "II", "DR", "human", set()),
+        alleles.Allele("H-2-Kb", "I", "K", "mouse", set()),
+        alleles.Allele("H-2-IAb", "II", "IA", "mouse", set()),
+    ]
+    registry = alleles.AlleleRegistry(allele_objects)
+    monkeypatch.setattr(alleles, "load_allele_registry", lambda: registry)
+    return registry
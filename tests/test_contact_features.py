@@ -0,0 +1,42 @@
+import numpy as np
+
+from pepdata.contact_features import ContactEnergyFeaturizer
+from pepdata.residue_contact_energies import (
+    helix_vs_coil_dict,
+    strand_vs_coil_dict,
+    strand_vs_coil_array,
+)
+
+peptides = ["SIINFEKL", "GILGFVFTL", "YL", "A"]
+
+def brute_force(peptide, d):
+    adjacent = sum(d[x][y] for (x, y) in zip(peptide, peptide[1:]))
+    all_pairs = sum(
+        d[peptide[i]][peptide[j]]
+        for i in range(len(peptide))
+        for j in range(i + 1, len(peptide)))
+    return adjacent, all_pairs
+
+def test_contact_energy_featurizer_matches_dicts():
+    featurizer = ContactEnergyFeaturizer(["strand_vs_coil", "helix_vs_coil"])
+    assert featurizer.feature_names == [
+        "strand_vs_coil_adjacent", "strand_vs_coil_all_pairs",
+        "helix_vs_coil_adjacent", "helix_vs_coil_all_pairs",
+    ]
+    X = featurizer.transform(peptides)
+    assert X.shape == (4, 4)
+    for i, p in enumerate(peptides):
+        expected = brute_force(p, strand_vs_coil_dict) + brute_force(p, helix_vs_coil_dict)
+        assert np.allclose(X[i], expected, atol=1e-4)
+
+def test_contact_energy_featurizer_chunked():
+    featurizer = ContactEnergyFeaturizer()
+    chunked = ContactEnergyFeaturizer(chunk_size=3)
+    assert np.allclose(featurizer.transform(peptides), chunked.transform(peptides))
+
+def test_contact_energy_pair_tensor():
+    tensor = ContactEnergyFeaturizer().pair_tensor(peptides, "strand_vs_coil")
+    assert tensor.shape == (4, 9, 9)
+    assert np.isclose(tensor[0, 1, 4], strand_vs_coil_dict["I"]["F"])
+    assert np.isnan(tensor[2, 0, 2])
+    assert np.isclose(tensor[3, 0, 0], strand_vs_coil_array[0, 0])
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from pepdata import encode_peptides
+from pepdata.amino_acid_alphabet import (
+    extended_amino_acid_letters,
+    peptide_to_indices,
+)
+from pepdata.encoded_peptides import PADDING_INDEX
+from pepdata.reduced_alphabet import gbmr4
+
+def test_encode_peptides_matches_peptide_to_indices():
+    peptides = ["SIINFEKL", "YLLPAIV", "ACDEFGHIKLMNPQRSTVWY"]
+    encoded = encode_peptides(peptides)
+    assert encoded.indices.dtype == np.uint8
+    assert encoded.indices.shape == (3, 20)
+    assert list(encoded.lengths) == [8, 7, 20]
+    for i, p in enumerate(peptides):
+        assert list(encoded.indices[i, :len(p)]) == peptide_to_indices(p)
+        assert (encoded.indices[i, len(p):] == PADDING_INDEX).all()
+    assert encoded.decode() == peptides
+
+def test_encode_peptides_invalid_letter():
+    with pytest.raises(ValueError, match="SIIXFEKL"):
+        encode_peptides(["YLLPAIV", "SIIXFEKL"])
+
+def test_encode_peptides_extended_and_unknown_letter():
+    encoded = encode_peptides(["SIIXFEKL"], alphabet=extended_amino_acid_letters)
+    assert encoded.decode() == ["SIIXFEKL"]
+    encoded = encode_peptides(
+        ["SIIxFEK#"], alphabet=extended_amino_acid_letters, unknown_letter="X")
+    assert encoded.decode() == ["SIIXFEKX"]
+
+def test_encode_peptides_reduced_alphabet():
+    encoded = encode_peptides(["SIINFEKL", "GP"], reduced_alphabet=gbmr4)
+    assert encoded.alphabet == ["A", "G", "P", "Y"]
+    assert encoded.decode() == [
+        "".join(gbmr4[c] for c in "SIINFEKL"), "GP"]
+
+def test_encoded_peptides_selection():
+    encoded = encode_peptides(["SIINFEKL", "YLLPAIV", "GILGFVFTL", "NLVPMVATV"])
+    nine, rows = encoded.with_length(9)
+    assert list(rows) == [2, 3]
+    assert nine.indices.shape == (2, 9)
+    assert nine.decode() == ["GILGFVFTL", "NLVPMVATV"]
+    assert encoded[1].decode() == ["YLLPAIV"]
+    assert encoded[encoded.lengths < 9].decode() == ["SIINFEKL", "YLLPAIV"]
+
+def test_encode_peptides_empty_and_max_length():
+    assert encode_peptides([]).indices.shape == (0, 0)
+    assert encode_peptides(["SIINFEKL"], max_length=11).max_length == 11
+    with pytest.raises(ValueError):
+        encode_peptides(["SIINFEKL"], max_length=5)
@@ -0,0 +1,101 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from pepdata.iedb import aggregate, tcell
+from pepdata.iedb.aggregate import EpitopeAlleleTable, load_epitope_allele_table
+
+from conftest import make_export_rows, write_export
+
+def assay_dataframe():
+    return pd.DataFrame({
+        ("Epitope", "Name"): [
+            "SIINFEKL", "SIINFEKL", "SIINFEKL", "GILGFVFTL", None, "GILGFVFTL"],
+        ("MHC Restriction", "Name"): [
+            "H-2-Kb", "H-2-Kb", "HLA-A*02:01", "HLA-A*02:01", "H-2-Kb", None],
+        ("Assay", "Method"): ["ELISPOT", "ICS", "ICS", None, "ICS", "ELISPOT"],
+        ("Assay", "Qualitative Measurement"): [
+            "Positive-High", "Negative", "Positive", "Positive-Low", "Positive", "Negative"],
+        ("Assay", "Number of Subjects Tested"): [3, 2, None, 1, 5, "unknown"],
+        ("Assay", "Number of Subjects Responded"): [2, 0, None, 1, 5, 0],
+    })
+
+def test_epitope_allele_table_aggregates():
+    df = EpitopeAlleleTable.from_dataframe(assay_dataframe()).to_dataframe()
+    rows = {
+        (row.epitope, None if pd.isnull(row.allele) else row.allele): row
+        for row in df.itertuples()
+    }
+    assert len(rows) == 4
+    row = rows[("SIINFEKL", "H-2-Kb")]
+    assert (row.n_assays, row.n_positive, row.n_negative) == (2, 1, 1)
+    assert (row.n_tested, row.n_responded) == (5, 2)
+    assert row.assay_methods == frozenset(["ELISPOT", "ICS"])
+    row = rows[("GILGFVFTL", "HLA-A*02:01")]
+    assert (row.n_assays, row.n_positive, row.n_tested) == (1, 1, 1)
+    assert row.assay_methods == frozenset()
+    row = rows[("GILGFVFTL", None)]
+    assert (row.n_negative, row.n_tested) == (1, 0)
+    assert df["n_assays"].sum() == 5
+
+def test_epitope_allele_table_append_keeps_codes():
+    df = assay_dataframe()
+    first = EpitopeAlleleTable.from_dataframe(df.iloc[:2])
+    table = first.append(df.iloc[2:])
+    assert list(table.epitopes[:len(first.epitopes)]) == list(first.epitopes)
+    assert list(table.alleles[:len(first.alleles)]) == list(first.alleles)
+    expected = EpitopeAlleleTable.from_dataframe(df).to_dataframe()
+    pd.testing.assert_frame_equal(
+        table.to_dataframe().astype({"epitope": str, "allele": object}),
+        expected.astype({"epitope": str, "allele": object}))
+    assert table.n_source_rows == len(df)
+    assert table.extends(aggregate.row_hashes(df))
+    assert not table.extends(aggregate.row_hashes(df.iloc[::-1]))
+
+def test_epitope_allele_table_save_load(tmp_path):
+    table = EpitopeAlleleTable.from_dataframe(assay_dataframe())
+    path = str(tmp_path / "table.npz")
+    table.save(path)
+    loaded = EpitopeAlleleTable.load(path)
+    pd.testing.assert_frame_equal(loaded.to_dataframe(), table.to_dataframe())
+    assert loaded.source_checksum == table.source_checksum
+
+def test_load_epitope_allele_table_appends_new_rows(iedb_exports, allele_list, monkeypatch):
+    table = load_epitope_allele_table("tcell", mhc_class=1)
+    path = aggregate.cached_table_path(iedb_exports["tcell"], {"mhc_class": 1})
+    assert os.path.exists(path)
+
+    appended = []
+    original_append = EpitopeAlleleTable.append
+
+    def append(self, df, hashes=None):
+        appended.append(len(df))
+        return original_append(self, df, hashes=hashes)
+
+    monkeypatch.setattr(EpitopeAlleleTable, "append", append)
+    with monkeypatch.context() as m:
+        # an unchanged export isn't loaded at all
+        m.setattr(tcell, "load_dataframe", None)
+        cached = load_epitope_allele_table("tcell", mhc_class=1)
+    assert appended == []
+    assert cached.source_fingerprint == table.source_fingerprint is not None
+    assert np.array_equal(cached.n_assays, table.n_assays)
+
+    write_export(iedb_exports["tcell"], make_export_rows(150))
+    updated = load_epitope_allele_table("tcell", mhc_class=1)
+    assert len(appended) == 1 and 0 < appended[0] < updated.n_source_rows
+    expected = EpitopeAlleleTable.from_dataframe(tcell.load_dataframe(mhc_class=1))
+    assert updated.n_source_rows == expected.n_source_rows
+    assert updated.n_assays.sum() == expected.n_assays.sum()
+    pd.testing.assert_frame_equal(
+        updated.to_dataframe().sort_values(["epitope", "allele"]).reset_index(drop=True)
+            .astype({"epitope": str, "allele": str}),
+        expected.to_dataframe().sort_values(["epitope", "allele"]).reset_index(drop=True)
+            .astype({"epitope": str, "allele": str}))
+
+    # changing earlier rows rebuilds the table
+    appended.clear()
+    write_export(iedb_exports["tcell"], make_export_rows(150, seed=1))
+    rebuilt = load_epitope_allele_table("tcell", mhc_class=1)
+    assert appended == [rebuilt.n_source_rows]
@@ -11,6 +11,8 @@
 # limitations under the License.
 
 
+import pandas as pd
+import pytest
 
 from pepdata import iedb
 
@@ -38,3 +40,176 @@ def test_iedb_mouse_class2_allele():
     allele = allele_dict["H-2-IAq"]
     assert allele.mhc_class == "II"
     assert allele.locus == "IA"
+
+def test_classify_alleles_once_per_distinct_name(allele_list):
+    names = pd.Series(
+        ["HLA-A*02:01", "HLA-DRB1*04:01", None, "HLA-Z*01", "H-2-Kb"] * 3)
+    fallback = pd.Series(["I", "II", None, "I", "I"] * 3)
+    classes = iedb.alleles.classify_alleles(names).fillna("?")
+    assert classes.tolist()[:5] == ["I", "II", "?", "?", "I"]
+    classes = iedb.alleles.classify_alleles(names, fallback).fillna("?")
+    assert classes.tolist()[:5] == ["I", "II", "?", "I", "I"]
+    mask = iedb.alleles.mhc_class_mask(names, 2, fallback)
+    assert mask.tolist()[:5] == [False, True, False, False, False]
+
+def test_classify_alleles_keeps_class_column_of_unlisted_names(allele_list):
+    # resolve_alleles would match these, but the export's class wins
+    names = pd.Series(["hla-a*0201", "A*02:01", "HLA class I"])
+    fallback = pd.Series(["II", "II", "II"])
+    assert iedb.alleles.classify_alleles(names, fallback).tolist() == ["II"] * 3
+    assert iedb.alleles.resolve_alleles(names)["mhc_class"].tolist() == ["I"] * 3
+
+def test_normalize_mhc_class():
+    assert iedb.alleles.normalize_mhc_class(1) == "I"
+    assert iedb.alleles.normalize_mhc_class("II") == "II"
+    with pytest.raises(ValueError):
+        iedb.alleles.normalize_mhc_class(3)
+
+ALLELE_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<MhcAlleleNames>
+  <MhcAlleleName>
+    <DisplayedRestriction>HLA-A*02:01</DisplayedRestriction>
+    <Synonyms>HLA-A*0201, HLA-A2.1</Synonyms>
+    <Organsim>human</Organsim>
+    <Class>I</Class>
+    <Locus>A</Locus>
+  </MhcAlleleName>
+  <MhcAlleleName>
+    <DisplayedRestriction>HLA-A*02:06</DisplayedRestriction>
+    <Organsim>human</Organsim>
+    <Class>I</Class>
+    <Locus>A</Locus>
+  </MhcAlleleName>
+  <MhcAlleleName>
+    <DisplayedRestriction>HLA-A*24:02</DisplayedRestriction>
+    <Organsim>human</Organsim>
+    <Class>I</Class>
+    <Locus>A</Locus>
+  </MhcAlleleName>
+  <MhcAlleleName>
+    <DisplayedRestriction>HLA-DRA*01:01/DRB1*04:04</DisplayedRestriction>
+    <Organsim>human</Organsim>
+    <Class>II</Class>
+    <Locus>DR</Locus>
+  </MhcAlleleName>
+  <MhcAlleleName>
+    <DisplayedRestriction>H-2-IAq</DisplayedRestriction>
+    <Organsim>mouse</Organsim>
+    <Class>II</Class>
+    <Locus>IA</Locus>
+  </MhcAlleleName>
+  <MhcAlleleName>
+    <DisplayedRestriction>H-2-Ds</DisplayedRestriction>
+    <Organsim>mouse</Organsim>
+    <Class>I</Class>
+    <Locus>D</Locus>
+  </MhcAlleleName>
+  <MhcAlleleName>
+    <DisplayedRestriction>No class given</DisplayedRestriction>
+  </MhcAlleleName>
+</MhcAlleleNames>
+"""
+
+@pytest.fixture
+def allele_xml(tmp_path, monkeypatch):
+    path = tmp_path / "MhcAlleleNames.xml"
+    path.write_text(ALLELE_XML)
+    monkeypatch.setattr(
+        iedb.alleles, "local_path", lambda force_download=False: str(path))
+    iedb.alleles.load_allele_registry.cache_clear()
+    yield str(path)
+    iedb.alleles.load_allele_registry.cache_clear()
+
+def test_parse_alleles(allele_xml):
+    alleles = iedb.alleles.parse_alleles(allele_xml)
+    assert [a.name for a in alleles][:2] == ["HLA-A*02:01", "HLA-A*02:06"]
+    assert len(alleles) == 6
+    assert alleles[0].synonyms == {"HLA-A*0201", "HLA-A2.1"}
+    assert alleles[0].organism == "human"
+
+def test_allele_registry_compiled_once(allele_xml, monkeypatch):
+    registry = iedb.alleles.load_allele_registry()
+    assert registry.get("HLA-A*0201").name == "HLA-A*02:01"
+    assert iedb.alleles.load_alleles_dict()["HLA-A*0201"].name == "HLA-A*02:01"
+    # a fresh process reads the pickled registry instead of the XML
+    iedb.alleles.load_allele_registry.cache_clear()
+
+    def fail(path):
+        raise AssertionError("XML should not be parsed again")
+
+    monkeypatch.setattr(iedb.alleles, "parse_alleles", fail)
+    assert len(iedb.alleles.load_allele_registry()) == len(registry)
+
+def test_allele_registry_rebuilt_for_other_format(allele_xml, monkeypatch):
+    registry = iedb.alleles.load_allele_registry()
+    iedb.alleles.load_allele_registry.cache_clear()
+    monkeypatch.setattr(
+        iedb.alleles, "REGISTRY_FORMAT", iedb.alleles.REGISTRY_FORMAT + 1)
+    parsed = []
+    parse_alleles = iedb.alleles.parse_alleles
+    monkeypatch.setattr(
+        iedb.alleles, "parse_alleles",
+        lambda path: parsed.append(path) or parse_alleles(path))
+    assert len(iedb.alleles.load_allele_registry()) == len(registry)
+    assert parsed == [allele_xml]
+
+def test_allele_registry_indexes(allele_xml):
+    registry = iedb.alleles.load_allele_registry()
+    names = lambda alleles: sorted(a.name for a in alleles)
+    assert names(registry.with_prefix("HLA-A*02")) == ["HLA-A*02:01", "HLA-A*02:06"]
+    assert names(registry.with_prefix("HLA-A*0")) == \
+        ["HLA-A*02:01", "HLA-A*02:06"]
+    assert len(registry.with_prefix("HLA")) == 4
+    assert names(registry.with_locus("A", organism="human")) == \
+        ["HLA-A*02:01", "HLA-A*02:06", "HLA-A*24:02"]
+    assert names(registry.with_class(2, organism="mouse")) == ["H-2-IAq"]
+    assert len(registry.with_class("I")) == 4
+
+def test_normalize_allele_name():
+    normalize = iedb.alleles.normalize_allele_name
+    assert normalize("HLA-A*02:01") == normalize("hla-a*0201")
+    assert normalize("HLA A*02:01") == normalize("HLA-A02:01")
+    assert normalize("HLA-A2") != normalize("HLA-A*02")
+
+def test_resolve_alleles(allele_list):
+    names = pd.Series(
+        [
+            "HLA-A*02:01",
+            "hla-a*0201",
+            "A*02:01",
+            "HLA-B7",
+            "HLA class I",
+            "Class II,allele undetermined",
+            None,
+            "unknown",
+        ],
+        index=list("abcdefgh"))
+    resolved = iedb.alleles.resolve_alleles(names)
+    assert list(resolved.index) == list("abcdefgh")
+    assert list(resolved.columns) == ["name", "mhc_class", "locus", "organism"]
+    assert resolved["name"].fillna("?").tolist() == [
+        "HLA-A*02:01", "HLA-A*02:01", "HLA-A*02:01", "HLA-B*07:02",
+        "?", "?", "?", "?"]
+    assert resolved["mhc_class"].fillna("?").tolist() == \
+        ["I", "I", "I", "I", "I", "II", "?", "?"]
+    assert resolved["locus"].fillna("?").tolist()[:4] == ["A", "A", "A", "B"]
+
+def test_resolve_alleles_cached_across_calls(allele_list, monkeypatch):
+    iedb.alleles.resolve_alleles(["HLA-A*0201"])
+    calls = []
+    resolve_one = iedb.alleles._resolve_allele
+
+    def counting_resolve(registry, name):
+        calls.append(name)
+        return resolve_one(registry, name)
+
+    monkeypatch.setattr(iedb.alleles, "_resolve_allele", counting_resolve)
+    resolved = iedb.alleles.resolve_alleles(["HLA-A*0201", "H-2-Kb"] * 1000)
+    assert calls == ["H-2-Kb"]
+    assert resolved["name"].tolist()[:2] == ["HLA-A*02:01", "H-2-Kb"]
+
+def test_resolve_alleles_cache_is_bounded(allele_list, monkeypatch):
+    monkeypatch.setattr(iedb.alleles, "RESOLUTION_CACHE_SIZE", 2)
+    iedb.alleles.resolve_alleles(["HLA-A*0201", "H-2-Kb", "HLA-B7"])
+    resolved = iedb.alleles._resolution_cache["resolved"]
+    assert list(resolved) == ["H-2-Kb", "HLA-B7"]
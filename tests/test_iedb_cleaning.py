@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pepdata.iedb import columnar, mhc, tcell
+from pepdata.iedb.cleaning import clean_dataframe, clean_epitopes
+
+EPITOPES = [
+    "SIINFEKL",
+    "gilgfvftl",
+    "KLVALGINAV + OX(M1)",
+    "NLVPMVATV+",
+    None,
+    "",
+    "SLYNTVXTL",
+    "xyz",
+]
+
+def test_clean_epitopes_steps():
+    cleaned = clean_epitopes(pd.Series(EPITOPES, dtype=object))
+    assert cleaned.sequences.tolist()[:4] == [
+        "SIINFEKL", "GILGFVFTL", "KLVALGINAV", "NLVPMVATV"]
+    assert np.isnan(cleaned.sequences[4])
+    assert cleaned.sequences.tolist()[5:] == ["", "SLYNTVXTL", "XYZ"]
+    assert cleaned.lengths.tolist() == [8, 9, 10, 9, 0, 0, 9, 3]
+    assert cleaned.null.tolist() == [False] * 4 + [True] + [False] * 3
+    assert np.flatnonzero(cleaned.lowercase).tolist() == [1, 7]
+    assert np.flatnonzero(cleaned.modified).tolist() == [2, 3]
+    assert np.flatnonzero(cleaned.nonstandard).tolist() == [5, 6, 7]
+    assert np.flatnonzero(cleaned.valid).tolist() == [0, 1, 2, 3]
+    assert cleaned.stats._asdict() == {
+        "n_rows": 8,
+        "n_null": 1,
+        "n_lowercase": 2,
+        "n_modified": 2,
+        "n_empty": 1,
+        "n_nonstandard": 3,
+        "n_valid": 4,
+    }
+
+def test_clean_epitopes_string_and_categorical_inputs_agree():
+    expected = clean_epitopes(pd.Series(EPITOPES, dtype=object))
+    for dtype in ["str", "category"]:
+        cleaned = clean_epitopes(pd.Series(EPITOPES, dtype=dtype))
+        assert cleaned.sequences.astype(object).fillna("?").tolist() == \
+            expected.sequences.fillna("?").tolist()
+        assert cleaned.lengths.tolist() == expected.lengths.tolist()
+        assert cleaned.nonstandard.tolist() == expected.nonstandard.tolist()
+        assert cleaned.stats == expected.stats
+    categorical = clean_epitopes(pd.Series(
+        ["siinfekl", "SIINFEKL", "SIINFEKL + OX(M1)"], dtype="category"))
+    assert categorical.sequences.cat.categories.tolist() == ["SIINFEKL"]
+
+def test_clean_epitopes_modifications_column():
+    cleaned = clean_epitopes(
+        pd.Series(["SIINFEKL", "GILGFVFTL"]),
+        modifications=pd.Series([None, "M1"]))
+    assert cleaned.modified.tolist() == [False, True]
+    assert cleaned.sequences.tolist() == ["SIINFEKL", "GILGFVFTL"]
+
+def test_clean_dataframe_records_stats():
+    df = pd.DataFrame({("Epitope", "Name"): ["aymdtvsei", "SIINFEKL"]})
+    cleaned = clean_dataframe(df)
+    assert df[("Epitope", "Name")].tolist() == ["AYMDTVSEI", "SIINFEKL"]
+    assert df.attrs["epitope_cleaning"] == cleaned.stats._asdict()
+    assert clean_dataframe(pd.DataFrame({("Assay", "Method"): ["ICS"]})) is None
+
+def test_loaders_clean_epitopes(iedb_exports):
+    for module in [tcell, mhc]:
+        epitopes = set(module.load_dataframe(
+            only_standard_amino_acids=False)[("Epitope", "Name")].dropna())
+        assert "AYMDTVSEI" in epitopes
+        assert "KLVALGINAV" in epitopes
+        assert not any(e != e.upper() or " " in e for e in epitopes)
+        standard = set(module.load_dataframe()[("Epitope", "Name")])
+        assert "SLYNTVXTL" not in standard
+        assert "" not in standard
+        assert module._load_base_dataframe().attrs["epitope_cleaning"]["n_lowercase"] > 0
+
+def test_clean_epitopes_of_parquet_row_groups(iedb_exports, monkeypatch):
+    pytest.importorskip("pyarrow")
+    # reading a Parquet copy with several row groups gives Arrow string
+    # columns of several chunks
+    monkeypatch.setattr(columnar, "ROW_GROUP_SIZE", 16)
+    csv_path = iedb_exports["tcell"]
+    from_csv = clean_epitopes(columnar.load_table(csv_path)[("Epitope", "Name")])
+    cached = columnar.load_table(csv_path)[("Epitope", "Name")]
+    assert len(cached) > 16
+    from_parquet = clean_epitopes(cached)
+    assert from_parquet.sequences.fillna("").tolist() == \
+        from_csv.sequences.fillna("").tolist()
+    tcell._load_base_dataframe.cache_clear()
+    assert len(tcell.load_dataframe()) > 0
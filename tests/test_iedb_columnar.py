@@ -0,0 +1,69 @@
+import os
+
+import pandas as pd
+import pytest
+
+from pepdata.iedb import columnar
+
+pytest.importorskip("pyarrow")
+
+def test_table_cache_written_on_full_load(iedb_exports):
+    csv_path = iedb_exports["tcell"]
+    assert not columnar.is_fresh(csv_path)
+    df_csv = columnar.load_table(csv_path)
+    assert os.path.exists(columnar.cached_table_path(csv_path))
+    assert columnar.is_fresh(csv_path)
+    df_cached = columnar.load_table(csv_path)
+    assert list(df_cached.columns) == list(df_csv.columns)
+    assert df_cached[("Epitope", "Name")].fillna("").tolist() == \
+        df_csv[("Epitope", "Name")].fillna("").tolist()
+
+def test_table_cache_partial_load_not_cached(iedb_exports):
+    csv_path = iedb_exports["mhc"]
+    df = columnar.load_table(csv_path, nrows=10)
+    assert len(df) == 10
+    assert not columnar.is_fresh(csv_path)
+
+def test_table_cache_column_subset_and_nrows(iedb_exports):
+    csv_path = iedb_exports["tcell"]
+    columnar.load_table(csv_path)
+    columns = [("Epitope", "Name"), ("MHC Restriction", "Name")]
+    df = columnar.load_table(csv_path, columns=columns, nrows=7)
+    assert list(df.columns) == columns
+    assert len(df) == 7
+
+def test_table_cache_stale_after_csv_changes(iedb_exports):
+    csv_path = iedb_exports["tcell"]
+    n = len(columnar.load_table(csv_path))
+    with open(csv_path, "a", encoding="latin-1") as f:
+        f.write(open(csv_path, encoding="latin-1").read().splitlines()[-1] + "\n")
+    assert not columnar.is_fresh(csv_path)
+    assert len(columnar.load_table(csv_path)) == n + 1
+    assert columnar.is_fresh(csv_path)
+
+def test_scan_table_only_decodes_filter_columns(iedb_exports, monkeypatch):
+    monkeypatch.setattr(columnar, "ROW_GROUP_SIZE", 16)
+    csv_path = iedb_exports["tcell"]
+    full = columnar.load_table(csv_path)
+    key = ("MHC Restriction", "Name")
+    seen_columns = []
+
+    def mask_fn(df):
+        seen_columns.append(list(df.columns))
+        return (df[key] == "HLA-B*07:02").values
+
+    chunks = list(columnar.scan_table(csv_path, mask_fn, filter_columns=[key]))
+    assert len(seen_columns) == -(-len(full) // 16)
+    assert all(columns == [key] for columns in seen_columns)
+    df = pd.concat(chunks)
+    expected = full[full[key] == "HLA-B*07:02"]
+    assert list(df.index) == list(expected.index)
+    assert list(df.columns) == list(full.columns)
+
+def test_scan_table_nothing_passes(iedb_exports):
+    csv_path = iedb_exports["mhc"]
+    columnar.load_table(csv_path)
+    chunks = list(columnar.scan_table(
+        csv_path, lambda df: [False] * len(df), filter_columns=[("Epitope", "Name")]))
+    assert len(chunks) == 1
+    assert len(chunks[0]) == 0
@@ -0,0 +1,14 @@
+import pandas as pd
+
+from pepdata.iedb.common import str_contains, str_startswith
+
+def test_str_predicates_on_categorical_match_strings():
+    values = ["HLA-A*02:01", "HLA-A2", None, "H-2-Kb", "HLA-B*07:02"] * 4
+    strings = pd.Series(values)
+    categories = strings.astype("category")
+    for pattern in [r"HLA-A\*02", "HLA-A2|H-2", "Z"]:
+        assert str_contains(categories, pattern).tolist() == \
+            str_contains(strings, pattern).tolist()
+    assert str_startswith(categories, "HLA").tolist() == \
+        str_startswith(strings, "HLA").tolist()
+    assert str_contains(categories, "HLA").dtype == bool
@@ -0,0 +1,120 @@
+import numpy as np
+
+from pepdata.iedb.memoize import memoize
+
+def test_memoize_positional_and_keyword_args_share_key():
+    calls = []
+
+    @memoize
+    def f(x, y=2, z=None):
+        calls.append((x, y, z))
+        return x + y
+
+    assert f(1) == 3
+    assert f(1, 2) == 3
+    assert f(x=1, y=2, z=None) == 3
+    assert len(calls) == 1
+    info = f.cache_info()
+    assert info.hits == 2
+    assert info.misses == 1
+
+def test_memoize_unhashable_args():
+    calls = []
+
+    @memoize
+    def f(d):
+        calls.append(d)
+        return len(d)
+
+    assert f({"A": "G", "C": "G"}) == 2
+    assert f({"C": "G", "A": "G"}) == 2
+    assert len(calls) == 1
+
+def test_memoize_lru_eviction():
+    calls = []
+
+    @memoize(maxsize=2)
+    def f(x):
+        calls.append(x)
+        return x
+
+    f(1)
+    f(2)
+    f(1)
+    f(3)  # evicts 2, the least recently used
+    assert f.cache_info().currsize == 2
+    f(1)
+    assert calls == [1, 2, 3]
+    f(2)
+    assert calls == [1, 2, 3, 2]
+
+def test_memoize_pinned_results_not_evicted():
+    calls = []
+
+    @memoize(maxsize=2)
+    def f(x):
+        calls.append(x)
+        return x
+
+    f.cache_pin("shared", 0)
+    for x in [1, 2, 3]:
+        f(x)
+    assert f(0) == "shared"
+    assert f.cache_info().currsize == 2
+    f.cache_clear()
+    assert f(0) == 0
+
+def test_memoize_maxbytes():
+    @memoize(maxbytes=10000)
+    def f(n):
+        return np.zeros(n, dtype="uint8")
+
+    f(6000)
+    f(6000 + 1)
+    info = f.cache_info()
+    assert info.currsize == 1
+    assert info.currbytes <= 10000
+
+def test_memoize_cache_clear_and_configure():
+    @memoize
+    def f(x):
+        return x
+
+    for i in range(5):
+        f(i)
+    assert f.cache_info().currsize == 5
+    f.cache_configure(maxsize=3)
+    assert f.cache_info().currsize == 3
+    f.cache_clear()
+    assert f.cache_info().currsize == 0
+    assert f.cache_info().misses == 0
+
+def test_memoize_disk_tier_keyed_by_fingerprint(tmp_path):
+    version = ["v1"]
+    calls = []
+
+    def make():
+        @memoize(maxsize=1, disk=True, disk_dir=str(tmp_path), fingerprint=lambda: version[0])
+        def f(x):
+            calls.append(x)
+            return [x, version[0]]
+        return f
+
+    f = make()
+    assert f(1) == [1, "v1"]
+    # a new process (simulated by a new wrapper) finds the pickled result
+    g = make()
+    assert g(1) == [1, "v1"]
+    assert g.cache_info().disk_hits == 1
+    assert calls == [1]
+    # results for an older version of the data aren't reused
+    version[0] = "v2"
+    assert g(1) == [1, "v2"]
+    assert calls == [1, 1]
+    # and their pickles are removed once a newer result is written
+    assert len(list(tmp_path.iterdir())) == 1
+    version[0] = "v1"
+    assert make()(1) == [1, "v1"]
+    assert calls == [1, 1, 1]
+    g.cache_clear(disk=True)
+    assert list(tmp_path.iterdir()) == []
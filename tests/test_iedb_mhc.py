@@ -12,7 +12,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import pandas as pd
+
 from pepdata import iedb
+from pepdata.iedb.columns import get_epitope_name, get_mhc_class
 
 def test_mhc_hla_a2():
     """
@@ -28,3 +31,48 @@ def test_mhc_hla_a2():
     assert len(df_a2_combined) <= len(df_a2_1) + len(df_a2_2), \
         "Expected %d <= %d + %d" % \
         (len(df_a2_combined), len(df_a2_1), len(df_a2_2))
+
+def test_mhc_filters_same_from_csv_and_table_cache(iedb_exports, allele_list):
+    load_dataframe = iedb.mhc.load_dataframe
+    kwargs = dict(mhc_class=1, human_only=True, assay_method="mass spec")
+    df_partial = load_dataframe(nrows=50, **kwargs)
+    df_csv = load_dataframe(**kwargs)
+    load_dataframe.cache_clear()
+    iedb.mhc._load_base_dataframe.cache_clear()
+    df_cached = load_dataframe(**kwargs)
+    assert len(df_cached) > 0
+    assert list(df_csv.index) == list(df_cached.index)
+    assert list(df_partial.index) == [i for i in df_cached.index if i < 50]
+    epitopes = get_epitope_name(df_cached)
+    assert (epitopes == epitopes.str.upper()).all()
+    assert (get_mhc_class(df_cached) == "I").all()
+
+def test_mhc_scanned_and_masked_rows_agree(iedb_exports):
+    load_dataframe = iedb.mhc.load_dataframe
+    scanned = load_dataframe(peptide_length=9)
+    assert iedb.mhc._load_base_dataframe.cache_info().misses == 0
+    masked = load_dataframe(peptide_length=9, materialize=True)
+    assert len(scanned) > 0
+    assert list(scanned.index) == list(masked.index)
+    pd.testing.assert_frame_equal(
+        scanned.astype(str), masked.astype(str), check_dtype=False)
+
+def test_mhc_iter_dataframes_matches_load_dataframe(iedb_exports):
+    load_dataframe = iedb.mhc.load_dataframe
+    df = load_dataframe(peptide_length=9)
+    chunks = list(iedb.mhc.iter_dataframes(chunksize=10, peptide_length=9))
+    assert len(chunks) > 1
+    combined = pd.concat(chunks)
+    assert list(combined.index) == list(df.index)
+    assert combined[("Epitope", "Name")].tolist() == \
+        df[("Epitope", "Name")].tolist()
+
+def test_mhc_iter_dataframes_nothing_passes(iedb_exports):
+    chunks = list(iedb.mhc.iter_dataframes(hla="HLA-Z"))
+    assert len(chunks) == 1
+    assert len(chunks[0]) == 0
+
+def test_mhc_mhc_class_matches_tcell(iedb_exports, allele_list):
+    df_class2 = iedb.mhc.load_dataframe(mhc_class=2)
+    assert len(df_class2) > 0
+    assert (get_mhc_class(df_class2) == "II").all()
@@ -0,0 +1,136 @@
+import os
+import zipfile
+
+import datacache
+import numpy as np
+import pandas as pd
+import pytest
+
+from pepdata.iedb import refresh, tcell
+from pepdata.iedb.aggregate import EpitopeAlleleTable, load_epitope_allele_table
+from pepdata.kmer_index import KmerIndex
+from pepdata.similarity_index import SimilarityIndex
+
+from conftest import make_export_rows, write_export
+
+@pytest.fixture
+def export_server(tmp_path, monkeypatch):
+    """
+    Download the T-cell export into a temporary cache, from file:// URLs of
+    zipped stand-ins for the IEDB export.
+    """
+    cache = datacache.Cache("pepdata", cache_root=str(tmp_path / "cache"))
+    monkeypatch.setattr(tcell, "cache", cache)
+    csv_path = cache.local_path(
+        filename=tcell.TCELL_COMPACT_FILENAME,
+        url=tcell.TCELL_COMPACT_URL,
+        decompress=tcell.TCELL_COMPACT_DECOMPRESS)
+    monkeypatch.setattr(tcell, "local_path", lambda auto_download=True: csv_path)
+
+    def publish(rows, version):
+        csv = write_export(tmp_path / ("export_%d.csv" % version), rows)
+        zip_path = str(tmp_path / ("export_%d.zip" % version))
+        with zipfile.ZipFile(zip_path, "w") as f:
+            f.write(csv, "tcell_full_v3.csv")
+        return "file://" + zip_path
+
+    return publish
+
+def distinct_rows(n_rows, seed=0):
+    # the synthetic rows repeat, make every assay distinct
+    rows = make_export_rows(n_rows, seed=seed)
+    for i, row in enumerate(rows):
+        row[11] = str(1 + seed + i)
+    return rows
+
+def epitopes_of(df):
+    return set(df[("Epitope", "Name")].dropna())
+
+def test_refresh_without_previous_export(export_server):
+    delta = tcell.refresh(url=export_server(make_export_rows(40), 0))
+    assert len(delta.inserted) == 40
+    assert len(delta.removed) == 0
+    assert delta.old_fingerprint is None
+    assert len(tcell._load_base_dataframe()) == 40
+
+def test_refresh_delta_and_cached_tables(export_server, monkeypatch):
+    rows = distinct_rows(120)
+    tcell.refresh(url=export_server(rows, 0))
+    old_table = load_epitope_allele_table("tcell")
+    old_epitopes = epitopes_of(tcell.load_dataframe())
+    similarity_index = SimilarityIndex(old_epitopes)
+    kmer_index = KmerIndex(old_epitopes)
+    # the edited epitope only passes the first filter
+    filters = [dict(assay_method="ELISPOT"), dict(hla="HLA-A24")]
+    filtered_indexes = [
+        (SimilarityIndex.from_iedb("tcell", **f), KmerIndex.from_iedb("tcell", **f))
+        for f in filters
+    ]
+
+    new_rows = [list(row) for row in rows[10:]]
+    new_rows[20][10] = "Negative" if new_rows[20][10] == "Positive" else "Positive"
+    new_rows[30][3] = "YLLPAIVHIAAA"
+    new_rows += distinct_rows(15, seed=500)
+
+    rebuilt = []
+    with monkeypatch.context() as m:
+        # neither the refresh nor the next load aggregate the export again
+        m.setattr(
+            EpitopeAlleleTable, "append",
+            lambda self, df, hashes=None: rebuilt.append(len(df)))
+        delta = tcell.refresh(url=export_server(new_rows, 1))
+        new_df = tcell.load_dataframe()
+        table = load_epitope_allele_table("tcell")
+    assert rebuilt == []
+    assert len(delta.removed) == 12
+    assert len(delta.inserted) == 17
+    assert sorted(delta.removed.index)[-2:] == [30, 40]
+    assert "YLLPAIVHIAAA" in delta.added_epitopes
+    assert delta.new_fingerprint != delta.old_fingerprint
+    saved = refresh.load_delta("tcell")
+    assert len(saved.inserted) == 17 and len(saved.removed) == 12
+
+    assert table.n_source_rows == len(new_df) != old_table.n_source_rows
+    expected = EpitopeAlleleTable.from_dataframe(new_df).to_dataframe()
+    key = ["epitope", "allele"]
+    actual = table.to_dataframe()
+    pd.testing.assert_frame_equal(
+        actual.astype({"epitope": str, "allele": str}).sort_values(key)
+            .reset_index(drop=True),
+        expected.astype({"epitope": str, "allele": str}).sort_values(key)
+            .reset_index(drop=True))
+
+    new_epitopes = epitopes_of(new_df)
+    delta.update_similarity_index(similarity_index)
+    assert similarity_index.peptides == SimilarityIndex(new_epitopes).peptides
+    kmer_index = delta.update_kmer_index(kmer_index)
+    assert np.array_equal(kmer_index.epitopes, KmerIndex(new_epitopes).epitopes)
+
+    # indexes of filtered rows are updated with the same filters
+    assert delta.epitope_changes(**filters[0]) == ({"YLLPAIVHIAAA"}, set())
+    assert delta.epitope_changes(**filters[1]) == (set(), set())
+    for f, (filtered_similarity_index, filtered_kmer_index) in zip(filters, filtered_indexes):
+        delta.update_similarity_index(filtered_similarity_index, **f)
+        assert filtered_similarity_index.peptides == \
+            SimilarityIndex.from_iedb("tcell", **f).peptides
+        delta.update_kmer_index(filtered_kmer_index, **f)
+        assert np.array_equal(
+            filtered_kmer_index.epitopes, KmerIndex.from_iedb("tcell", **f).epitopes)
+
+def test_refresh_matches_duplicate_rows_in_order():
+    hashes = np.array([5, 5, 5, 7, 9], dtype="uint64")
+    other = np.array([9, 5, 3], dtype="uint64")
+    assert refresh._unmatched(hashes, other).tolist() == [1, 2, 3]
+    assert refresh._unmatched(other, hashes).tolist() == [2]
+
+def test_refresh_drops_tables_of_partial_loads(export_server):
+    tcell.refresh(url=export_server(make_export_rows(60), 0))
+    load_epitope_allele_table("tcell", nrows=20)
+    cached = [path for (path, _) in refresh._cached_tables(tcell.local_path())]
+    assert len(cached) == 1
+    tcell.refresh(url=export_server(make_export_rows(70), 1))
+    assert not os.path.exists(cached[0])
+
+def test_refresh_unknown_source():
+    with pytest.raises(ValueError, match="Unknown IEDB source 'bcell'"):
+        refresh.refresh_export("bcell")
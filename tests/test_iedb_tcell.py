@@ -1,3 +1,5 @@
+import pandas as pd
+
 from pepdata import iedb
 from pepdata.iedb.columns import get_mhc_allele
 
@@ -40,3 +42,66 @@ def test_tcell_hla_exclude_a0201():
     assert n_A0201_entries == 0, \
         ("Not supposed to contain HLA-A*02:01, "
          " but found %d rows of that allele") % n_A0201_entries
+
+def test_tcell_filters_same_from_csv_and_table_cache(iedb_exports):
+    load_dataframe = iedb.tcell.load_dataframe
+    kwargs = dict(hla="HLA-A", exclude_hla="HLA-A2", peptide_length=9)
+    df_partial = load_dataframe(nrows=100, **kwargs)
+    df_csv = load_dataframe(**kwargs)
+    load_dataframe.cache_clear()
+    iedb.tcell._load_base_dataframe.cache_clear()
+    df_cached = load_dataframe(**kwargs)
+    assert len(df_cached) > 0
+    assert list(df_csv.index) == list(df_cached.index)
+    assert list(df_partial.index) == [i for i in df_cached.index if i < 100]
+    alleles = get_mhc_allele(df_cached)
+    assert alleles.str.startswith("HLA-A").all()
+    assert not (alleles == "HLA-A2").any()
+
+def test_tcell_iter_dataframes_matches_load_dataframe(iedb_exports):
+    load_dataframe = iedb.tcell.load_dataframe
+    kwargs = dict(hla="HLA-A|HLA-B", human_only=True)
+    # first pass streams the CSV, second goes through the Parquet copy
+    chunks_csv = list(iedb.tcell.iter_dataframes(chunksize=25, **kwargs))
+    df = load_dataframe(**kwargs)
+    chunks_cached = list(iedb.tcell.iter_dataframes(chunksize=25, **kwargs))
+    for chunks in [chunks_csv, chunks_cached]:
+        assert all(chunk.index.max() - chunk.index.min() < 25 for chunk in chunks)
+        combined = pd.concat(chunks)
+        assert list(combined.index) == list(df.index)
+        assert combined[("Epitope", "Name")].tolist() == \
+            df[("Epitope", "Name")].tolist()
+
+def test_tcell_filters_share_one_base_load(iedb_exports):
+    base = iedb.tcell._load_base_dataframe
+    # selective queries scan the export rather than loading all of it
+    scanned = iedb.tcell.load_dataframe(hla="HLA-A24")
+    assert len(scanned) > 0
+    assert base.cache_info().misses == 0
+    df_all = iedb.tcell.load_dataframe()
+    df_a24 = iedb.tcell.load_dataframe(hla="HLA-A24", human_only=True)
+    df_b7 = iedb.tcell.load_dataframe(hla=r"HLA-B7|HLA-B\*07")
+    assert 0 < len(df_a24) < len(df_all)
+    assert len(df_b7) > 0
+    info = base.cache_info()
+    assert info.misses == 1
+    assert info.hits == 0
+    # once the export is in memory, other filters mask it
+    masked = iedb.tcell.load_dataframe(hla="HLA-A24", materialize=False)
+    assert list(masked.index) == list(scanned.index)
+    assert masked[("Epitope", "Name")].tolist() == scanned[("Epitope", "Name")].tolist()
+    assert base.cache_info().misses == 1
+
+def test_tcell_mhc_class(iedb_exports, allele_list):
+    df_all = iedb.tcell.load_dataframe()
+    df_class1 = iedb.tcell.load_dataframe(mhc_class=1)
+    df_class2 = iedb.tcell.load_dataframe(mhc_class="II")
+    assert len(df_class1) + len(df_class2) == len(df_all)
+    assert set(get_mhc_allele(df_class2)) == {"HLA-DRB1*04:01"}
+    assert "HLA class I" in set(get_mhc_allele(df_class1))
+
+def test_tcell_low_cardinality_columns_are_categorical(iedb_exports):
+    df = iedb.tcell.load_dataframe()
+    assert isinstance(get_mhc_allele(df).dtype, pd.CategoricalDtype)
+    chunk = next(iter(iedb.tcell.iter_dataframes(chunksize=50)))
+    assert isinstance(get_mhc_allele(chunk).dtype, pd.CategoricalDtype)
@@ -0,0 +1,94 @@
+import numpy as np
+
+from pepdata import kmer_index
+from pepdata.kmer_index import KmerIndex
+
+def random_sequences(n, length, seed):
+    rng = np.random.RandomState(seed)
+    letters = np.array(list("ACDEFGHIKLMNPQRSTVWY"))
+    return ["".join(rng.choice(letters, length)) for _ in range(n)]
+
+proteins = dict(zip(["p1", "p2", "p3"], random_sequences(3, 400, seed=0)))
+proteins["p3"] = proteins["p3"][:100] + "X" + proteins["p3"][101:]
+
+epitopes = (
+    [proteins["p1"][10:19], proteins["p1"][200:208], proteins["p2"][0:9]] +
+    # longer than the anchor, so only matched after checking the full sequence
+    [proteins["p2"][50:80], proteins["p2"][50:79] + "A"] +
+    # wildcard matches literally, spanning proteins never matches
+    [proteins["p3"][95:105], proteins["p1"][-4:] + proteins["p2"][:4]] +
+    random_sequences(50, 9, seed=1)
+)
+
+def brute_force(epitopes, proteins):
+    results = set()
+    for e in set(epitopes):
+        for name, sequence in proteins.items():
+            start = sequence.find(e)
+            while start != -1:
+                results.add((e, name, start))
+                start = sequence.find(e, start + 1)
+    return results
+
+def as_set(df, columns=("epitope", "protein", "offset")):
+    return set(df[list(columns)].itertuples(index=False, name=None))
+
+def test_kmer_index_search_matches_brute_force():
+    assert kmer_index.ANCHOR_LENGTH < 30
+    index = KmerIndex(epitopes + ["not an epitope"])
+    assert len(index) == len(set(epitopes))
+    df = index.search(proteins)
+    assert as_set(df) == brute_force(epitopes, proteins)
+    assert as_set(df) >= {
+        (proteins["p2"][50:80], "p2", 50),
+        (proteins["p3"][95:105], "p3", 95),
+    }
+    assert as_set(index.search(proteins, chunk_size=1)) == as_set(df)
+
+def test_kmer_index_search_list_of_proteins():
+    index = KmerIndex(epitopes)
+    df = index.search(list(proteins.values()))
+    assert set(df["protein"]) == {0, 1, 2}
+
+def test_kmer_index_overlaps():
+    index = KmerIndex(["AAAAACDEFGHIK", "QQQQQQQQ"])
+    df = index.overlaps({"p": "MMMCDEFGHIKLLL"}, k=5)
+    assert sorted(as_set(df, ["epitope", "offset", "epitope_offset"])) == [
+        ("AAAAACDEFGHIK", 3, 5),
+        ("AAAAACDEFGHIK", 4, 6),
+        ("AAAAACDEFGHIK", 5, 7),
+        ("AAAAACDEFGHIK", 6, 8),
+    ]
+
+def test_kmer_index_no_proteins():
+    index = KmerIndex(epitopes)
+    for no_proteins in [{}, []]:
+        df = index.search(no_proteins)
+        assert len(df) == 0 and list(df.columns) == ["epitope", "protein", "offset"]
+        df = index.overlaps(no_proteins, k=5)
+        assert len(df) == 0
+        assert list(df.columns) == ["epitope", "protein", "offset", "epitope_offset"]
+
+def test_kmer_index_save_load(tmp_path):
+    index = KmerIndex(epitopes)
+    path = str(tmp_path / "kmers.npz")
+    index.save(path)
+    loaded = KmerIndex.load(path)
+    assert as_set(loaded.search(proteins)) == as_set(index.search(proteins))
+
+def test_kmer_index_add_remove_matches_rebuild():
+    anchor = "A" * kmer_index.ANCHOR_LENGTH
+    long_epitopes = [anchor + suffix for suffix in ["C", "DE", "CC", "D"]]
+    first = epitopes[:30] + long_epitopes[:2]
+    added = epitopes[25:] + long_epitopes[2:] + ["SIINFEKL", "not an epitope"]
+    removed = epitopes[:5] + long_epitopes[:1] + ["GILGFVFTL"]
+    index = KmerIndex(first)
+    index.add(added)
+    index.remove(removed)
+    expected = KmerIndex((set(first) | set(added)) - set(removed))
+    assert index.epitopes.tolist() == expected.epitopes.tolist()
+    assert np.array_equal(index.lengths, expected.lengths)
+    assert np.array_equal(index.codes, expected.codes)
+    assert as_set(index.search(proteins)) == as_set(expected.search(proteins))
+    empty = KmerIndex().add(epitopes)
+    assert empty.epitopes.tolist() == KmerIndex(epitopes).epitopes.tolist()
@@ -0,0 +1,86 @@
+import subprocess
+import sys
+
+import pepdata.amino_acid_properties
+import pepdata.blosum
+import pepdata.chou_fasman
+import pepdata.pmbec
+import pepdata.residue_contact_energies
+
+def run_python(code):
+    return subprocess.run(
+        [sys.executable, "-c", code],
+        check=True,
+        capture_output=True,
+        text=True).stdout
+
+def test_import_pepdata_skips_heavy_dependencies():
+    # guards import time: `import pepdata` shouldn't load pandas, scikit-learn,
+    # datacache or any amino acid matrix
+    output = run_python(
+        "import sys, pepdata\n"
+        "import pepdata.blosum, pepdata.pmbec, pepdata.residue_contact_energies\n"
+        "import pepdata.amino_acid_properties, pepdata.chou_fasman\n"
+        "heavy = ['pandas', 'sklearn', 'datacache', 'scipy']\n"
+        "print(sorted(m for m in heavy if m in sys.modules))\n"
+        "print('blosum62_matrix' in vars(pepdata.blosum))\n"
+        "print('pmbec_matrix' in vars(pepdata.pmbec))\n"
+        "print('hydropathy' in vars(pepdata.amino_acid_properties))\n"
+        "print('turn_score' in vars(pepdata.chou_fasman))\n")
+    assert output.split("\n")[:5] == ["[]", "False", "False", "False", "False"]
+
+def import_times(module):
+    """
+    Cumulative import time (in microseconds) of every module imported by
+    a fresh interpreter running `import module`, from python -X importtime.
+    """
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + module],
+        check=True,
+        capture_output=True,
+        text=True).stderr
+    times = {}
+    for line in stderr.splitlines():
+        fields = line[len("import time:"):].split("|")
+        if line.startswith("import time:") and fields[1].strip().isdigit():
+            times[fields[2].strip()] = int(fields[1])
+    return times
+
+def test_import_pepdata_time_relative_to_numpy():
+    # benchmark of import time which doesn't depend on the speed of the
+    # machine: what pepdata adds to importing numpy (which it needs) should
+    # stay well below numpy's own import time, as it does when it loads
+    # nothing else heavy (importing pandas alone takes several times as long)
+    timings = []
+    for _ in range(3):
+        times = import_times("pepdata")
+        timings.append((times["pepdata"] - times["numpy"], times["numpy"]))
+    overhead, numpy_time = min(timings)
+    assert overhead < numpy_time / 2, \
+        "import pepdata takes %.1fms beyond numpy (%.1fms)" % (
+            overhead / 1000, numpy_time / 1000)
+
+def test_pmbec_is_quiet():
+    output = run_python("from pepdata.pmbec import pmbec_matrix")
+    assert output == ""
+
+def test_lazy_attributes_resolve():
+    output = run_python(
+        "import pepdata\n"
+        "print(pepdata.PeptideVectorizer.__name__, pepdata.iedb.__name__)\n")
+    assert output.strip() == "PeptideVectorizer pepdata.iedb"
+
+def test_lazy_matrices():
+    assert pepdata.blosum.blosum50_matrix.shape[0] >= 20
+    assert "blosum30_dict" in dir(pepdata.blosum)
+    assert pepdata.pmbec.pmbec_dict["V"]["R"] == pepdata.pmbec.pmbec_matrix[19, 1]
+    contacts = pepdata.residue_contact_energies
+    assert (contacts.coil_vs_helix_array == contacts.helix_vs_coil_array.T).all()
+    assert "strand_vs_helix_dict" in dir(contacts)
+
+def test_lazy_property_tables():
+    properties = pepdata.amino_acid_properties
+    assert properties.hydropathy["I"] == 4.5
+    assert set(properties.mass) == set(properties.volume)
+    assert "polarity" in dir(properties)
+    assert pepdata.chou_fasman.alpha_helix_score[0] == 142
@@ -0,0 +1,57 @@
+import os
+import shutil
+
+import numpy as np
+
+from pepdata import matrix_bundle
+from pepdata.amino_acid_alphabet import dict_to_amino_acid_matrix
+from pepdata.blosum import blosum62_dict, blosum62_matrix
+from pepdata.pmbec import pmbec_dict, pmbec_matrix
+from pepdata.residue_contact_energies import coil_vs_helix_array, coil_vs_helix_dict
+
+def test_bundle_matches_sources(tmp_path):
+    matrix_bundle.write_bundle(str(tmp_path))
+    arrays = matrix_bundle.read_bundle(str(tmp_path))
+    parsed = matrix_bundle.parse_source_arrays()
+    assert sorted(arrays) == sorted(parsed)
+    for name, array in parsed.items():
+        assert arrays[name].dtype == array.dtype
+        assert (arrays[name] == array).all()
+    assert isinstance(arrays["blosum62"].base, np.memmap)
+    # writable, but writes don't reach the file
+    arrays["blosum62"][0, 0] = 100
+    assert matrix_bundle.read_bundle(str(tmp_path))["blosum62"][0, 0] == parsed["blosum62"][0, 0]
+
+def test_module_matrices_match_dicts():
+    assert (blosum62_matrix == dict_to_amino_acid_matrix(blosum62_dict)).all()
+    assert blosum62_matrix.dtype == np.float32
+    assert (pmbec_matrix == dict_to_amino_acid_matrix(pmbec_dict)).all()
+    assert (coil_vs_helix_array == dict_to_amino_acid_matrix(coil_vs_helix_dict)).all()
+
+def test_bundle_is_rebuilt_when_a_source_changes(tmp_path, monkeypatch):
+    sources = tmp_path / "sources"
+    sources.mkdir()
+    paths = []
+    for path in matrix_bundle.source_paths:
+        shutil.copy(path, sources)
+        paths.append(str(sources / os.path.basename(path)))
+    monkeypatch.setattr(matrix_bundle, "source_paths", paths)
+    bundles = str(tmp_path / "bundles")
+    monkeypatch.setenv(matrix_bundle.ENV_KEY, bundles)
+    monkeypatch.setattr(matrix_bundle, "_arrays", None)
+    first = matrix_bundle.load_arrays()
+    assert len(os.listdir(bundles)) == 2
+
+    # a bundle of the same sources is reused rather than rebuilt
+    monkeypatch.setattr(matrix_bundle, "_arrays", None)
+    assert matrix_bundle.read_bundle(bundles) is not None
+
+    with open(paths[0], "a") as f:
+        f.write("\n")
+    assert matrix_bundle.read_bundle(bundles) is None
+    monkeypatch.setattr(matrix_bundle, "_arrays", None)
+    second = matrix_bundle.load_arrays()
+    assert (second["blosum30"] == first["blosum30"]).all()
+    # the stale bundle was replaced
+    assert len(os.listdir(bundles)) == 2
+    assert all(matrix_bundle.source_fingerprint() in name for name in os.listdir(bundles))
@@ -14,7 +14,13 @@
 
 import pickle
 
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer
+
 from pepdata import PeptideVectorizer
+from pepdata.peptide_vectorizer import NgramCounter
+from pepdata.reduced_alphabet import gbmr4
 
 # isoforms of two different proteins a, b
 
@@ -59,3 +65,133 @@ b2 = (
 )
 
 B = [b1, b2]
+
+def test_peptide_vectorizer_dense():
+    vectorizer = PeptideVectorizer(max_ngram=2)
+    X = vectorizer.fit_transform(A + B)
+    assert isinstance(X, np.ndarray)
+    assert X.dtype == np.float64
+    assert np.allclose(X.sum(axis=1), 1.0)
+    assert np.allclose(vectorizer.transform(B), X[3:])
+
+def test_peptide_vectorizer_sparse_float32():
+    dense = PeptideVectorizer(max_ngram=3).fit_transform(A + B)
+    vectorizer = PeptideVectorizer(max_ngram=3, sparse=True, dtype=np.float32)
+    X = vectorizer.fit_transform(A + B)
+    assert sparse.issparse(X) and X.format == "csr"
+    assert X.dtype == np.float32
+    assert np.allclose(X.toarray(), dense, atol=1e-6)
+    X_b = vectorizer.transform(B)
+    assert sparse.issparse(X_b)
+    assert np.allclose(X_b.toarray(), dense[3:], atol=1e-6)
+
+def test_peptide_vectorizer_pickle():
+    vectorizer = PeptideVectorizer(max_ngram=2, sparse=True)
+    X = vectorizer.fit_transform(A)
+    unpickled = pickle.loads(pickle.dumps(vectorizer))
+    assert unpickled.sparse
+    assert np.allclose(unpickled.transform(A).toarray(), X.toarray())
+
+def test_ngram_counter_matches_count_vectorizer():
+    peptides = A + B + ["SIINFEKL", "siinfekl", "Y"]
+    for reduced_alphabet in [None, gbmr4]:
+        if reduced_alphabet is None:
+            preprocessor = None
+        else:
+            peptides = [p.upper() for p in peptides]
+            def preprocessor(s):
+                return "".join(reduced_alphabet[c] for c in s)
+        expected_vectorizer = CountVectorizer(
+            analyzer='char', ngram_range=(1, 3), preprocessor=preprocessor)
+        expected = expected_vectorizer.fit_transform(peptides)
+        counter = NgramCounter(max_ngram=3, reduced_alphabet=reduced_alphabet)
+        counts = counter.fit_transform(peptides)
+        assert counter.vocabulary_ == expected_vectorizer.vocabulary_
+        assert (counts != expected).nnz == 0
+        assert (counter.transform(B) != expected_vectorizer.transform(B)).nnz == 0
+
+def test_ngram_counter_breaks_on_other_characters():
+    # CountVectorizer also counts digits, '-' and the n-grams spanning them,
+    # the counts of every other n-gram are the same
+    peptides = ["SIIN-FEKL", "GILG9FVFTL", "-AC1DE-", "YLQ"]
+    expected_vectorizer = CountVectorizer(analyzer='char', ngram_range=(1, 3))
+    expected = expected_vectorizer.fit_transform(peptides)
+    counter = NgramCounter(max_ngram=3)
+    counts = counter.fit_transform(peptides)
+    assert set(counter.vocabulary_) == {
+        ngram for ngram in expected_vectorizer.vocabulary_ if ngram.isalpha()
+    }
+    columns = [
+        expected_vectorizer.vocabulary_[ngram]
+        for ngram in counter.get_feature_names_out()
+    ]
+    assert (counts != expected[:, columns]).nnz == 0
+    pieces = counter.transform(["SII", "N"]).toarray().sum(axis=0)
+    assert np.array_equal(counter.transform(["1SII-N"]).toarray()[0], pieces)
+
+def test_peptide_vectorizer_training_already_reduced():
+    reduced = ["".join(gbmr4[c] for c in p) for p in A]
+    vectorizer = PeptideVectorizer(
+        max_ngram=2, reduced_alphabet=gbmr4, training_already_reduced=True)
+    X = vectorizer.fit_transform(reduced)
+    assert np.allclose(vectorizer.transform(A), X)
+
+def test_peptide_vectorizer_transform_parallel():
+    peptides = A + B + [p[i:i + 9] for p in A + B for i in range(0, 60, 3)]
+    for is_sparse in [False, True]:
+        vectorizer = PeptideVectorizer(max_ngram=2, sparse=is_sparse)
+        expected = vectorizer.fit_transform(peptides)
+        for backend in ["thread", "process"]:
+            X = vectorizer.transform_parallel(
+                peptides, n_jobs=2, chunk_size=7, backend=backend)
+            assert sparse.issparse(X) == is_sparse
+            if is_sparse:
+                X, X_expected = X.toarray(), expected.toarray()
+            else:
+                X_expected = expected
+            assert np.allclose(X, X_expected)
+
+def test_peptide_vectorizer_n_jobs():
+    vectorizer = PeptideVectorizer(max_ngram=2, n_jobs=2)
+    X = vectorizer.fit_transform(A + B)
+    assert np.allclose(vectorizer.transform(A + B), X)
+
+def test_peptide_vectorizer_stateless_enumeration():
+    vectorizer = PeptideVectorizer(max_ngram=2, stateless=True, sparse=True)
+    assert len(vectorizer.count_vectorizer.vocabulary_) == 20 + 20 ** 2
+    # no fit needed, and separately made vectorizers agree
+    X = vectorizer.transform(A)
+    X_other = PeptideVectorizer(max_ngram=2, stateless=True, sparse=True).transform(A)
+    assert (X != X_other).nnz == 0
+    # same values as a fitted vectorizer, in the columns of the same n-grams
+    fitted = PeptideVectorizer(max_ngram=2, sparse=True)
+    X_fitted = fitted.fit_transform(A)
+    columns = [
+        vectorizer.count_vectorizer.vocabulary_[ngram]
+        for ngram in fitted.count_vectorizer.get_feature_names_out()
+    ]
+    assert np.allclose(X[:, columns].toarray(), X_fitted.toarray())
+    # n-grams missing from the training data still count
+    X_b = vectorizer.transform(B)
+    assert np.allclose(X_b.sum(axis=1), 1.0)
+
+def test_peptide_vectorizer_stateless_skips_unknown_letters():
+    for n_features in [None, 2 ** 10]:
+        vectorizer = PeptideVectorizer(
+            max_ngram=2, stateless=True, n_features=n_features,
+            normalize_row=False)
+        X = vectorizer.transform(["SIIXNFEKL", "BZUO"])
+        assert np.array_equal(X[0], vectorizer.transform(["SII", "NFEKL"]).sum(axis=0))
+        assert not X[1].any()
+
+def test_peptide_vectorizer_stateless_hashing():
+    vectorizer = PeptideVectorizer(
+        max_ngram=4, stateless=True, n_features=2 ** 12, reduced_alphabet=gbmr4)
+    X = vectorizer.transform(A + B)
+    assert X.shape == (5, 2 ** 12)
+    assert np.allclose(X.sum(axis=1), 1.0)
+    X_again = pickle.loads(pickle.dumps(vectorizer)).transform(A + B)
+    assert np.allclose(X, X_again)
+    assert np.allclose(
+        PeptideVectorizer(max_ngram=4, stateless=True, n_features=2 ** 12,
+            reduced_alphabet=gbmr4).fit_transform(B), X[3:])
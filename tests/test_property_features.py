@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from pepdata.amino_acid_properties import hydropathy, volume
+from pepdata.chou_fasman import alpha_helix_score
+from pepdata.amino_acid_alphabet import amino_acid_letter_indices
+from pepdata.property_features import PropertyFeaturizer, property_matrix
+
+peptides = ["SIINFEKL", "GILGFVFTL", "YLQ"]
+
+def test_property_matrix():
+    matrix = property_matrix(["hydropathy", "alpha_helix_score"])
+    assert matrix.shape == (20, 2)
+    assert matrix[amino_acid_letter_indices["I"], 0] == hydropathy["I"]
+    assert matrix[amino_acid_letter_indices["I"], 1] == \
+        alpha_helix_score[amino_acid_letter_indices["I"]]
+    standardized = property_matrix(standardize=True)
+    assert np.allclose(standardized.mean(axis=0), 0)
+    assert np.allclose(standardized.std(axis=0), 1)
+
+def test_property_featurizer_per_position():
+    featurizer = PropertyFeaturizer(["hydropathy", "volume"])
+    X = featurizer.transform(peptides)
+    assert X.shape == (3, 9, 2)
+    assert np.allclose(X[0, :8, 0], [hydropathy[c] for c in "SIINFEKL"])
+    assert np.isnan(X[0, 8]).all()
+    assert np.isnan(X[2, 3:]).all()
+
+def test_property_featurizer_pooling():
+    featurizer = PropertyFeaturizer(
+        ["hydropathy", "volume"], pooling=["mean", "min", "max", "sum"])
+    assert featurizer.feature_names[:3] == [
+        "mean_hydropathy", "mean_volume", "min_hydropathy"]
+    X = featurizer.transform(peptides)
+    assert X.shape == (3, 8)
+    for i, p in enumerate(peptides):
+        values = np.array([[hydropathy[c], volume[c]] for c in p])
+        expected = np.concatenate([
+            values.mean(axis=0), values.min(axis=0),
+            values.max(axis=0), values.sum(axis=0)])
+        assert np.allclose(X[i], expected, rtol=1e-5)
+
+def test_property_featurizer_rejects_other_letters():
+    with pytest.raises(ValueError):
+        PropertyFeaturizer().transform(["SIIXFEKL"])
+    with pytest.raises(ValueError):
+        PropertyFeaturizer(pooling="median")
@@ -0,0 +1,94 @@
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import pepdata.blosum
+from pepdata import matrix_bundle, shared_arrays
+from pepdata.iedb import mhc, tcell
+from pepdata.iedb.columns import get_epitope_name, get_mhc_allele
+
+@pytest.fixture
+def restore_matrices(monkeypatch):
+    arrays = matrix_bundle.load_arrays()
+    monkeypatch.setattr(shared_arrays, "_registries", [])
+    yield
+    matrix_bundle.install_arrays(arrays)
+
+def test_shared_arrays_round_trip():
+    arrays = {"a": np.arange(10, dtype="int16"), "b": np.eye(3, dtype="float32")}
+    shared = shared_arrays.SharedArrays.create(arrays)
+    try:
+        attached = shared_arrays.SharedArrays.attach(shared.name)
+        assert sorted(attached) == ["a", "b"]
+        assert (attached["a"] == arrays["a"]).all()
+        assert attached["b"].dtype == np.float32
+        assert not attached["b"].flags.writeable
+        attached.close()
+    finally:
+        shared.unlink()
+
+def test_encode_dataframe_round_trip(iedb_exports):
+    df = tcell._load_base_dataframe()
+    arrays = shared_arrays.encode_dataframe(df, "iedb/tcell/all/")
+    decoded = shared_arrays.decode_dataframe(arrays, "iedb/tcell/all/")
+    pd.testing.assert_frame_equal(decoded, df)
+    assert decoded.attrs == df.attrs
+
+def test_encode_dataframe_other_dtypes():
+    df = pd.DataFrame({
+        ("a", "mixed"): pd.Series(["x", 1, None, 2.5], dtype=object),
+        ("a", "numbers"): pd.Categorical([3, 1, 3, None]),
+        ("a", "text"): pd.Series(["p", None, "q", "p"], dtype=object),
+    }, index=[4, 5, 6, 7])
+    decoded = shared_arrays.decode_dataframe(
+        shared_arrays.encode_dataframe(df, "x/"), "x/")
+    pd.testing.assert_frame_equal(decoded, df)
+
+def test_publish_and_attach(iedb_exports, restore_matrices):
+    expected = tcell.load_dataframe(hla="HLA-A2")
+    expected_all = tcell.load_dataframe()
+    expected_mhc = mhc.load_dataframe()
+    assert pepdata.blosum.blosum62_matrix is matrix_bundle.get_array("blosum62")
+    shared = shared_arrays.publish()
+    try:
+        # the loaders now filter the shared DataFrames, which have the
+        # dtypes and attrs of the loaders' own
+        tcell.load_dataframe.cache_clear()
+        mhc.load_dataframe.cache_clear()
+        result = tcell.load_dataframe(hla="HLA-A2")
+        pd.testing.assert_frame_equal(result, expected)
+        pd.testing.assert_frame_equal(tcell.load_dataframe(), expected_all)
+        assert tcell.load_dataframe().attrs == expected_all.attrs
+        assert len(mhc.load_dataframe()) == len(expected_mhc)
+        assert matrix_bundle.get_array("blosum62") is shared["matrix/blosum62"]
+        # including matrices which modules already hold
+        assert pepdata.blosum.blosum62_matrix is shared["matrix/blosum62"]
+
+        # loads of other nrows don't evict the shared DataFrame
+        base = tcell._load_base_dataframe()
+        tcell._load_base_dataframe(nrows=5)
+        tcell._load_base_dataframe(nrows=6)
+        assert tcell._load_base_dataframe() is base
+
+        # another process attaches by name without copying or unlinking it
+        code = (
+            "from pepdata import matrix_bundle, shared_arrays\n"
+            "from pepdata.iedb.columns import get_epitope_name\n"
+            "shared = shared_arrays.SharedArrays.attach(%r)\n"
+            "df = shared_arrays.decode_dataframe(shared.arrays, 'iedb/tcell/all/')\n"
+            "print(len(df), get_epitope_name(df).notnull().sum())\n"
+            "print(float(shared['matrix/blosum62'].sum()))\n") % shared.name
+        output = subprocess.run(
+            [sys.executable, "-c", code],
+            check=True, capture_output=True, text=True).stdout.split("\n")
+        codes = get_mhc_allele(base).array.codes
+        assert any(np.shares_memory(codes, array) for array in shared.arrays.values())
+        assert output[0] == "%d %d" % (len(base), get_epitope_name(base).notnull().sum())
+        assert float(output[1]) == float(matrix_bundle.parse_source_arrays()["blosum62"].sum())
+        assert (shared_arrays.SharedArrays.attach(shared.name)["matrix/pmbec"] ==
+            matrix_bundle.parse_source_arrays()["pmbec"]).all()
+    finally:
+        shared.unlink()
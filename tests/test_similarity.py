@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from pepdata.blosum import blosum62_dict, blosum62_matrix
+from pepdata.pmbec import pmbec_matrix
+from pepdata.residue_contact_energies import helix_vs_coil_array
+from pepdata.similarity import paired_similarity, pairwise_similarity
+
+def random_peptides(n, length, seed):
+    rng = np.random.RandomState(seed)
+    letters = np.array(list("ACDEFGHIKLMNPQRSTVWY"))
+    return ["".join(rng.choice(letters, length)) for _ in range(n)]
+
+def test_pairwise_similarity_matches_blosum62_dict():
+    a = random_peptides(7, 9, seed=0)
+    b = random_peptides(5, 9, seed=1)
+    scores = pairwise_similarity(a, b, blosum62_matrix)
+    assert scores.shape == (7, 5)
+    for i, x in enumerate(a):
+        for j, y in enumerate(b):
+            expected = sum(blosum62_dict[xi][yi] for (xi, yi) in zip(x, y))
+            assert scores[i, j] == expected
+
+def test_pairwise_similarity_chunked_matches_unchunked():
+    a = random_peptides(23, 8, seed=2)
+    b = random_peptides(17, 8, seed=3)
+    for matrix in [pmbec_matrix, helix_vs_coil_array]:
+        full = pairwise_similarity(a, b, matrix)
+        chunked = pairwise_similarity(a, b, matrix, chunk_size=5)
+        assert np.allclose(full, chunked)
+
+def test_asymmetric_matrix_rows_follow_first_batch():
+    scores = pairwise_similarity(["AC"], ["DE"], helix_vs_coil_array)
+    # A=0, C=4, D=3, E=5 in the canonical order
+    expected = helix_vs_coil_array[0, 3] + helix_vs_coil_array[4, 5]
+    assert np.isclose(scores[0, 0], expected)
+
+def test_paired_similarity():
+    a = random_peptides(6, 9, seed=4)
+    b = random_peptides(6, 9, seed=5)
+    assert np.allclose(
+        paired_similarity(a, b, blosum62_matrix),
+        np.diag(pairwise_similarity(a, b, blosum62_matrix)))
+
+def test_pairwise_similarity_length_mismatch():
+    with pytest.raises(ValueError):
+        pairwise_similarity(["SIINFEKL"], ["GILGFVFTL"], blosum62_matrix)
+    with pytest.raises(ValueError):
+        pairwise_similarity(["SIINFEKL", "GILGFVFTL"], ["SIINFEKL"], blosum62_matrix)
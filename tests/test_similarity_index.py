@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+
+from pepdata.blosum import blosum62_matrix
+from pepdata.pmbec import pmbec_matrix
+from pepdata import similarity_index
+from pepdata.similarity import pairwise_similarity
+from pepdata.similarity_index import SimilarityIndex
+
+def random_peptides(n, length, seed):
+    rng = np.random.RandomState(seed)
+    letters = np.array(list("ACDEFGHIKLMNPQRSTVWY"))
+    return ["".join(rng.choice(letters, length)) for _ in range(n)]
+
+def brute_force(query, peptides, matrix, k=None, threshold=None):
+    peptides = sorted(set(p for p in peptides if len(p) == len(query)))
+    scores = pairwise_similarity([query], peptides, matrix, dtype="float64")[0]
+    results = sorted(zip(peptides, scores.tolist()), key=lambda x: (-x[1], x[0]))
+    if threshold is not None:
+        results = [(p, s) for (p, s) in results if s >= threshold]
+    if k is not None:
+        results = results[:k]
+    return results
+
+@pytest.fixture
+def peptides():
+    return random_peptides(900, 9, seed=0) + random_peptides(300, 8, seed=1)
+
+def test_similarity_index_top_k_is_exact(peptides):
+    index = SimilarityIndex(peptides)
+    assert len(index.groups[9].orders) > 1
+    for query in random_peptides(10, 9, seed=2) + peptides[:3]:
+        assert index.query(query, k=5) == brute_force(query, peptides, blosum62_matrix, k=5)
+
+def test_similarity_index_threshold_is_exact(peptides):
+    index = SimilarityIndex(peptides)
+    for query in random_peptides(5, 8, seed=3):
+        assert index.query(query, k=None, threshold=5, matrix=pmbec_matrix) == \
+            brute_force(query, peptides, pmbec_matrix, threshold=5)
+
+def test_similarity_index_search_many(peptides):
+    index = SimilarityIndex(peptides)
+    queries = random_peptides(3, 9, seed=4) + ["SIINF"]
+    df = index.search(queries, k=2)
+    assert list(df.columns) == ["query", "match", "score"]
+    assert len(df) == 6
+
+def test_similarity_index_search_matches_queries(peptides):
+    index = SimilarityIndex(peptides)
+    queries = random_peptides(20, 9, seed=6) + random_peptides(20, 8, seed=7)
+    queries = queries[::2] + peptides[:4] + queries[1::2]
+    for kwargs in [dict(k=3), dict(k=None, threshold=15), dict(k=2, threshold=20)]:
+        df = index.search(queries, **kwargs)
+        expected = [
+            (query, match, score)
+            for query in queries
+            for (match, score) in index.query(query, **kwargs)
+        ]
+        assert list(df.itertuples(index=False, name=None)) == expected
+
+def test_similarity_index_scores_few_peptides(monkeypatch):
+    peptides = random_peptides(20000, 9, seed=8)
+    index = SimilarityIndex(peptides)
+    scored = []
+    score_rows = similarity_index._LengthGroup.score_rows
+
+    def counting_score_rows(self, query_scores, queries, rows):
+        scored.append(len(rows))
+        return score_rows(self, query_scores, queries, rows)
+
+    monkeypatch.setattr(similarity_index._LengthGroup, "score_rows", counting_score_rows)
+    queries = random_peptides(20, 9, seed=9)
+    df = index.search(queries, k=None, threshold=30)
+    assert sum(scored) < 0.02 * len(queries) * len(peptides)
+    for query in queries[:5]:
+        assert df[df["query"] == query][["match", "score"]].values.tolist() == \
+            [list(match) for match in brute_force(query, peptides, blosum62_matrix, threshold=30)]
+
+def test_similarity_index_incremental_update(peptides):
+    index = SimilarityIndex(peptides)
+    group_8 = index.groups[8]
+    new_peptides = peptides[100:] + random_peptides(50, 9, seed=5) + ["SIINFEKLX"]
+    index.update(new_peptides)
+    assert index.groups[8] is group_8
+    assert index.peptides == set(p for p in new_peptides if "X" not in p)
+    assert peptides[0] not in index
+    index.remove(peptides[950:1000])
+    index.add(["SIINFEKL"])
+    assert "SIINFEKL" in index
+    assert peptides[960] not in index
+
+def test_similarity_index_save_load(peptides, tmp_path):
+    index = SimilarityIndex(peptides)
+    path = str(tmp_path / "index.npz")
+    index.save(path)
+    loaded = SimilarityIndex.load(path)
+    assert loaded.peptides == index.peptides
+    query = peptides[7]
+    assert loaded.query(query, k=3) == index.query(query, k=3)